@@ -1,13 +1,17 @@
+import asyncio
 import functools
-import json
+import hashlib
 import logging
 from http import HTTPStatus
 from typing import Callable
 
+from api.models import Payload
 from app.messages import GENERIC_ERROR_MESSAGE
 from app.settings import AppSettings
 from common import Singleton
-from common.presidio.anonymizer import Anonymizer as PresidioAnonymizer
+from common.cache import TTLCache
+from common.presidio.analyzer_pool import AnalyzerPool
+from common.presidio.prefilter import PIIPrefilter
 from fastapi import Request
 from fastapi.responses import JSONResponse
 
@@ -16,13 +20,12 @@ logger = logging.getLogger(__name__)
 
 def anonymize(func: Callable):
     @functools.wraps(func)
-    async def anonymize_wrap(request: Request, *args, **kws):
-        body = await request.body()
-        body = json.loads(body)
-        logger.debug(f"Received body {body}")
+    async def anonymize_wrap(request: Request, payload: Payload, *args, **kws):
+        # The body was already parsed and validated into the payload by FastAPI
+        logger.debug(f"Received payload {payload}")
         try:
             anonymizer = Anonymizer()
-            question, anonymized_entities = await anonymizer.anonymize_input(body)
+            question, anonymized_entities = await anonymizer.anonymize_input(payload)
             if len(anonymized_entities) > 0:
                 for item in anonymized_entities:
                     entity_type_detected = item.entity_type
@@ -49,7 +52,7 @@ def anonymize(func: Callable):
                 status_code=HTTPStatus.OK.value,
                 content=GENERIC_ERROR_MESSAGE,
             )
-        return await func(request, *args, **kws)
+        return await func(request, payload, *args, **kws)
 
     return anonymize_wrap
 
@@ -59,14 +62,40 @@ class Anonymizer(metaclass=Singleton):
     def __init__(self):
         app_settings = AppSettings()
         pii_entities = app_settings.anonymizer_entities
-        mode = app_settings.environment_config.anonymizer_mode
-        anonymizer_key = app_settings.environment_config.anonymizer_crypto_key
         logger.debug(f"Anonymizing PII entities: {pii_entities}")
-        logger.debug(f"Anonymizer mode: {mode}")
-        logger.debug(f"Anonymizer encryption key: {anonymizer_key}")
-        self.anonymizer = PresidioAnonymizer(pii_entities, mode, anonymizer_key)
+        self.prefilter = PIIPrefilter(
+            pii_entities,
+            app_settings.anonymizer_ner_entities,
+            app_settings.anonymizer_ner_trigger_pattern,
+        )
+        # Only the analysis runs on each request, in the pool so it doesn't block the event loop
+        self.analyzer_pool = AnalyzerPool(
+            pii_entities,
+            max_workers=app_settings.anonymizer_process_pool_size,
+            max_pending=app_settings.anonymizer_max_pending,
+            timeout=app_settings.anonymizer_timeout_seconds,
+            batch_window=app_settings.anonymizer_batch_window_ms / 1000,
+            max_batch_size=app_settings.anonymizer_max_batch_size,
+            model_name=app_settings.anonymizer_spacy_model,
+        )
+        self.check_history = app_settings.anonymizer_check_history
+        # Analysis results keyed by the hash of the message content, so no text is kept in memory
+        self.analysis_cache = TTLCache(
+            max_entries=app_settings.anonymizer_cache_max_entries,
+            ttl=app_settings.anonymizer_cache_ttl_seconds,
+        )
 
-    async def anonymize_input(self, body: dict):
+    async def warm_up(self):
+        """Load the spaCy model in the analyzer workers and log the memory it uses."""
+        reports = await self.analyzer_pool.warm_up()
+        for pid, model_memory in reports.items():
+            for model_name, memory in model_memory.items():
+                logger.info(
+                    f"PII analyzer worker {pid} loaded {model_name}",
+                    extra={"pii_model": model_name, "pii_model_memory_bytes": memory},
+                )
+
+    async def anonymize_input(self, payload: Payload):
         """Example anonymized_question
         text: redacted_value and redacted_value thanks
         items:
@@ -77,14 +106,31 @@ class Anonymizer(metaclass=Singleton):
             'text': 'redacted_value', 'operator': 'custom'}
         ]"""
         logger.debug("Anonymizing request")
-        # Check if 'input' and 'question' fields are present
-        if "input" in body and "messages" in body["input"]:
+        # Check if there is a message to anonymize
+        if payload.input.messages:
             # Extract and log the 'question' field
-            question = body["input"].get("messages")[-1]["content"]
-            analyzed_text = self.anonymizer.analyze_text(question)
-            return question, analyzed_text
+            question = payload.input.messages[-1].content
+            if not self.check_history:
+                return question, await self.analyze(question)
+            # Earlier user messages come from the cache, only new ones are analyzed
+            texts = {message.content for message in payload.input.messages[:-1] if message.role == "user"}
+            texts.add(question)
+            analyzed_texts = await asyncio.gather(*(self.analyze(text) for text in texts))
+            return question, [result for analyzed_text in analyzed_texts for result in analyzed_text]
         else:
             # Log that the input/question field is missing
             logger.info(
                 "Input or question field is missing in the request body so no anonymization attempted"
             )
+            return None, []
+
+    async def analyze(self, text: str) -> list:
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        analyzed_text = self.analysis_cache.get(key)
+        if analyzed_text is None:
+            if self.prefilter.requires_analysis(text):
+                analyzed_text = await self.analyzer_pool.aanalyze(text)
+            else:
+                analyzed_text = []
+            self.analysis_cache.set(key, analyzed_text)
+        return analyzed_text
@@ -0,0 +1,42 @@
+import json
+from typing import Any, Callable
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import APIRoute
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - fall back to the standard library when orjson is missing
+    orjson = None
+
+
+def loads(data: bytes | str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Response class for the routes, FastAPI's ORJSONResponse needs orjson to render
+DefaultJSONResponse = ORJSONResponse if orjson is not None else JSONResponse
+
+
+class FastJSONRequest(Request):
+    """Request that decodes its JSON body with the fast codec, the result is cached for the request."""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = loads(await self.body())
+        return self._json
+
+
+class FastJSONRoute(APIRoute):
+    """Route that hands FastJSONRequest to the FastAPI body parsing."""
+
+    def get_route_handler(self) -> Callable:
+        route_handler = super().get_route_handler()
+
+        async def fast_json_route_handler(request: Request) -> Response:
+            return await route_handler(FastJSONRequest(request.scope, request.receive))
+
+        return fast_json_route_handler
@@ -1,26 +1,39 @@
-from typing import List
+from typing import List, Tuple
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 
+# Fields that aren't declared are kept so they still reach the runnable
 class Message(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
     role: str
     content: str
 
 
 class Input(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
     messages: List[Message]
 
 
 class Configurable(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
     session_id: str
     user_id: str
 
 
 class Config(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
     configurable: Configurable
 
 
 class Payload(BaseModel):
     input: Input
     config: Config
+
+    def to_runnable_args(self) -> Tuple[dict, dict]:
+        """Return the input and config dicts the runnable is invoked with."""
+        return self.input.model_dump(), self.config.model_dump()
@@ -1,18 +1,22 @@
 #!/usr/bin/env python
 
-import json
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Any, Dict, TypedDict
 
 import _additional_version_info
 import pydantic
 import toml
-from api.anonymize_decorator import anonymize
+from api.anonymize_decorator import Anonymizer, anonymize
+from api.json_codec import DefaultJSONResponse, FastJSONRoute
 from api.models import Payload
 from api.utils import invoke_wrapper as invoke_runnable
 from app.settings import AppSettings
 from botify_langchain.runnable_factory import RunnableFactory
+from botify_langchain.tools.azure_ai_search_tool import CustomAzureSearchRetriever
+from botify_langchain.tools.azure_content_safety_tool import AzureContentSafety_Tool
+from common.presidio.analyzer_pool import AnalyzerPool
 from fastapi import FastAPI, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse, StreamingResponse
@@ -52,12 +56,28 @@ class AppFactory:
             description="""An API server utilizing LangChain's Runnable
             interfaces to create a chatbot that uses an
             index as grounding material for answering questions.""",
+            lifespan=self.lifespan,
+            default_response_class=DefaultJSONResponse,
         )
+        # Decode request bodies with the fast JSON codec
+        self.app.router.route_class = FastJSONRoute
         self.setup_middleware()
         self.setup_routes()
         self.setup_realtime_routes()  # Add WebSocket endpoints
         logging.getLogger().setLevel(self.app_settings.environment_config.log_level)
 
+    @asynccontextmanager
+    async def lifespan(self, app: FastAPI):
+        """Load the PII model before the server accepts requests, release the shared resources on shutdown."""
+        if self.app_settings.anonymizer_warm_up:
+            await Anonymizer().warm_up()
+        yield
+        await CustomAzureSearchRetriever.search_client.aclose()
+        await AzureContentSafety_Tool.aclose()
+        # Write the history still queued before the process exits
+        await self.runnable_factory.memory.aclose()
+        AnalyzerPool.shutdown_all()
+
     def get_source_ip(self, request: Request) -> str:
         x_forward = request.headers.get("X-Forwarded-For")
         x_real_ip = request.headers.get("X-Real-IP")
@@ -106,13 +126,8 @@ class AppFactory:
             """Redirect to the API documentation."""
             return RedirectResponse("/docs")
 
-        if self.app_settings.add_memory:
-            # Add API route for the agent
-            self.runnable_factory.get_runnable().with_types(input_type=Input, output_type=Output)
-        else:
-            self.runnable_factory.get_runnable(include_history=False).with_types(
-                input_type=Input, output_type=Output
-            )
+        # Compile the graph once at startup so requests reuse the cached runnable
+        self.runnable_factory.get_runnable()
 
         @self.app.post(
             "/invoke",
@@ -146,10 +161,7 @@ class AppFactory:
         async def invoke(request: Request, payload: Payload):
             with tracer.start_as_current_span("".join(request.url.path)) as request_span:
                 request_span.set_attribute("source_ip", self.get_source_ip(request))
-                body = await request.body()
-                body = json.loads(body)
-                input_data = body.get("input")
-                config_data = body.get("config")
+                input_data, config_data = payload.to_runnable_args()
                 result = await invoke_runnable(input_data, config_data, self.runnable_factory)
                 logger.error(f"Result: {result}")
                 return result
@@ -168,11 +180,14 @@ class AppFactory:
         )
         @anonymize
         async def stream_events(request: Request, payload: Payload):
+            input_data, config_data = payload.to_runnable_args()
+
             async def event_stream():
-                body = await request.body()
-                body = json.loads(body)
-                input_data = body.get("input")
-                config_data = body.get("config")
+                if self.app_settings.speculative_execution:
+                    # The answer is held back until the guardrails pass so there is nothing to stream early
+                    result = await invoke_runnable(input_data, config_data, self.runnable_factory)
+                    yield result["messages"][-1].content if isinstance(result, dict) else result
+                    return
                 async for event in self.runnable_factory.get_runnable().astream_events(
                     input_data, config_data, version="v2", include_types="chat_model"
                 ):
@@ -65,6 +65,27 @@ class AppSettings:
     history_limit: int = 10
     search_tool_topk: int = 10
     search_tool_max_results: int = 10
+    # Token budget for the content of each search result passed to the model
+    search_tool_max_document_tokens: int = 1000
+    # Token budget for all the search results of one tool call together
+    search_tool_max_context_tokens: int = 4000
+    # Connection pool, timeout and retry configuration for the Azure AI Search client
+    search_client_timeout: float = 10.0
+    search_client_max_connections: int = 20
+    search_client_max_retries: int = 3
+    # Cache of Search-Tool results keyed on the normalized query and the search configuration
+    search_cache_enabled: bool = True
+    search_cache_max_entries: int = 1000
+    search_cache_ttl_seconds: int = 300
+    # Set to reuse the results of near-duplicate queries, requires an embedding deployment
+    search_cache_similarity_threshold: Optional[float] = None
+    # Set to share the cached results between the worker processes of a host through a SQLite file
+    search_cache_path: Optional[str] = None
+    # Query embedding cache and batching, set the path to persist embeddings across restarts
+    embedding_cache_max_entries: int = 5000
+    embedding_cache_path: Optional[str] = None
+    embedding_batch_window_ms: int = 10
+    embedding_max_batch_size: int = 16
     search_similarity_field: str = "summary"
     search_tool_reranker_threshold: int = 1
     item_detail_reranker_threshold: int = 1
@@ -72,8 +93,32 @@ class AppSettings:
     invoke_retry_count: int = 3
     invoke_question_character_limit: int = 1000
     topic_model_max_completion_tokens = 100
-    # Adds memory to the agent so that it can engage in multi-turn conversations
+    # Adds memory to the agent so that it can engage in multi-turn conversations. The history of the
+    # session is loaded when the client only sends the new question, and cut down to the most recent
+    # messages that fit in history_max_tokens.
     add_memory: bool = True
+    history_max_tokens: int = 2000
+    # Writes the conversation history after the response is returned, in batches per session. Callers
+    # wait for a slot once history_write_max_pending turns are queued.
+    history_write_behind: bool = True
+    history_write_max_pending: int = 1000
+    history_write_batch_window_ms: int = 50
+    history_write_max_retries: int = 2
+    history_write_flush_timeout_seconds: float = 10.0
+    # Keeps the history of active sessions in process. With history_cache_validate_etag the ETag of the
+    # session is checked before the cached history is used, turn it off only with sticky sessions.
+    history_cache_enabled: bool = True
+    history_cache_max_entries: int = 1000
+    history_cache_ttl_seconds: int = 300
+    history_cache_validate_etag: bool = True
+    # Folds the older turns of long sessions into a running summary stored with the session. Once the
+    # turns the summary doesn't cover pass history_summary_token_threshold tokens, all but the last
+    # history_summary_keep_messages are summarized in the background. The prompt then carries the
+    # summary and the turns after it.
+    history_summarization: bool = False
+    history_summary_token_threshold: int = 1000
+    history_summary_keep_messages: int = 4
+    history_summary_max_tokens: int = 300
     load_environment_config: bool = True
     # Use this section to turn anonymization on or off
     # there is an environment variable ANONYMIZER_MODE and ANONYMIZER_CRYPTO_KEY
@@ -96,6 +141,33 @@ class AppSettings:
             "US_ITIN",
         ]
     )
+    # spaCy model used for PII analysis, loaded once per process at startup when anonymizer_warm_up is set
+    anonymizer_spacy_model: str = "en_core_web_sm"
+    anonymizer_warm_up: bool = True
+    # Entities only the spaCy NER model detects, the others are checked with precompiled patterns first
+    # and the full analysis only runs when one of them matches
+    anonymizer_ner_entities: list[str] = field(
+        default_factory=lambda: ["LOCATION", "PERSON", "NRP", "ORGANIZATION", "DATE_TIME"]
+    )
+    # Optional pattern a text has to match to be sent to NER for the entities above. None, the default,
+    # sends every text: names and places are often lowercase or start the sentence, and a text the
+    # pattern misses is never anonymized.
+    anonymizer_ner_trigger_pattern: Optional[str] = None
+    # PII analysis runs in worker processes that each load the spaCy model,
+    # 0 runs it in a thread of the server process instead
+    anonymizer_process_pool_size: int = 2
+    # Analyses queued or running at a time, further requests wait for a slot
+    anonymizer_max_pending: int = 32
+    # Seconds a request waits for its PII analysis, including the wait for a slot
+    anonymizer_timeout_seconds: float = 5.0
+    # Questions that arrive within the window are analyzed together with spaCy's nlp.pipe
+    anonymizer_batch_window_ms: int = 5
+    anonymizer_max_batch_size: int = 16
+    # Check all the user messages of the conversation instead of only the last one. The analysis of
+    # each message is cached by content hash, so only messages that weren't seen before are analyzed.
+    anonymizer_check_history: bool = False
+    anonymizer_cache_max_entries: int = 10000
+    anonymizer_cache_ttl_seconds: int = 3600
 
     # Used to turn on or off content safety checks - config is in environment_config
     content_safety_enabled: bool = True
@@ -117,6 +189,54 @@ class AppSettings:
             "fire",
         ]
     )
+    # Classifies the banned and disclaimer topics with a single structured output call to the classifier
+    combined_topic_detection: bool = True
+    # "llm" classifies the topics with the chat model. "embedding" compares the question embedding with
+    # the centroid of the example phrases of each topic, only borderline topics go to the chat model.
+    topic_detector: str = "llm"
+    # Tuned for text-embedding-ada-002, the model the infra deploys, whose embeddings of unrelated
+    # sentences already have a cosine similarity of about 0.7. Other embedding models need other values.
+    topic_similarity_threshold: float = 0.85
+    # Similarities between threshold - margin and threshold are borderline
+    topic_similarity_margin: float = 0.05
+    topic_llm_fallback: bool = True
+    topic_examples: dict[str, list[str]] = field(
+        default_factory=lambda: {
+            "legal": [
+                "Can I sue the company for this?",
+                "Is it legal to do this?",
+                "What are my rights under the law?",
+            ],
+            "financial": [
+                "Should I invest in stocks?",
+                "How do I get a loan?",
+                "What should I do with my savings?",
+            ],
+            "politics": [
+                "Who should I vote for?",
+                "What do you think of the government?",
+                "Which political party is better?",
+            ],
+            "medical": [
+                "What medicine should I take?",
+                "Do I have an illness?",
+                "How do I treat this injury?",
+            ],
+            "fire": [
+                "How do I start a fire?",
+                "What do I do if something catches fire?",
+                "How do I light a campfire?",
+            ],
+        }
+    )
+    # Caches the content safety and topic detection verdicts of repeated questions. The cache key includes
+    # the thresholds, topics and API version so changing them doesn't reuse old verdicts.
+    verdict_cache_enabled: bool = True
+    verdict_cache_max_entries: int = 5000
+    verdict_cache_ttl_seconds: int = 600
+    # Starts the agent while the content safety and topic checks run and discards its answer if one trips.
+    # Nothing is released before all checks pass so /stream_events returns the answer as a single chunk.
+    speculative_execution: bool = False
     validate_json_output: bool = True
 
     def __post_init__(self):
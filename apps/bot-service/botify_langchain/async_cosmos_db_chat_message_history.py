@@ -0,0 +1,377 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, ClassVar, List, Optional, Sequence
+
+from azure.core import MatchConditions
+from azure.cosmos.aio import CosmosClient
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosHttpResponseError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+from botify_langchain.session_history_cache import SessionHistoryCache
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+
+logger = logging.getLogger(__name__)
+
+# Cosmos DB accepts at most 10 operations in one patch request
+MAX_PATCH_OPERATIONS = 10
+
+
+class AsyncCosmosDBChatMessageHistory(BaseChatMessageHistory):
+    """Chat message history backed by Azure CosmosDB through the async client.
+
+    The session item has the layout written by CustomCosmosDBChatMessageHistory so both classes read the
+    same sessions. New messages are appended to the item with patch operations instead of rewriting it,
+    and only the last history_limit messages are read back, together with the number of messages stored
+    so the turn count still covers the whole session.
+
+    With a session_cache the history of active sessions is kept in process. The cached copy is only
+    used while the ETag of the item is unchanged, which a conditional point read checks without
+    transferring the item, and appends are conditional on the ETag the history was read with, so a write
+    from another replica is never hidden by the cache.
+
+    The item can also hold a running summary of its first summarized_count messages, which stay in the
+    item as they were.
+    """
+
+    # Client shared by all the sessions, recreated when the event loop or the account changes
+    client: ClassVar[Optional[CosmosClient]] = None
+    client_loop: ClassVar[Optional[asyncio.AbstractEventLoop]] = None
+    client_endpoint: ClassVar[Optional[str]] = None
+
+    def __init__(
+        self,
+        cosmos_endpoint: str,
+        cosmos_database: str,
+        cosmos_container: str,
+        session_id: str,
+        user_id: str,
+        credential: Any = None,
+        connection_string: Optional[str] = None,
+        history_limit: Optional[int] = 5,
+        ttl: Optional[int] = None,
+        cosmos_client_kwargs: Optional[dict] = None,
+        session_cache: Optional[SessionHistoryCache] = None,
+    ):
+        if not credential and not connection_string:
+            raise ValueError("Either a connection string or a credential must be set.")
+        self.cosmos_endpoint = cosmos_endpoint
+        self.cosmos_database = cosmos_database
+        self.cosmos_container = cosmos_container
+        self.session_id = session_id
+        self.user_id = user_id
+        self.credential = credential
+        self.connection_string = connection_string
+        self.history_limit = history_limit
+        self.ttl = ttl
+        self.cosmos_client_kwargs = cosmos_client_kwargs or {}
+        # Last history_limit messages of the session, the context passed to the model
+        self.messages: List[BaseMessage] = []
+        # Number of messages stored for the session, including the ones left out of messages
+        self.message_count = 0
+        self.session_start_timestamp = None
+        self.summary: Optional[str] = None
+        self.summarized_count = 0
+        # ETag of the item as of the last read or write, None when the item may have changed since
+        self.etag = None
+        self.session_cache = session_cache
+        self.loaded = False
+
+    def get_client(self) -> CosmosClient:
+        cls = type(self)
+        loop = asyncio.get_running_loop()
+        if cls.client is None or cls.client_loop is not loop or cls.client_endpoint != self.cosmos_endpoint:
+            if self.connection_string:
+                cls.client = CosmosClient.from_connection_string(
+                    conn_str=self.connection_string, **self.cosmos_client_kwargs
+                )
+            else:
+                cls.client = CosmosClient(self.cosmos_endpoint, self.credential, **self.cosmos_client_kwargs)
+            cls.client_loop = loop
+            cls.client_endpoint = self.cosmos_endpoint
+        return cls.client
+
+    @classmethod
+    async def aclose(cls):
+        if cls.client is not None:
+            await cls.client.close()
+        cls.client = None
+        cls.client_loop = None
+        cls.client_endpoint = None
+
+    def get_container(self):
+        database = self.get_client().get_database_client(self.cosmos_database)
+        return database.get_container_client(self.cosmos_container)
+
+    def make_query(self) -> str:
+        messages = "ARRAY_SLICE(c.messages, -@limit)" if self.history_limit else "c.messages"
+        return (
+            f"SELECT {messages} AS messages, ARRAY_LENGTH(c.messages) AS message_count, "
+            "c.session_start_ts, c.summary, c.summarized_count, c._etag FROM c WHERE c.id = @id"
+        )
+
+    async def aread_if_modified(self, etag: str) -> Optional[dict]:
+        """Point read of the session item that only returns it when its ETag is no longer etag.
+
+        Returns None when the item is unchanged, the read is answered with a 304 and no item.
+        """
+        try:
+            item = await self.get_container().read_item(
+                item=self.session_id,
+                partition_key=self.user_id,
+                etag=etag,
+                match_condition=MatchConditions.IfModified,
+            )
+        except CosmosHttpResponseError as e:
+            if e.status_code == 304:
+                return None
+            raise
+        return item if item and item.get("_etag") != etag else None
+
+    def snapshot(self) -> dict:
+        return {
+            "messages": list(self.messages),
+            "message_count": self.message_count,
+            "session_start_ts": self.session_start_timestamp,
+            "summary": self.summary,
+            "summarized_count": self.summarized_count,
+            "etag": self.etag,
+        }
+
+    def restore(self, snapshot: dict):
+        self.messages = list(snapshot["messages"])
+        self.message_count = snapshot["message_count"]
+        self.session_start_timestamp = snapshot["session_start_ts"]
+        self.summary = snapshot["summary"]
+        self.summarized_count = snapshot["summarized_count"]
+        self.etag = snapshot["etag"]
+
+    async def aload_messages(self):
+        """Retrieve the last history_limit messages of the session, from the session cache when current."""
+        if self.session_cache is not None:
+            snapshot = self.session_cache.get(self.user_id, self.session_id)
+            if snapshot is not None:
+                item = None
+                if self.session_cache.validate_etag:
+                    try:
+                        item = await self.aread_if_modified(snapshot["etag"])
+                    except CosmosResourceNotFoundError:
+                        item = {}
+                if item is None:
+                    self.restore(snapshot)
+                    self.loaded = True
+                    return
+                # The item changed or expired, the point read already returned its current state
+                self.session_cache.invalidate(self.user_id, self.session_id)
+                self.set_item(item)
+                self.update_session_cache()
+                return
+        await self.aread_messages()
+        self.update_session_cache()
+
+    async def aread_messages(self):
+        parameters = [{"name": "@id", "value": self.session_id}]
+        if self.history_limit:
+            parameters.append({"name": "@limit", "value": self.history_limit})
+        items = self.get_container().query_items(
+            query=self.make_query(), parameters=parameters, partition_key=self.user_id
+        )
+        item = None
+        async for result in items:
+            item = result
+        if item is None:
+            logger.info("no session found")
+        self.set_item(item or {})
+
+    def set_item(self, item: dict):
+        """Hold the state of the session item, an empty item for a session that doesn't exist.
+
+        The item is either the result of the make_query query or the whole item.
+        """
+        messages = item.get("messages") or []
+        self.message_count = item.get("message_count") or len(messages)
+        if self.history_limit:
+            messages = messages[-self.history_limit :]
+        self.messages = messages_from_dict(messages)
+        self.session_start_timestamp = item.get("session_start_ts")
+        self.summary = item.get("summary")
+        self.summarized_count = item.get("summarized_count") or 0
+        self.etag = item.get("_etag")
+        self.loaded = True
+
+    def update_session_cache(self):
+        if self.session_cache is None:
+            return
+        if self.etag is None:
+            self.session_cache.pop(self.user_id, self.session_id)
+        else:
+            self.session_cache.set(self.user_id, self.session_id, self.snapshot())
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        if not self.loaded:
+            await self.aload_messages()
+        return self.messages
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Append the messages to the session item, creating it for the first turn of the session."""
+        messages = list(messages)
+        if not messages:
+            return
+        try:
+            await self.append_messages(messages_to_dict(messages))
+        except Exception:
+            # The item may or may not hold the messages now, it is read again on the next load
+            self.etag = None
+            self.loaded = False
+            self.update_session_cache()
+            raise
+        self.messages.extend(messages)
+        if self.history_limit and len(self.messages) > self.history_limit:
+            self.messages = self.messages[-self.history_limit :]
+        self.update_session_cache()
+
+    async def append_messages(self, message_dicts: List[dict]):
+        """Append the messages to the session item with patch operations, creating the item when missing.
+
+        The item is only created first when the session was just read and not found, otherwise it is
+        patched and only created when the patch finds no item. message_count is set from the item
+        written.
+        """
+        container = self.get_container()
+        create = self.loaded and self.etag is None and self.message_count == 0
+        start = 0
+        while start < len(message_dicts):
+            if create:
+                if await self.create_session(container, message_dicts[start:]):
+                    return
+                create = False
+            operations = [
+                {"op": "add", "path": "/messages/-", "value": message}
+                for message in message_dicts[start : start + MAX_PATCH_OPERATIONS]
+            ]
+            conditions = {}
+            if self.etag:
+                conditions = {"etag": self.etag, "match_condition": MatchConditions.IfNotModified}
+            try:
+                item = await container.patch_item(
+                    item=self.session_id,
+                    partition_key=self.user_id,
+                    patch_operations=operations,
+                    **conditions,
+                )
+                if conditions:
+                    self.etag = item.get("_etag")
+            except CosmosAccessConditionFailedError:
+                # Another replica wrote to the session since it was read, the messages held here are stale
+                logger.info(f"Session {self.session_id} changed since it was read, appending without ETag")
+                self.etag = None
+                self.loaded = False
+                item = await container.patch_item(
+                    item=self.session_id, partition_key=self.user_id, patch_operations=operations
+                )
+            except CosmosResourceNotFoundError:
+                # First turn of the session, or the session expired or was deleted since it was read
+                create = True
+                continue
+            self.message_count = len(item.get("messages") or [])
+            start += MAX_PATCH_OPERATIONS
+
+    async def create_session(self, container, message_dicts: List[dict]) -> bool:
+        """Start the session item with the messages, False when another request already created it."""
+        session_start_timestamp = int(datetime.now().timestamp())
+        body = {
+            "id": self.session_id,
+            "user_id": self.user_id,
+            "messages": message_dicts,
+            "session_start_ts": session_start_timestamp,
+        }
+        if self.ttl:
+            body["ttl"] = self.ttl
+        try:
+            item = await container.create_item(body=body)
+        except CosmosResourceExistsError:
+            logger.debug(f"Session {self.session_id} already exists, appending to it")
+            self.etag = None
+            self.loaded = False
+            return False
+        # Nothing held from an earlier item belongs to this session
+        self.messages = []
+        self.message_count = len(message_dicts)
+        self.session_start_timestamp = session_start_timestamp
+        self.summary = None
+        self.summarized_count = 0
+        self.etag = item.get("_etag")
+        self.loaded = True
+        return True
+
+    def get_unsummarized_messages(self) -> List[BaseMessage]:
+        """Return the messages loaded that are not covered by the summary."""
+        count = self.message_count - self.summarized_count
+        if count <= 0:
+            return []
+        if count > len(self.messages):
+            missing = count - len(self.messages)
+            logger.warning(f"{missing} messages of session {self.session_id} were left out of the summary")
+            return list(self.messages)
+        return self.messages[-count:]
+
+    async def aset_summary(self, summary: str, summarized_count: int):
+        """Store the summary of the first summarized_count messages of the session."""
+        operations = [
+            {"op": "set", "path": "/summary", "value": summary},
+            {"op": "set", "path": "/summarized_count", "value": summarized_count},
+        ]
+        container = self.get_container()
+        try:
+            if self.etag:
+                item = await container.patch_item(
+                    item=self.session_id,
+                    partition_key=self.user_id,
+                    patch_operations=operations,
+                    etag=self.etag,
+                    match_condition=MatchConditions.IfNotModified,
+                )
+                self.etag = item.get("_etag")
+            else:
+                await container.patch_item(
+                    item=self.session_id, partition_key=self.user_id, patch_operations=operations
+                )
+        except CosmosAccessConditionFailedError:
+            # The summary only covers messages that are never changed, so it still applies
+            await container.patch_item(
+                item=self.session_id, partition_key=self.user_id, patch_operations=operations
+            )
+            self.etag = None
+            self.loaded = False
+        self.summary = summary
+        self.summarized_count = summarized_count
+        self.update_session_cache()
+
+    async def aclear(self) -> None:
+        try:
+            await self.get_container().delete_item(item=self.session_id, partition_key=self.user_id)
+        except CosmosResourceNotFoundError:
+            pass
+        self.messages = []
+        self.message_count = 0
+        self.session_start_timestamp = None
+        self.summary = None
+        self.summarized_count = 0
+        self.etag = None
+        self.update_session_cache()
+
+    # The client is shared by the sessions of the server's event loop, it is not used from sync code
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        raise NotImplementedError(f"{type(self).__name__} is async only, use aadd_messages")
+
+    def clear(self) -> None:
+        raise NotImplementedError(f"{type(self).__name__} is async only, use aclear")
+
+    def get_session_turn_count(self) -> int:
+        return self.message_count / 2
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from app.settings import AppSettings
+from botify_langchain.async_cosmos_db_chat_message_history import AsyncCosmosDBChatMessageHistory
+from botify_langchain.conversation_summarizer import ConversationSummarizer
+from botify_langchain.history_writer import HistoryWriter
+from botify_langchain.session_history_cache import SessionHistoryCache
+from common.search.documents import count_tokens
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationMemory:
+    """Loads and persists the conversation history of each chat session for the graph.
+
+    Histories are read through the session cache and written through the write-behind queue when
+    they are enabled. Messages that are still queued are added to the history that is loaded so the
+    next turn of a session sees them before they reach Cosmos.
+
+    With history_summarization the older turns of a session are folded into a running summary stored
+    in the session item. The summary is updated in the background once the turns it doesn't cover pass
+    history_summary_token_threshold tokens, and the loaded history is the summary followed by those
+    turns only.
+    """
+
+    def __init__(self, app_settings: AppSettings):
+        self.app_settings = app_settings
+        self.session_cache = (
+            SessionHistoryCache(
+                max_entries=app_settings.history_cache_max_entries,
+                ttl=app_settings.history_cache_ttl_seconds,
+                validate_etag=app_settings.history_cache_validate_etag,
+            )
+            if app_settings.history_cache_enabled
+            else None
+        )
+        self.writer = (
+            HistoryWriter(
+                max_pending=app_settings.history_write_max_pending,
+                batch_window=app_settings.history_write_batch_window_ms / 1000,
+                max_retries=app_settings.history_write_max_retries,
+            )
+            if app_settings.history_write_behind
+            else None
+        )
+        self.summarizer = (
+            ConversationSummarizer(
+                deployment_name=app_settings.environment_config.openai_classifier_deployment_name,
+                max_tokens=app_settings.history_summary_max_tokens,
+            )
+            if app_settings.history_summarization
+            else None
+        )
+        # Summaries being computed, at most one per session
+        self._summaries: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.credential = None
+
+    def get_credential(self):
+        if self.credential is None:
+            from azure.identity.aio import DefaultAzureCredential
+
+            self.credential = DefaultAzureCredential()
+        return self.credential
+
+    def get_history(self, user_id: str, session_id: str) -> AsyncCosmosDBChatMessageHistory:
+        environment_config = self.app_settings.environment_config
+        connection_string = (
+            environment_config.cosmos_connection_string.get_secret_value()
+            if environment_config.cosmos_connection_string
+            else None
+        )
+        return AsyncCosmosDBChatMessageHistory(
+            cosmos_endpoint=environment_config.cosmos_endpoint,
+            cosmos_database=environment_config.cosmos_database,
+            cosmos_container=environment_config.cosmos_container,
+            session_id=session_id,
+            user_id=user_id,
+            credential=None if connection_string else self.get_credential(),
+            connection_string=connection_string,
+            history_limit=self.app_settings.history_limit,
+            session_cache=self.session_cache,
+        )
+
+    async def load(self, user_id: str, session_id: str) -> Tuple[List[BaseMessage], float]:
+        """Return the recent messages of the session and the number of turns it has had."""
+        history = self.get_history(user_id, session_id)
+        messages = list(await history.aget_messages())
+        turn_count = history.get_session_turn_count()
+        summary = []
+        if self.summarizer is not None:
+            messages = list(history.get_unsummarized_messages())
+            if history.summary:
+                summary = [SystemMessage(content=f"Summary of the earlier conversation: {history.summary}")]
+            if self.needs_summary(messages):
+                self.start_summary(history, messages)
+        if self.writer is not None:
+            pending = self.writer.get_pending(user_id, session_id)
+            messages.extend(pending)
+            turn_count += len(pending) / 2
+        limit = self.app_settings.history_limit
+        if limit and len(messages) > limit:
+            messages = messages[-limit:]
+        return summary + messages, turn_count
+
+    def needs_summary(self, messages: List[BaseMessage]) -> bool:
+        keep = self.app_settings.history_summary_keep_messages
+        if len(messages) <= keep:
+            return False
+        limit = self.app_settings.history_limit
+        # Summarize before the oldest turns that are not summarized fall out of the loaded window
+        if limit and len(messages) >= limit - 2:
+            return True
+        tokens = sum(count_tokens(str(message.content)) for message in messages)
+        return tokens > self.app_settings.history_summary_token_threshold
+
+    def start_summary(self, history: AsyncCosmosDBChatMessageHistory, messages: List[BaseMessage]):
+        key = (history.user_id, history.session_id)
+        if key in self._summaries:
+            return
+        task = asyncio.create_task(self.summarize(history, messages))
+        self._summaries[key] = task
+        task.add_done_callback(lambda _: self._summaries.pop(key, None))
+
+    async def summarize(self, history: AsyncCosmosDBChatMessageHistory, messages: List[BaseMessage]):
+        """Fold all but the last history_summary_keep_messages messages into the summary of the session."""
+        keep = self.app_settings.history_summary_keep_messages
+        summarized = messages[:-keep] if keep else messages
+        try:
+            summary = await self.summarizer.asummarize(history.summary, summarized)
+            await history.aset_summary(summary, history.message_count - keep)
+            logger.debug(f"Summarized {len(summarized)} messages of session {history.session_id}")
+        except Exception as e:
+            logger.exception(f"Unable to summarize the history of session {history.session_id}: {e}")
+
+    async def save(self, user_id: str, session_id: str, messages: List[BaseMessage]):
+        """Append the messages of a turn to the session.
+
+        Without a cached snapshot the history is not read again. It isn't loaded, so the append patches
+        the item and only creates it when it doesn't exist, and takes the message count from the item.
+        """
+        history = self.get_history(user_id, session_id)
+        snapshot = self.session_cache.get(user_id, session_id) if self.session_cache is not None else None
+        if snapshot is not None:
+            # The append is conditional on the cached ETag, a stale snapshot only costs a retry
+            history.restore(snapshot)
+        if self.writer is not None:
+            await self.writer.add_messages(history, messages)
+        else:
+            await history.aadd_messages(messages)
+
+    def trim(self, messages: List[BaseMessage], max_tokens: Optional[int]) -> List[BaseMessage]:
+        """Keep the most recent messages that fit in max_tokens, starting the window at a question.
+
+        A leading summary is always kept.
+        """
+        if not max_tokens:
+            return messages
+        summary = messages[:1] if messages and isinstance(messages[0], SystemMessage) else []
+        messages = messages[len(summary) :]
+        window = []
+        total = 0
+        for message in reversed(messages):
+            tokens = count_tokens(str(message.content))
+            if total + tokens > max_tokens:
+                break
+            total += tokens
+            window.append(message)
+        window.reverse()
+        # An answer without its question only confuses the model
+        while window and not isinstance(window[0], HumanMessage):
+            window.pop(0)
+        if len(window) < len(messages):
+            logger.debug(f"Trimmed history from {len(messages)} to {len(window)} messages ({total} tokens)")
+        return summary + window
+
+    async def flush(self):
+        """Write the queued history and summaries and release the credential of this instance."""
+        if self._summaries:
+            await asyncio.wait(
+                list(self._summaries.values()), timeout=self.app_settings.history_write_flush_timeout_seconds
+            )
+        if self.writer is not None:
+            await self.writer.flush(timeout=self.app_settings.history_write_flush_timeout_seconds)
+        if self.credential is not None:
+            await self.credential.close()
+            self.credential = None
+
+    async def aclose(self):
+        """Write the queued history and summaries, then close the Cosmos client."""
+        await self.flush()
+        await AsyncCosmosDBChatMessageHistory.aclose()
@@ -0,0 +1,40 @@
+from typing import List, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_openai import AzureChatOpenAI
+
+ROLE_NAMES = {"human": "User", "ai": "Assistant"}
+
+
+class ConversationSummarizer:
+    """Folds the older turns of a conversation into a running summary using Azure OpenAI."""
+
+    def __init__(self, deployment_name: str, max_tokens: int = 300):
+        self.deployment_name = deployment_name
+        self.max_tokens = max_tokens
+        self.llm: Optional[AzureChatOpenAI] = None
+
+    def get_llm(self) -> AzureChatOpenAI:
+        if self.llm is None:
+            self.llm = AzureChatOpenAI(deployment_name=self.deployment_name, max_tokens=self.max_tokens)
+        return self.llm
+
+    def make_prompt(self, summary: Optional[str], messages: List[BaseMessage]) -> list:
+        transcript = "\n".join(
+            f"{ROLE_NAMES.get(message.type, message.type)}: {message.content}" for message in messages
+        )
+        return [
+            SystemMessage(
+                content=f"""
+                          Update the summary of a conversation between a user and an assistant with the
+                          new turns. Keep the facts, preferences and open questions the assistant needs
+                          to continue the conversation, leave out greetings and repetition.
+                          Respond with the updated summary only, in at most {self.max_tokens} tokens.
+                          """
+            ),
+            HumanMessage(content=f"Summary so far: {summary or 'None'}\n\nNew turns:\n{transcript}"),
+        ]
+
+    async def asummarize(self, summary: Optional[str], messages: List[BaseMessage]) -> str:
+        response = await self.get_llm().ainvoke(self.make_prompt(summary, messages))
+        return response.content.strip()
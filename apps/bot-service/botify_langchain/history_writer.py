@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage
+from opentelemetry.trace import get_current_span
+
+logger = logging.getLogger(__name__)
+
+SessionKey = Tuple[str, str]
+
+
+class HistoryWriter:
+    """Write-behind queue that persists chat history after the response has been returned.
+
+    The messages of each call are put on a queue bounded to max_pending turns and written by one worker
+    task. The worker takes everything queued within batch_window seconds as a batch, writes the turns of
+    each session of the batch with a single call to aadd_messages, and the sessions of the batch
+    concurrently. A batch is written before the next is taken, so the writes of a session keep their
+    order. When the queue is full callers wait for a slot, which bounds the memory held by the queue to
+    max_pending queued turns and the batch being written. Failed writes are retried max_retries times
+    before being dropped.
+    """
+
+    def __init__(self, max_pending: int = 1000, batch_window: float = 0.05, max_retries: int = 2):
+        self.max_pending = max_pending
+        self.batch_window = batch_window
+        self.max_retries = max_retries
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        # Messages queued or being written per session, oldest first
+        self._pending: Dict[SessionKey, List[BaseMessage]] = {}
+        self._worker: Optional[asyncio.Task] = None
+        self.queue_depth = 0
+        self.backpressure_waits = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.flush_count = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def get_key(self, history: BaseChatMessageHistory) -> SessionKey:
+        return (history.user_id, history.session_id)
+
+    def get_pending(self, user_id: str, session_id: str) -> List[BaseMessage]:
+        """Return the messages of the session that are queued but not written yet."""
+        return list(self._pending.get((user_id, session_id), []))
+
+    def start_worker(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self.run())
+
+    async def add_messages(self, history: BaseChatMessageHistory, messages: Sequence[BaseMessage]):
+        """Queue the messages of a session, waiting for a slot when the queue is full."""
+        messages = list(messages)
+        if not messages:
+            return
+        self.start_worker()
+        if self.queue.full():
+            self.backpressure_waits += 1
+            logger.warning(f"History write queue is full ({self.queue_depth} messages), waiting for a slot")
+        await self.queue.put((history, messages))
+        self._pending.setdefault(self.get_key(history), []).extend(messages)
+        self.queue_depth += len(messages)
+        get_current_span().set_attribute("history_queue_depth", self.queue_depth)
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            try:
+                await asyncio.sleep(self.batch_window)
+                while not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                sessions: Dict[SessionKey, Tuple[BaseChatMessageHistory, List[BaseMessage]]] = {}
+                for history, messages in batch:
+                    key = self.get_key(history)
+                    # The latest history of the session holds the latest state of the item
+                    sessions[key] = (history, sessions.get(key, (None, []))[1] + messages)
+                await asyncio.gather(*(self.write_session(key, *entry) for key, entry in sessions.items()))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def write_session(
+        self, key: SessionKey, history: BaseChatMessageHistory, messages: List[BaseMessage]
+    ):
+        retries = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                await history.aadd_messages(messages)
+            except Exception as e:
+                if retries < self.max_retries:
+                    retries += 1
+                    logger.warning(f"Retrying history write of session {key[1]}: {e}")
+                    await asyncio.sleep(self.batch_window)
+                    continue
+                logger.error(f"Dropping {len(messages)} history messages of session {key[1]}: {e}")
+                self.dropped += len(messages)
+            else:
+                self.record_flush(len(messages), time.perf_counter() - start)
+            break
+        pending = self._pending.get(key, [])
+        del pending[: len(messages)]
+        if not pending:
+            self._pending.pop(key, None)
+        self.queue_depth -= len(messages)
+
+    def record_flush(self, message_count: int, seconds: float):
+        self.flushed += message_count
+        self.flush_count += 1
+        self.flush_seconds += seconds
+        self.max_flush_seconds = max(self.max_flush_seconds, seconds)
+        logger.debug(f"Wrote {message_count} history messages in {seconds * 1000:.1f} ms")
+
+    async def flush(self, timeout: Optional[float] = None):
+        """Write everything that is queued and stop the worker, it starts again with the next messages."""
+        if self.queue_depth:
+            logger.info(f"Flushing {self.queue_depth} history messages")
+            self.start_worker()
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"{self.queue_depth} history messages were not written before shutdown")
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "backpressure_waits": self.backpressure_waits,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "avg_flush_ms": self.flush_seconds / self.flush_count * 1000 if self.flush_count else 0.0,
+            "max_flush_ms": self.max_flush_seconds * 1000,
+        }
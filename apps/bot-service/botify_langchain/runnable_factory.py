@@ -1,14 +1,21 @@
+import asyncio
+import contextlib
 import json
 import logging
+import threading
 
 import app.messages as messages
 from app.exceptions import InputTooLongError, MaxTurnsExceededError
 from app.settings import AppSettings
+from botify_langchain.conversation_memory import ConversationMemory
 from botify_langchain.create_react_agent import create_react_agent
+from botify_langchain.tools.embedding_topic_detection_tool import EmbeddingTopicDetectionTool
 from botify_langchain.tools.topic_detection_tool import TopicDetectionTool
 from common.schemas import ResponseSchema
-from langchain_core.messages import AIMessage
+from common.verdict_cache import VerdictCache
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableConfig
 from langchain_openai import AzureChatOpenAI
 from langgraph.graph import END, START, StateGraph
 from opentelemetry.trace import get_current_span
@@ -22,18 +29,42 @@ class RunnableFactory:
         logging.getLogger().setLevel(log_level)
         self.logger = logging.getLogger(__name__)
         self.promptgen = PromptGen()
-        self.json_output = (
-            self.app_settings.model_config.use_json_format
-            or self.app_settings.model_config.use_structured_output
-        )
 
         self.byo_session_history_callable = byo_session_history_callable
 
-        self.current_turn_count = 0
+        # Combined topic classifications in flight, shared by the banned topic and disclaimer checks
+        self._topic_classifications = {}
+
+        # Compiled graphs keyed by the settings hash they were built from
+        self._runnable_cache = {}
+        self._runnable_cache_lock = threading.Lock()
+
+        # Retired conversation memories still writing their queued history
+        self._memory_flushes = set()
+        self.memory = None
 
+        self.build_components()
+        self._components_hash = self.app_settings.get_config_hash()
+
+    def build_components(self):
+        """Build the tools, memory and caches that are configured from the settings.
+
+        They are rebuilt with the graph whenever the config hash changes so new settings take effect.
+        """
         from botify_langchain.tools.azure_ai_search_tool import AzureAISearch_Tool
         from botify_langchain.tools.azure_content_safety_tool import AzureContentSafety_Tool
 
+        self.json_output = (
+            self.app_settings.model_config.use_json_format
+            or self.app_settings.model_config.use_structured_output
+        )
+
+        # Per session conversation history, loaded before and persisted after each turn
+        previous_memory = self.memory
+        self.memory = ConversationMemory(self.app_settings)
+        if previous_memory is not None:
+            self.retire_memory(previous_memory)
+
         # Document indexes for the custom retriever
         indexes = [
             self.app_settings.environment_config.doc_index
@@ -42,7 +73,7 @@ class RunnableFactory:
         # Doc Search Tool for searching the menu
         self.azure_ai_search_tool = AzureAISearch_Tool(
             indexes=indexes,
-            fields_to_select="id, title, chunk, location",
+            fields_to_select="id, ParentKey, title, chunk, location",
             vector_query_fields="chunkVector",
             generate_vector_query_embeddings=False,
             search_fields="",
@@ -56,9 +87,31 @@ class RunnableFactory:
             description="Use this tool to search the knowldge base",
             add_answer_scores=True,
             reranker_threshold=self.app_settings.search_tool_reranker_threshold,
+            max_document_tokens=self.app_settings.search_tool_max_document_tokens,
+            max_context_tokens=self.app_settings.search_tool_max_context_tokens,
+            parent_field="ParentKey",
         )
 
         self.content_safety_tool = AzureContentSafety_Tool()
+        self.verdict_cache = (
+            VerdictCache(
+                max_entries=self.app_settings.verdict_cache_max_entries,
+                ttl=self.app_settings.verdict_cache_ttl_seconds,
+            )
+            if self.app_settings.verdict_cache_enabled
+            else None
+        )
+
+    def retire_memory(self, memory: ConversationMemory):
+        """Write the history still queued by a replaced memory in the background."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Without a running loop nothing has been queued
+            return
+        task = loop.create_task(memory.flush())
+        self._memory_flushes.add(task)
+        task.add_done_callback(self._memory_flushes.discard)
 
     def make_prompt(self, file_names):
         schema = ResponseSchema().get_response_schema()
@@ -75,32 +128,119 @@ class RunnableFactory:
         return cpt
 
     def get_runnable(self):
+        """Return the compiled graph for the current settings, building it on first use.
+
+        The compiled graph holds no per-request state so a single instance is shared by all
+        concurrent requests. A change to the settings changes the config hash and triggers a rebuild
+        of the graph and of the components built from the settings.
+        """
+        config_hash = self.app_settings.get_config_hash()
+        runnable = self._runnable_cache.get(config_hash)
+        if runnable is None:
+            with self._runnable_cache_lock:
+                runnable = self._runnable_cache.get(config_hash)
+                if runnable is None:
+                    if config_hash != self._components_hash:
+                        self.logger.info(f"Rebuilding components for config hash {config_hash}")
+                        self.build_components()
+                        self._components_hash = config_hash
+                    self.logger.info(f"Compiling runnable for config hash {config_hash}")
+                    runnable = self.build_runnable()
+                    # Only the graph for the current settings is kept
+                    self._runnable_cache = {config_hash: runnable}
+        return runnable
+
+    def invalidate_runnable_cache(self):
+        """Drop the compiled graphs and components so the next call to get_runnable rebuilds them."""
+        with self._runnable_cache_lock:
+            self._runnable_cache = {}
+            self._components_hash = None
+
+    def build_runnable(self):
         graph = StateGraph(dict)
         graph.add_node("pre_processor", self.pre_processor)
-        graph.add_node("content_safety", self.content_safety)
         graph.add_node("stop_for_safety", self.return_safety_error_message)
-        graph.add_node("identify_disclaimers", self.identify_disclaimers)
-        graph.add_node("call_model", self.call_agent_graph())
         graph.add_node("post_processor", self.post_processor)
-        graph.add_edge(START, "pre_processor")
-        graph.add_edge("pre_processor", "content_safety")
-        graph.add_conditional_edges(
-            "content_safety",
-            self.should_stop_for_safety,
-            {"continue": "identify_disclaimers", "stop_for_safety": "stop_for_safety"},
-        )
-        graph.add_edge("identify_disclaimers", "call_model")
-        graph.add_edge("call_model", "post_processor")
+        if self.app_settings.add_memory:
+            graph.add_node("load_memory", self.load_memory)
+            graph.add_node("save_memory", self.save_memory)
+            graph.add_edge(START, "load_memory")
+            graph.add_edge("load_memory", "pre_processor")
+        else:
+            graph.add_edge(START, "pre_processor")
+        if self.app_settings.speculative_execution:
+            # The agent runs alongside the guardrails so the checks are off the critical path
+            graph.add_node("guarded_call_model", self.speculative_call_model(self.call_agent_graph()))
+            graph.add_edge("pre_processor", "guarded_call_model")
+            graph.add_conditional_edges(
+                "guarded_call_model",
+                self.should_stop_for_safety,
+                {"continue": "post_processor", "stop_for_safety": "stop_for_safety"},
+            )
+        else:
+            graph.add_node("guardrails", self.guardrails)
+            graph.add_node("call_model", self.call_agent_graph())
+            graph.add_edge("pre_processor", "guardrails")
+            graph.add_conditional_edges(
+                "guardrails",
+                self.should_stop_for_safety,
+                {"continue": "call_model", "stop_for_safety": "stop_for_safety"},
+            )
+            graph.add_edge("call_model", "post_processor")
         graph.add_edge("stop_for_safety", "post_processor")
-        graph.add_edge("post_processor", END)
+        if self.app_settings.add_memory:
+            graph.add_edge("post_processor", "save_memory")
+            graph.add_edge("save_memory", END)
+        else:
+            graph.add_edge("post_processor", END)
         graph_runnable = graph.compile()
         return graph_runnable
 
+    def get_session(self, config: RunnableConfig):
+        configurable = config.get("configurable", {})
+        return configurable.get("user_id"), configurable.get("session_id")
+
+    async def load_memory(self, state: dict, config: RunnableConfig):
+        """Load the turn count of the session and its recent history when the client only sends the question.
+
+        Clients that send the conversation themselves keep doing so, their messages are left as they are.
+        """
+        user_id, session_id = self.get_session(config)
+        state["session_turn_count"] = 0
+        if not user_id or not session_id:
+            return state
+        try:
+            history, turn_count = await self.memory.load(user_id, session_id)
+        except Exception as e:
+            self.logger.exception(f"Unable to load the history of session {session_id}: {e}")
+            return state
+        state["session_turn_count"] = turn_count
+        if len(state["messages"]) == 1:
+            history = self.memory.trim(history, self.app_settings.history_max_tokens)
+            state["messages"] = history + state["messages"]
+        return state
+
+    async def save_memory(self, state: dict, config: RunnableConfig):
+        """Persist the question and the answer of the turn once the response is final."""
+        user_id, session_id = self.get_session(config)
+        if not user_id or not session_id or "question" not in state:
+            return state
+        if self.safety_check_tripped(state):
+            # Flagged questions are not replayed to the model on later turns
+            self.logger.info(f"Not saving the turn of session {session_id} after a safety check tripped")
+            return state
+        turn = [HumanMessage(content=state["question"]), state["messages"][-1]]
+        try:
+            await self.memory.save(user_id, session_id, turn)
+        except Exception as e:
+            self.logger.exception(f"Unable to save the history of session {session_id}: {e}")
+        return state
+
     def pre_processor(self, state: dict):
         """Invoke prechecks before running the graph."""
         question = state["messages"][-1]["content"]
         state["question"] = question
-        current_turn_count = self.current_turn_count
+        current_turn_count = state.get("session_turn_count", 0)
         max_turn_count = self.app_settings.max_turn_count
         self.logger.info("Current Turn Count: " + str(current_turn_count))
         self.logger.info("Max Turn Count: " + str(max_turn_count))
@@ -114,21 +254,140 @@ class RunnableFactory:
         if state["question"].strip() == "":
             raise ValueError("Question is empty")
 
-    async def content_safety(self, state: dict):
-        """Evaluate content safety."""
+    async def guardrails(self, state: dict):
+        """Run the content safety, banned topic and disclaimer checks concurrently and join the results.
+
+        The stage takes as long as the slowest check instead of the sum of all of them.
+        """
         self.logger.debug(f"Prompt Input: {state}")
+        question = state["question"]
+        safety_results, banned_topic_results, disclaimer_results = await asyncio.gather(
+            self.content_safety(question),
+            self.detect_banned_topics(question),
+            self.identify_disclaimers(question),
+            return_exceptions=True,
+        )
+        state.update(safety_results)
+        state.update(banned_topic_results)
+        state["unable_to_complete_safety_check"] = (
+            safety_results["unable_to_complete_safety_check"]
+            or banned_topic_results["unable_to_complete_safety_check"]
+        )
+        if not self.safety_check_tripped(state):
+            # Disclaimers only matter when the question is answered
+            if isinstance(disclaimer_results, Exception):
+                raise disclaimer_results
+            state["disclaimers"] = disclaimer_results
+        return state
+
+    def speculative_call_model(self, agent_graph):
+        """Build a node that starts the agent at the same time as the guardrails.
+
+        The agent runs without the request callbacks so none of its output is streamed to the caller.
+        Its answer is only kept once every check has passed, otherwise the run is cancelled.
+        """
+
+        async def guarded_call_model(state: dict, config: RunnableConfig):
+            agent_task = asyncio.create_task(
+                agent_graph.ainvoke({"messages": list(state["messages"])}, {**config, "callbacks": []})
+            )
+            try:
+                state = await self.guardrails(state)
+            except BaseException:
+                agent_task.cancel()
+                raise
+            if self.safety_check_tripped(state):
+                self.logger.info("Discarding speculative agent run after a safety check tripped")
+                agent_task.cancel()
+                with contextlib.suppress(asyncio.CancelledError, Exception):
+                    await agent_task
+                return state
+            agent_state = await agent_task
+            state["messages"] = agent_state["messages"]
+            return state
+
+        return guarded_call_model
+
+    async def get_verdict(self, check: str, question: str, config: dict, compute):
+        """Return the verdict of a guardrail check, from the verdict cache when it is enabled."""
+        if self.verdict_cache is None:
+            return await compute()
+        return await self.verdict_cache.aget_or_compute(check, question, config, compute)
+
+    def content_safety_config(self) -> dict:
+        environment_config = self.app_settings.environment_config
+        return {
+            "endpoint": environment_config.content_safety_endpoint,
+            "api_version": environment_config.content_safety_api_version,
+            "threshold": self.app_settings.content_safety_threshold,
+        }
+
+    def topic_detection_config(self, topics: list[str]) -> dict:
+        config = {
+            "topics": sorted(topics),
+            "deployment": self.app_settings.environment_config.openai_classifier_deployment_name,
+            "detector": self.app_settings.topic_detector,
+        }
+        if self.app_settings.topic_detector == "embedding":
+            config["threshold"] = self.app_settings.topic_similarity_threshold
+            config["margin"] = self.app_settings.topic_similarity_margin
+            config["llm_fallback"] = self.app_settings.topic_llm_fallback
+            config["examples"] = {topic: self.app_settings.topic_examples.get(topic) for topic in topics}
+        return config
+
+    def get_topic_detection_tool(self):
+        if self.app_settings.topic_detector == "embedding":
+            return EmbeddingTopicDetectionTool.from_settings(self.app_settings)
+        return TopicDetectionTool()
+
+    def use_combined_topic_detection(self) -> bool:
+        # The embedding detector scores every topic locally, there is no call to combine
+        return self.app_settings.combined_topic_detection and self.app_settings.topic_detector == "llm"
+
+    async def classify_topics(self, question: str) -> dict:
+        """Classify the question against the banned and disclaimer topics with one classifier call.
+
+        detect_banned_topics and identify_disclaimers run concurrently and share the same call.
+        """
+        task = self._topic_classifications.get(question)
+        if task is None:
+            topic_sets = {
+                "banned_topics": self.app_settings.banned_topics,
+                "disclaimer_topics": self.app_settings.disclaimer_topics,
+            }
+            config = {
+                **{name: sorted(topics) for name, topics in topic_sets.items()},
+                "deployment": self.app_settings.environment_config.openai_classifier_deployment_name,
+            }
+            task = asyncio.ensure_future(
+                self.get_verdict(
+                    "topic_classification",
+                    question,
+                    config,
+                    lambda: TopicDetectionTool().aclassify(question, topic_sets),
+                )
+            )
+            self._topic_classifications[question] = task
+            task.add_done_callback(lambda _: self._topic_classifications.pop(question, None))
+        return await asyncio.shield(task)
+
+    async def content_safety(self, question: str) -> dict:
+        """Evaluate prompt shield and harmful text analysis for the question."""
         harmful_prompt_results = None
         prompt_shield_results = None
         attack_detected = False
-        banned_topic_detected = False
         harmful_prompt_detected = False
-        banned_topic_results = []
+        captured_harmful_categories = []
         unable_to_complete_safety_check = False
         current_span = get_current_span()
         try:
             if self.app_settings.content_safety_enabled:
-                question = state["question"]
-                results = await self.content_safety_tool._arun(question)
+                results = await self.get_verdict(
+                    "content_safety",
+                    question,
+                    self.content_safety_config(),
+                    lambda: self.content_safety_tool._arun(question),
+                )
                 self.logger.debug(f"GetContentSafetyValidation_Tool results: {results}")
                 harmful_prompt_results = results["analyzed_harmful_text_response"]
                 prompt_shield_results = results["prompt_shield_validation_response"]
@@ -153,10 +412,33 @@ class RunnableFactory:
             current_span.set_attribute(
                 "unable_to_complete_safety_check", str(unable_to_complete_safety_check)
             )
+        return {
+            "attackDetected": attack_detected,
+            "harmful_prompt_detected": harmful_prompt_detected,
+            "harmful_categories": captured_harmful_categories,
+            "unable_to_complete_safety_check": unable_to_complete_safety_check,
+        }
+
+    async def detect_banned_topics(self, question: str) -> dict:
+        """Classify the question against the configured banned topics."""
+        banned_topic_detected = False
+        banned_topic_results = []
+        unable_to_complete_safety_check = False
+        current_span = get_current_span()
         try:
-            self.logger.debug(f"Starting Topic Detection: {state}")
-            if len(self.app_settings.banned_topics) > 0 and harmful_prompt_detected is False:
-                banned_topic_results = await TopicDetectionTool()._arun(question, AppSettings().banned_topics)
+            self.logger.debug(f"Starting Topic Detection: {question}")
+            if len(self.app_settings.banned_topics) > 0:
+                banned_topics = self.app_settings.banned_topics
+                if self.use_combined_topic_detection():
+                    classification = await self.classify_topics(question)
+                    banned_topic_results = classification.get("banned_topics", [])
+                else:
+                    banned_topic_results = await self.get_verdict(
+                        "topic_detection",
+                        question,
+                        self.topic_detection_config(banned_topics),
+                        lambda: self.get_topic_detection_tool()._arun(question, banned_topics),
+                    )
                 banned_topic_detected = len(banned_topic_results) > 0
                 current_span.set_attribute("banned_topic_detected", str(banned_topic_detected))
                 if banned_topic_detected:
@@ -174,27 +456,23 @@ class RunnableFactory:
             current_span.set_attribute(
                 "unable_to_complete_safety_check", str(unable_to_complete_safety_check)
             )
+        return {
+            "banned_topic_detected": banned_topic_detected,
+            "banned_topics": banned_topic_results,
+            "unable_to_complete_safety_check": unable_to_complete_safety_check,
+        }
 
-        state.update(
-            {
-                "attackDetected": attack_detected,
-                "harmful_prompt_detected": harmful_prompt_detected,
-                "harmful_categories": captured_harmful_categories,
-                "banned_topic_detected": banned_topic_detected,
-                "banned_topics": banned_topic_results,
-                "unable_to_complete_safety_check": unable_to_complete_safety_check,
-            }
-        )
-        return state
-
-    def should_stop_for_safety(self, state: dict):
-        """Make a decision based on detected prompts."""
-        if (
+    def safety_check_tripped(self, state: dict) -> bool:
+        return bool(
             state["attackDetected"]
             or state["harmful_prompt_detected"]
             or state["banned_topic_detected"]
             or state["unable_to_complete_safety_check"]
-        ):
+        )
+
+    def should_stop_for_safety(self, state: dict):
+        """Make a decision based on detected prompts."""
+        if self.safety_check_tripped(state):
             self.logger.warning(f"Detected malicious step and stopping graph execution: {state}")
             return "stop_for_safety"
         else:
@@ -206,16 +484,23 @@ class RunnableFactory:
         state["messages"].append(AIMessage(content=response))
         return state
 
-    async def identify_disclaimers(self, state: dict):
-        results = []
+    async def identify_disclaimers(self, question: str) -> list[str]:
         self.logger.debug("Topic Detection Tool Executing")
         current_span = get_current_span()
-        question = state["question"]
-        results = await TopicDetectionTool()._arun(question, AppSettings().disclaimer_topics)
+        disclaimer_topics = self.app_settings.disclaimer_topics
+        if self.use_combined_topic_detection():
+            classification = await self.classify_topics(question)
+            results = classification.get("disclaimer_topics", [])
+        else:
+            results = await self.get_verdict(
+                "topic_detection",
+                question,
+                self.topic_detection_config(disclaimer_topics),
+                lambda: self.get_topic_detection_tool()._arun(question, disclaimer_topics),
+            )
         self.logger.debug(f"Topic Detection Tool results: {results}")
         current_span.set_attribute("disclaimers_added", str(results))
-        state["disclaimers"] = results
-        return state
+        return results
 
     def extract_content(self, input_str: str, start_delimiter: str, end_delimiter: str = "```") -> str:
         """
@@ -0,0 +1,57 @@
+import logging
+from typing import Optional
+
+from common.cache import CacheBackend, TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class SessionHistoryCache:
+    """In-process cache of the history of recently active chat sessions keyed by user and session.
+
+    Each entry is a snapshot of the history together with the ETag of the Cosmos item it was read from
+    or written as. With validate_etag set the history checks the ETag of the item before using a
+    snapshot, a query of a few bytes instead of reading the messages, so writes from other replicas are
+    picked up. Without it snapshots are used until they expire, which is only safe when a session is
+    always served by the same replica.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        max_entries: int = 1000,
+        ttl: Optional[float] = 300,
+        validate_etag: bool = True,
+    ):
+        self.backend = backend if backend is not None else TTLCache(max_entries=max_entries, ttl=ttl)
+        self.validate_etag = validate_etag
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, user_id: str, session_id: str) -> Optional[dict]:
+        snapshot = self.backend.get((user_id, session_id))
+        if snapshot is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            logger.debug(f"Session history cache hit for session {session_id}")
+        return snapshot
+
+    def set(self, user_id: str, session_id: str, snapshot: dict):
+        self.backend.set((user_id, session_id), snapshot)
+
+    def pop(self, user_id: str, session_id: str):
+        self.backend.pop((user_id, session_id))
+
+    def invalidate(self, user_id: str, session_id: str):
+        """Drop a snapshot whose ETag no longer matches the item."""
+        self.stale += 1
+        logger.debug(f"Session history of session {session_id} changed since it was cached")
+        self.pop(user_id, session_id)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "stale": self.stale}
@@ -1,17 +1,27 @@
-import asyncio
+import functools
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from typing import ClassVar, List, Optional, Type
+from typing import ClassVar, List, Literal, Optional, Tuple, Type
 
 from app.settings import AppSettings
+from common.cache import SqliteCache
 from common.search.azure_ai_search import AzureRAGSearchClient
+from common.search.documents import (
+    format_documents,
+    pack_documents,
+    parse_fields,
+    remove_chunk_overlap,
+    search_result_to_document,
+)
+from common.search.embeddings import QueryEmbedder
+from common.search.search_cache import SearchResultCache
 from langchain.callbacks.manager import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
 from langchain.tools import BaseTool
-from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
-from openai import AzureOpenAI
-from pydantic import BaseModel, Field
+from openai import AsyncAzureOpenAI, AzureOpenAI
+from opentelemetry.trace import get_current_span
+from pydantic import BaseModel, Field, PrivateAttr
 
 logger = logging.getLogger(__name__)
 
@@ -34,39 +44,67 @@ class CustomAzureSearchRetriever(BaseRetriever):
     highlightPostTag: str = ""
     reranker_threshold: Optional[int] = None
     vector_query_weight: Optional[int] = None
+    # Fields of each hit that are passed to the model, defaults to fields_to_select without parent_field
+    content_fields: Optional[List[str]] = None
+    max_document_tokens: Optional[int] = None
+    # Token budget for all the results together, the highest scoring results that fit are kept
+    max_context_tokens: Optional[int] = None
+    # Chunks that share a parent document have their overlapping text removed
+    parent_field: Optional[str] = None
+    chunk_field: str = "chunk"
 
     search_client: ClassVar[AzureRAGSearchClient] = AzureRAGSearchClient(
         api_key=app_settings.environment_config.azure_search_key.get_secret_value(),
         api_version=app_settings.environment_config.azure_search_api_version,
         search_endpoint=app_settings.environment_config.azure_search_endpoint,
+        timeout=app_settings.search_client_timeout,
+        max_connections=app_settings.search_client_max_connections,
+        max_retries=app_settings.search_client_max_retries,
+    )
+    result_cache: ClassVar[Optional[SearchResultCache]] = (
+        SearchResultCache(
+            backend=(
+                SqliteCache(app_settings.search_cache_path, ttl=app_settings.search_cache_ttl_seconds)
+                if app_settings.search_cache_path
+                else None
+            ),
+            max_entries=app_settings.search_cache_max_entries,
+            ttl=app_settings.search_cache_ttl_seconds,
+            similarity_threshold=app_settings.search_cache_similarity_threshold,
+        )
+        if app_settings.search_cache_enabled
+        else None
+    )
+
+    openai_client_kwargs: ClassVar[dict] = dict(
+        api_key=app_settings.environment_config.openai_api_key.get_secret_value(),
+        api_version=app_settings.environment_config.openai_api_version,
+        azure_endpoint=app_settings.environment_config.openai_endpoint,
+    )
+    embedder: ClassVar[QueryEmbedder] = QueryEmbedder(
+        model=app_settings.environment_config.openai_embedding_deployment_name,
+        client_factory=functools.partial(AzureOpenAI, **openai_client_kwargs),
+        async_client_factory=functools.partial(AsyncAzureOpenAI, **openai_client_kwargs),
+        max_entries=app_settings.embedding_cache_max_entries,
+        persist_path=app_settings.embedding_cache_path,
+        batch_window=app_settings.embedding_batch_window_ms / 1000,
+        max_batch_size=app_settings.embedding_max_batch_size,
     )
 
     def generate_embeddings(self, query: str):
-        client = AzureOpenAI(
-            api_key=self.app_settings.environment_config.openai_api_key.get_secret_value(),
-            api_version=self.app_settings.environment_config.openai_api_version,
-            azure_endpoint=self.app_settings.environment_config.openai_endpoint,
-        )
-        model = self.app_settings.environment_config.openai_embedding_deployment_name
-        return client.embeddings.create(input=[query], model=model).data[0].embedding
+        return self.embedder.embed(query)
 
-    def _get_relevant_documents(
-        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
-    ) -> List[Document]:
-        query_embeddings = None
-        top_docs = []
-        if self.generate_vector_query_embeddings:
-            query_embeddings = self.generate_embeddings(query)
-        ordered_results = self.search_client.search(
-            query,
-            self.indexes,
+    async def agenerate_embeddings(self, query: str):
+        return await self.embedder.aembed(query)
+
+    def get_search_kwargs(self, filter: Optional[str] = None) -> dict:
+        return dict(
             k=self.topK,
             fields_to_select=self.fields_to_select,
             search_fields=self.search_fields,
             id_field=self.id_field,
             vector_query_fields=self.vector_query_fields,
-            vector_query_embeddings=query_embeddings,
-            filter=self.filter,
+            filter=self.filter if filter is None else filter,
             semantic_config=self.semantic_config,
             answers=self.answers,
             captions=self.captions,
@@ -77,7 +115,76 @@ class CustomAzureSearchRetriever(BaseRetriever):
             max_results=self.max_results,
         )
 
-        top_docs = [Document(page_content=str(result)) for result in ordered_results]
+    def to_documents(self, ordered_results: List[dict]) -> List[Document]:
+        content_fields = self.content_fields or [
+            field for field in parse_fields(self.fields_to_select) if field != self.parent_field
+        ]
+        if self.parent_field:
+            ordered_results = remove_chunk_overlap(ordered_results, self.chunk_field, self.parent_field)
+        documents = [
+            search_result_to_document(
+                result,
+                content_fields,
+                self.id_field,
+                self.max_document_tokens,
+                parent_field=self.parent_field,
+            )
+            for result in ordered_results
+        ]
+        return pack_documents(documents, self.max_context_tokens)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun, filter: Optional[str] = None
+    ) -> List[Document]:
+        query_embeddings = None
+        top_docs = []
+        search_kwargs = self.get_search_kwargs(filter)
+        if self.result_cache is not None:
+            cache_scope = self.result_cache.make_scope(self.indexes, search_kwargs)
+            ordered_results = self.result_cache.get(query, cache_scope)
+            get_current_span().set_attribute("search_cache_hit", str(ordered_results is not None))
+            if ordered_results is not None:
+                return self.to_documents(ordered_results)
+        if self.generate_vector_query_embeddings:
+            query_embeddings = self.generate_embeddings(query)
+        ordered_results = self.search_client.search(
+            query,
+            self.indexes,
+            vector_query_embeddings=query_embeddings,
+            **search_kwargs,
+        )
+        if self.result_cache is not None:
+            self.result_cache.set(query, cache_scope, ordered_results)
+
+        top_docs = self.to_documents(ordered_results)
+        return top_docs
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun, filter: Optional[str] = None
+    ) -> List[Document]:
+        query_embeddings = None
+        top_docs = []
+        search_kwargs = self.get_search_kwargs(filter)
+        if self.result_cache is not None:
+            cache_scope = self.result_cache.make_scope(self.indexes, search_kwargs)
+            ordered_results = await self.result_cache.aget(
+                query, cache_scope, embed=self.agenerate_embeddings
+            )
+            get_current_span().set_attribute("search_cache_hit", str(ordered_results is not None))
+            if ordered_results is not None:
+                return self.to_documents(ordered_results)
+        if self.generate_vector_query_embeddings:
+            query_embeddings = await self.agenerate_embeddings(query)
+        ordered_results = await self.search_client.asearch(
+            query,
+            self.indexes,
+            vector_query_embeddings=query_embeddings,
+            **search_kwargs,
+        )
+        if self.result_cache is not None:
+            await self.result_cache.aset(query, cache_scope, ordered_results)
+
+        top_docs = self.to_documents(ordered_results)
         return top_docs
 
 
@@ -101,51 +208,54 @@ class AzureAISearch_Tool(BaseTool):
     reranker_th: int = None
     vector_query_weight: int = None
     max_results: int = 3
+    content_fields: Optional[List[str]] = None
+    max_document_tokens: Optional[int] = None
+    max_context_tokens: Optional[int] = None
+    parent_field: Optional[str] = None
+    chunk_field: str = "chunk"
     strict: bool = True
+    # The model gets the compact JSON content, the Documents are kept as the ToolMessage artifact
+    response_format: Literal["content", "content_and_artifact"] = "content_and_artifact"
 
-    def _run(self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
-        retriever = CustomAzureSearchRetriever(
-            indexes=self.indexes,
-            fields_to_select=self.fields_to_select,
-            vector_query_fields=self.vector_query_fields,
-            generate_vector_query_embeddings=self.generate_vector_query_embeddings,
-            search_fields=self.search_fields,
-            id_field=self.id_field,
-            topK=self.k,
-            filter=self.filter,
-            semantic_config=self.semantic_config,
-            reranker_threshold=self.reranker_th,
-            vector_query_weight=self.vector_query_weight,
-            callback_manager=self.callbacks,
-            max_results=self.max_results,
-        )
-        results = retriever.invoke(query)
+    _retriever: Optional[CustomAzureSearchRetriever] = PrivateAttr(default=None)
 
-        return results
+    def get_retriever(self) -> CustomAzureSearchRetriever:
+        """Build the retriever once per tool instance."""
+        if self._retriever is None:
+            self._retriever = CustomAzureSearchRetriever(
+                indexes=self.indexes,
+                fields_to_select=self.fields_to_select,
+                vector_query_fields=self.vector_query_fields,
+                generate_vector_query_embeddings=self.generate_vector_query_embeddings,
+                search_fields=self.search_fields,
+                id_field=self.id_field,
+                topK=self.k,
+                filter=self.filter,
+                semantic_config=self.semantic_config,
+                reranker_threshold=self.reranker_th,
+                vector_query_weight=self.vector_query_weight,
+                callback_manager=self.callbacks,
+                max_results=self.max_results,
+                content_fields=self.content_fields,
+                max_document_tokens=self.max_document_tokens,
+                max_context_tokens=self.max_context_tokens,
+                parent_field=self.parent_field,
+                chunk_field=self.chunk_field,
+            )
+        return self._retriever
 
-    async def _arun(self, query: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> str:
-        retriever = CustomAzureSearchRetriever(
-            indexes=self.indexes,
-            fields_to_select=self.fields_to_select,
-            vector_query_fields=self.vector_query_fields,
-            generate_vector_query_embeddings=self.generate_vector_query_embeddings,
-            search_fields=self.search_fields,
-            id_field=self.id_field,
-            topK=self.k,
-            filter=self.filter,
-            semantic_config=self.semantic_config,
-            reranker_threshold=self.reranker_th,
-            vector_query_weight=self.vector_query_weight,
-            callback_manager=self.callbacks,
-            max_results=self.max_results,
-        )
-        # Please note below that running a non-async function like run_agent
-        # in a separate thread won't make it truly asynchronous.
-        # It allows the function to be called without blocking the event loop,
-        # but it may still have synchronous behavior internally.
-        loop = asyncio.get_event_loop()
-        results = await loop.run_in_executor(ThreadPoolExecutor(), retriever.invoke, query)
-        return results
+    def _run(
+        self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None
+    ) -> Tuple[str, List[Document]]:
+        results = self.get_retriever().invoke(query)
+
+        return format_documents(results), results
+
+    async def _arun(
+        self, query: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+    ) -> Tuple[str, List[Document]]:
+        results = await self.get_retriever().ainvoke(query)
+        return format_documents(results), results
 
 
 class AzureAIFilterableSearchInput(BaseModel):
@@ -170,55 +280,54 @@ class AzureAIFilterableSearch_Tool(BaseTool):
     reranker_th: int = None
     vector_query_weight: int = None
     max_results: int = 3
+    content_fields: Optional[List[str]] = None
+    max_document_tokens: Optional[int] = None
+    max_context_tokens: Optional[int] = None
+    parent_field: Optional[str] = None
+    chunk_field: str = "chunk"
+    # The model gets the compact JSON content, the Documents are kept as the ToolMessage artifact
+    response_format: Literal["content", "content_and_artifact"] = "content_and_artifact"
+
+    _retriever: Optional[CustomAzureSearchRetriever] = PrivateAttr(default=None)
+
+    def get_retriever(self) -> CustomAzureSearchRetriever:
+        """Build the retriever once per tool instance, the filter is passed on each query."""
+        if self._retriever is None:
+            self._retriever = CustomAzureSearchRetriever(
+                indexes=self.indexes,
+                fields_to_select=self.fields_to_select,
+                vector_query_fields=self.vector_query_fields,
+                generate_vector_query_embeddings=self.generate_vector_query_embeddings,
+                search_fields=self.search_fields,
+                id_field=self.id_field,
+                topK=self.k,
+                semantic_config=self.semantic_config,
+                reranker_threshold=self.reranker_th,
+                vector_query_weight=self.vector_query_weight,
+                callback_manager=self.callbacks,
+                max_results=self.max_results,
+                content_fields=self.content_fields,
+                max_document_tokens=self.max_document_tokens,
+                max_context_tokens=self.max_context_tokens,
+                parent_field=self.parent_field,
+                chunk_field=self.chunk_field,
+            )
+        return self._retriever
 
     def _run(
         self, query: str, filter_expression: str = "", run_manager: Optional[CallbackManagerForToolRun] = None
-    ) -> str:
+    ) -> Tuple[str, List[Document]]:
         """Use the tool synchronously."""
-        retriever = CustomAzureSearchRetriever(
-            indexes=self.indexes,
-            fields_to_select=self.fields_to_select,
-            vector_query_fields=self.vector_query_fields,
-            generate_vector_query_embeddings=self.generate_vector_query_embeddings,
-            search_fields=self.search_fields,
-            id_field=self.id_field,
-            topK=self.k,
-            filter=filter_expression,
-            semantic_config=self.semantic_config,
-            reranker_threshold=self.reranker_th,
-            vector_query_weight=self.vector_query_weight,
-            callback_manager=self.callbacks,
-            max_results=self.max_results,
-        )
-        results = retriever.invoke(query)
+        results = self.get_retriever().invoke(query, filter=filter_expression)
 
-        return results
+        return format_documents(results), results
 
     async def _arun(
         self,
         query: str,
         filter_expression: str = "",
         run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
-    ) -> str:
+    ) -> Tuple[str, List[Document]]:
         """Use the tool asynchronously."""
-        retriever = CustomAzureSearchRetriever(
-            indexes=self.indexes,
-            fields_to_select=self.fields_to_select,
-            vector_query_fields=self.vector_query_fields,
-            generate_vector_query_embeddings=self.generate_vector_query_embeddings,
-            search_fields=self.search_fields,
-            topK=self.k,
-            filter=filter_expression,
-            semantic_config=self.semantic_config,
-            reranker_threshold=self.reranker_th,
-            vector_query_weight=self.vector_query_weight,
-            callback_manager=self.callbacks,
-            max_results=self.max_results,
-        )
-        # Please note below that running a non-async function like run_agent in
-        # a separate thread won't make it truly asynchronous.
-        # It allows the function to be called without blocking the event loop,
-        # but it may still have synchronous behavior internally.
-        loop = asyncio.get_event_loop()
-        results = await loop.run_in_executor(ThreadPoolExecutor(), retriever.invoke, query)
-        return results
+        results = await self.get_retriever().ainvoke(query, filter=filter_expression)
+        return format_documents(results), results
@@ -1,3 +1,5 @@
+import asyncio
+import importlib.util
 import logging
 from concurrent.futures import ThreadPoolExecutor
 from typing import ClassVar, Optional
@@ -9,6 +11,9 @@ from langchain.tools import BaseTool
 
 logger = logging.getLogger(__name__)
 
+# httpx only speaks HTTP/2 when the optional h2 package is installed
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
 
 class AzureContentSafety_Tool(BaseTool):
     app_settings: ClassVar[AppSettings] = AppSettings()
@@ -32,6 +37,29 @@ class AzureContentSafety_Tool(BaseTool):
         "Content-Type": "application/json",
     }
 
+    # Keep-alive client shared by all the instances, recreated when the event loop changes
+    http_client: ClassVar[Optional[httpx.AsyncClient]] = None
+    http_client_loop: ClassVar[Optional[asyncio.AbstractEventLoop]] = None
+
+    @classmethod
+    def get_async_client(cls) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = cls.http_client
+        if client is None or client.is_closed or cls.http_client_loop is not loop:
+            cls.http_client = httpx.AsyncClient(
+                headers=cls.headers,
+                transport=httpx.AsyncHTTPTransport(retries=3, http2=HTTP2_AVAILABLE),
+            )
+            cls.http_client_loop = loop
+        return cls.http_client
+
+    @classmethod
+    async def aclose(cls):
+        if cls.http_client is not None and not cls.http_client.is_closed:
+            await cls.http_client.aclose()
+        cls.http_client = None
+        cls.http_client_loop = None
+
     def _run(self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None):
         payload_shield = {"userPrompt": query, "documents": None}
         payload_harmful = {"text": query}
@@ -54,14 +82,12 @@ class AzureContentSafety_Tool(BaseTool):
     async def _arun(self, query: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None):
         payload_shield = {"userPrompt": query, "documents": None}
         payload_harmful = {"text": query}
-        transport = httpx.AsyncHTTPTransport(retries=3)
-        async with httpx.AsyncClient(transport=transport) as client:
-            shield_response = await client.post(
-                self.prompt_shield_endpoint, json=payload_shield, headers=self.headers
-            )
-            harmful_response = await client.post(
-                self.harmful_text_analysis_endpoint, json=payload_harmful, headers=self.headers
-            )
+        client = self.get_async_client()
+        # Both checks go out together over the pooled connections
+        shield_response, harmful_response = await asyncio.gather(
+            client.post(self.prompt_shield_endpoint, json=payload_shield),
+            client.post(self.harmful_text_analysis_endpoint, json=payload_harmful),
+        )
 
         return self._format_response(shield_response.json(), harmful_response.json())
 
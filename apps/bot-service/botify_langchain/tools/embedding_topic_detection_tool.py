@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from typing import ClassVar, Dict, List, Optional, Tuple
+
+import numpy as np
+from app.settings import AppSettings
+from botify_langchain.tools.topic_detection_tool import TopicDetectionTool
+from langchain.tools import BaseTool
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingTopicDetectionTool(BaseTool):
+    """Tool for detecting topics in a query by comparing its embedding with topic centroids.
+
+    Each topic centroid is the normalized mean embedding of the example phrases of the topic. A topic is
+    detected when the cosine similarity of the query reaches threshold and rejected when it is below
+    threshold - margin. Topics in between, and topics without examples, are sent to the LLM classifier
+    when llm_fallback is set.
+    """
+
+    name: ClassVar[str] = "Embedding Topic Detection Tool"
+    description: ClassVar[str] = "Detects topics in the query using embedding similarity."
+    topic_examples: Dict[str, List[str]]
+    # Defaults for text-embedding-ada-002, see topic_similarity_threshold in AppSettings
+    threshold: float = 0.85
+    margin: float = 0.05
+    llm_fallback: bool = True
+
+    # Centroids keyed by topic and examples, shared by all the instances
+    centroids: ClassVar[Dict[Tuple[str, Tuple[str, ...]], np.ndarray]] = {}
+    # Held while centroids are computed so concurrent requests embed the examples once,
+    # recreated when the event loop changes
+    centroid_lock: ClassVar[Optional[asyncio.Lock]] = None
+    centroid_lock_loop: ClassVar[Optional[asyncio.AbstractEventLoop]] = None
+
+    @classmethod
+    def from_settings(cls, app_settings: AppSettings) -> "EmbeddingTopicDetectionTool":
+        return cls(
+            topic_examples=app_settings.topic_examples,
+            threshold=app_settings.topic_similarity_threshold,
+            margin=app_settings.topic_similarity_margin,
+            llm_fallback=app_settings.topic_llm_fallback,
+        )
+
+    def get_embedder(self):
+        # Shares the cache and request batching of the search query embeddings
+        from botify_langchain.tools.azure_ai_search_tool import CustomAzureSearchRetriever
+
+        return CustomAzureSearchRetriever.embedder
+
+    def normalize(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    @classmethod
+    def get_centroid_lock(cls) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if cls.centroid_lock is None or cls.centroid_lock_loop is not loop:
+            cls.centroid_lock = asyncio.Lock()
+            cls.centroid_lock_loop = loop
+        return cls.centroid_lock
+
+    def get_centroid_keys(self, topics: List[str]) -> List[Optional[Tuple[str, Tuple[str, ...]]]]:
+        """Key of the centroid of each topic, None for topics without examples."""
+        return [
+            (topic, tuple(self.topic_examples[topic])) if self.topic_examples.get(topic) else None
+            for topic in topics
+        ]
+
+    def get_missing_keys(self, keys: list) -> list:
+        return [key for key in dict.fromkeys(keys) if key is not None and key not in self.centroids]
+
+    def make_centroid(self, vectors) -> np.ndarray:
+        return self.normalize(self.normalize(vectors).mean(axis=0))
+
+    def get_centroids(self, topics: List[str]) -> List[Optional[np.ndarray]]:
+        keys = self.get_centroid_keys(topics)
+        embedder = self.get_embedder()
+        for key in self.get_missing_keys(keys):
+            self.centroids[key] = self.make_centroid([embedder.embed(example) for example in key[1]])
+        return [self.centroids[key] if key is not None else None for key in keys]
+
+    async def aget_centroids(self, topics: List[str]) -> List[Optional[np.ndarray]]:
+        keys = self.get_centroid_keys(topics)
+        if self.get_missing_keys(keys):
+            async with self.get_centroid_lock():
+                # Centroids computed by another request while this one waited are not embedded again
+                missing = self.get_missing_keys(keys)
+                embedder = self.get_embedder()
+                vectors = await asyncio.gather(
+                    *(asyncio.gather(*(embedder.aembed(example) for example in key[1])) for key in missing)
+                )
+                for key, examples_vectors in zip(missing, vectors):
+                    self.centroids[key] = self.make_centroid(examples_vectors)
+        return [self.centroids[key] if key is not None else None for key in keys]
+
+    def score_topics(self, query_vector: np.ndarray, topics: List[str], centroids: List[np.ndarray]):
+        """Split the topics into detected and borderline ones."""
+        detected, borderline = [], []
+        known = [(topic, centroid) for topic, centroid in zip(topics, centroids) if centroid is not None]
+        borderline.extend(topic for topic, centroid in zip(topics, centroids) if centroid is None)
+        if known:
+            similarities = np.stack([centroid for _, centroid in known]) @ query_vector
+            for (topic, _), similarity in zip(known, similarities):
+                logger.debug(f"Similarity to topic {topic}: {similarity:.3f}")
+                if similarity >= self.threshold:
+                    detected.append(topic)
+                elif similarity >= self.threshold - self.margin:
+                    borderline.append(topic)
+        return detected, borderline
+
+    def _run(self, text_entry, topics, run_manager: Optional[CallbackManagerForToolRun] = None) -> List[str]:
+        if not topics:
+            return []
+        query_vector = self.get_embedder().embed(text_entry)
+        centroids = self.get_centroids(topics)
+        detected, borderline = self.score_topics(self.normalize(query_vector), topics, centroids)
+        if borderline and self.llm_fallback:
+            logger.debug(f"Asking the LLM classifier about borderline topics {borderline}")
+            detected.extend(TopicDetectionTool()._run(text_entry, borderline))
+        return [topic for topic in topics if topic in detected]
+
+    async def _arun(
+        self, text_entry, topics, run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+    ) -> List[str]:
+        if not topics:
+            return []
+        query_vector, centroids = await asyncio.gather(
+            self.get_embedder().aembed(text_entry), self.aget_centroids(topics)
+        )
+        detected, borderline = self.score_topics(self.normalize(query_vector), topics, centroids)
+        if borderline and self.llm_fallback:
+            logger.debug(f"Asking the LLM classifier about borderline topics {borderline}")
+            detected.extend(await TopicDetectionTool()._arun(text_entry, borderline))
+        return [topic for topic in topics if topic in detected]
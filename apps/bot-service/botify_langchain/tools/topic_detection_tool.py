@@ -1,4 +1,5 @@
-from typing import ClassVar, Optional, Tuple
+import json
+from typing import ClassVar, Dict, List, Optional
 
 from app.settings import AppSettings
 from langchain.tools import BaseTool
@@ -12,47 +13,96 @@ class TopicDetectionTool(BaseTool):
 
     name: ClassVar[str] = "Topic Detection Tool"
     description: ClassVar[str] = "Detects topics in the query using Azure OpenAI."
+    # The chat client keeps its connections, so it is shared by all the instances
+    llm: ClassVar[Optional[AzureChatOpenAI]] = None
 
-    def make_prompt(self, text_entry: str, topics: list[str]) -> list[dict]:
+    def make_prompt(self, text_entry: str, topic_sets: Dict[str, List[str]]) -> list[dict]:
+        topic_lists = "\n".join(f"{name}: {', '.join(topics)}" for name, topics in topic_sets.items())
         return [
             SystemMessage(
                 content=f"""
-                          Identify if it contains any of these topics topics: {', '.join(topics)}.
-                          If the prompt contains any of the following topics,
-                          please respond with the list of all topics that are present in the prompt.
-                          If the prompt does not contain any of the banned topics, please respond with 'None'
-                          Example Responses: 'medical, legal', 'None'
+                          Identify which of the topics in each of these topic lists the prompt pertains to.
+                          {topic_lists}
+                          Respond with a JSON object that has one key per topic list, each holding the list
+                          of all the topics of that list that are present in the prompt, or an empty list.
+                          Example Response: {{"{next(iter(topic_sets))}": ["medical", "legal"]}}
                           """
             ),
             HumanMessage(content=f"Does this prompt pertain to the listed topics? {text_entry}"),
         ]
 
-    def get_llm(self):
-        app_settings = AppSettings()
-        llm = AzureChatOpenAI(
-            deployment_name=app_settings.environment_config.openai_classifier_deployment_name,
-            max_tokens=app_settings.topic_model_max_completion_tokens,
-        )
-        return llm
-
-    def format_response(self, response: AIMessage) -> list[str]:
-        result = response.content
-        if result == "None":
-            return []
-        else:
-            return result.split(", ")
+    def make_response_format(self, topic_sets: Dict[str, List[str]]) -> dict:
+        """JSON schema that only allows the configured topics for each topic list."""
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "topic_classification",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        name: {"type": "array", "items": {"type": "string", "enum": topics}}
+                        for name, topics in topic_sets.items()
+                    },
+                    "required": list(topic_sets),
+                    "additionalProperties": False,
+                },
+            },
+        }
+
+    @classmethod
+    def get_llm(cls) -> AzureChatOpenAI:
+        if cls.llm is None:
+            app_settings = AppSettings()
+            cls.llm = AzureChatOpenAI(
+                deployment_name=app_settings.environment_config.openai_classifier_deployment_name,
+                max_tokens=app_settings.topic_model_max_completion_tokens,
+            )
+        return cls.llm
+
+    def get_classifier(self, topic_sets: Dict[str, List[str]]):
+        return self.get_llm().bind(response_format=self.make_response_format(topic_sets))
+
+    def format_response(self, response: AIMessage, topic_sets: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        """Parse the JSON classification, raises ValueError when it doesn't match the topic lists."""
+        result = json.loads(response.content)
+        if not isinstance(result, dict):
+            raise ValueError(f"Topic classification is not a JSON object: {response.content}")
+        classification = {}
+        for name, topics in topic_sets.items():
+            detected = result.get(name)
+            if not isinstance(detected, list) or any(topic not in topics for topic in detected):
+                raise ValueError(f"Invalid topic classification for {name}: {detected}")
+            classification[name] = detected
+        return classification
+
+    def classify(self, text_entry: str, topic_sets: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        topic_sets = {name: topics for name, topics in topic_sets.items() if topics}
+        if not topic_sets:
+            return {}
+        response = self.get_classifier(topic_sets).invoke(self.make_prompt(text_entry, topic_sets))
+        return self.format_response(response, topic_sets)
+
+    async def aclassify(self, text_entry: str, topic_sets: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        """Classify the text against several topic lists with one call to the model.
+
+        Topic lists that are empty are left out of the result.
+        """
+        topic_sets = {name: topics for name, topics in topic_sets.items() if topics}
+        if not topic_sets:
+            return {}
+        response = await self.get_classifier(topic_sets).ainvoke(self.make_prompt(text_entry, topic_sets))
+        return self.format_response(response, topic_sets)
 
     def _run(
         self, text_entry, topics, run_manager: Optional[CallbackManagerForToolRun] = None
-    ) -> Tuple[str, bool, float]:
+    ) -> List[str]:
         # Call Azure OpenAI to classify the prompt
-        response = self.get_llm().ainvoke(self.make_prompt(text_entry, topics))
-        return self.format_response(response)
+        return self.classify(text_entry, {"topics": topics}).get("topics", [])
 
     async def _arun(
         self, text_entry, topics, run_manager: Optional[AsyncCallbackManagerForToolRun] = None
-    ) -> Tuple[str, bool, float]:
+    ) -> List[str]:
         # Call Azure OpenAI to classify the prompt asynchronously
-        response = await self.get_llm().ainvoke(self.make_prompt(text_entry, topics))
-
-        return self.format_response(response)
+        classification = await self.aclassify(text_entry, {"topics": topics})
+        return classification.get("topics", [])
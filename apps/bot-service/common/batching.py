@@ -0,0 +1,80 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class MicroBatcher:
+    """Groups the items submitted within batch_window seconds of each other into batches.
+
+    A batch is processed as soon as max_batch_size items are queued, or batch_window seconds after the
+    first item of the batch was queued. process receives the items of a batch and returns their results
+    in the same order. When it fails, the error is set on the future of every item of the batch.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[List[Any]], Awaitable[List[Any]]],
+        batch_window: float = 0.01,
+        max_batch_size: int = 16,
+    ):
+        self.process = process
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._pending: Dict[Hashable, Tuple[Any, asyncio.Future]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks: set = set()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, item: Any, key: Optional[Hashable] = None) -> asyncio.Future:
+        """Queue the item and return the future of its result.
+
+        Items submitted with the same key while the first one is queued share its future.
+        """
+        if key is None:
+            key = object()
+        pending = self._pending.get(key)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = (item, loop.create_future())
+            self._pending[key] = pending
+            if len(self._pending) >= self.max_batch_size:
+                self.schedule_flush(loop, 0)
+            elif self._flush_handle is None:
+                self.schedule_flush(loop, self.batch_window)
+        return pending[1]
+
+    def schedule_flush(self, loop: asyncio.AbstractEventLoop, delay: float):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = loop.call_later(delay, self.start_flush, loop)
+
+    def start_flush(self, loop: asyncio.AbstractEventLoop):
+        # Keep a reference so the task is not garbage collected before it completes
+        task = loop.create_task(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self):
+        """Process up to max_batch_size of the queued items as one batch."""
+        self._flush_handle = None
+        keys = list(self._pending)[: self.max_batch_size]
+        if not keys:
+            return
+        batch = [self._pending.pop(key) for key in keys]
+        if self._pending:
+            self.schedule_flush(asyncio.get_running_loop(), 0)
+        try:
+            results = await self.process([item for item, _ in batch])
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
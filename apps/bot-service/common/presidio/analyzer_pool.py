@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from common.batching import MicroBatcher
+from common.presidio.anonymizer import Anonymizer
+from common.presidio.engines import DEFAULT_SPACY_MODEL, get_model_memory
+
+logger = logging.getLogger(__name__)
+
+# Anonymizer of the worker, created once by the pool initializer so the spaCy model is loaded up front
+_worker_anonymizer: Optional[Anonymizer] = None
+
+
+def init_worker(pii_entities: List[str], model_name: str = DEFAULT_SPACY_MODEL):
+    global _worker_anonymizer
+    _worker_anonymizer = Anonymizer(pii_entities, model_name=model_name)
+
+
+def warm_up_worker() -> Tuple[int, Dict[str, int]]:
+    # Run the whole pipeline once so lazily initialized parts of spaCy and Presidio are ready too
+    _worker_anonymizer.analyze_texts(["warm up"])
+    return os.getpid(), get_model_memory()
+
+
+def analyze_batch_in_worker(texts: List[str]) -> List[list]:
+    return _worker_anonymizer.analyze_texts(texts)
+
+
+class AnalyzerPool:
+    """Runs Presidio PII analysis in worker processes so spaCy doesn't block the event loop.
+
+    Texts that arrive within batch_window seconds of each other are analyzed together, up to
+    max_batch_size at a time, so spaCy can process them with nlp.pipe. At most max_pending analyses
+    are queued or running at a time, including the ones whose request timed out, further requests wait
+    for a slot. A request fails with
+    TimeoutError when it hasn't got its result timeout seconds after it was made, including the time
+    spent waiting for a slot. With max_workers set to 0 the analysis runs in a thread of the current
+    process instead.
+    """
+
+    _pools = weakref.WeakSet()
+
+    def __init__(
+        self,
+        pii_entities: List[str],
+        max_workers: int = 2,
+        max_pending: int = 32,
+        timeout: float = 5.0,
+        batch_window: float = 0.005,
+        max_batch_size: int = 16,
+        model_name: str = DEFAULT_SPACY_MODEL,
+    ):
+        self.pii_entities = pii_entities
+        self.model_name = model_name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.batcher = MicroBatcher(
+            self.analyze_batch, batch_window=batch_window, max_batch_size=max_batch_size
+        )
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pools.add(self)
+
+    def get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.max_workers > 0:
+                # Spawned workers don't inherit the locks and threads of the server process
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_worker,
+                    initargs=(self.pii_entities, self.model_name),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, initializer=init_worker, initargs=(self.pii_entities, self.model_name)
+                )
+        return self._executor
+
+    async def warm_up(self) -> Dict[int, Dict[str, int]]:
+        """Start the workers and load their models.
+
+        Returns the resident memory in bytes used by each model, per worker process id.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self.get_executor()
+        reports = await asyncio.gather(
+            *(loop.run_in_executor(executor, warm_up_worker) for _ in range(max(self.max_workers, 1)))
+        )
+        return dict(reports)
+
+    def get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def aanalyze(self, text: str) -> list:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        semaphore = self.get_semaphore()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"No PII analysis slot became free within {self.timeout} seconds") from None
+        future = self.batcher.submit(text)
+        # The slot is held until the analysis is done, even when the request stops waiting for it, so
+        # max_pending also bounds the work queued in the executor
+        future.add_done_callback(lambda _: semaphore.release())
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"PII analysis did not finish within {self.timeout} seconds") from None
+
+    async def analyze_batch(self, texts: List[str]) -> List[list]:
+        """Analyze the texts in a worker as one batch."""
+        logger.debug(f"Analyzing batch of {len(texts)} texts for PII")
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.get_executor(), analyze_batch_in_worker, texts
+            )
+        except BrokenProcessPool:
+            logger.exception("PII analysis worker died, the pool will be restarted")
+            self._executor = None
+            raise
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @classmethod
+    def shutdown_all(cls):
+        for pool in list(cls._pools):
+            pool.shutdown()
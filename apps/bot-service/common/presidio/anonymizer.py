@@ -2,9 +2,9 @@ import json
 import logging
 import traceback
 
-from presidio_analyzer import AnalyzerEngine
-from presidio_analyzer.nlp_engine import NlpEngineProvider
-from presidio_anonymizer import AnonymizerEngine, DeanonymizeEngine
+from common.presidio.engines import DEFAULT_SPACY_MODEL, get_analyzer_engine, get_anonymizer_engine
+from presidio_analyzer import BatchAnalyzerEngine
+from presidio_anonymizer import DeanonymizeEngine
 from presidio_anonymizer.entities import OperatorConfig, OperatorResult
 from pydantic import SecretStr
 
@@ -16,16 +16,17 @@ class Anonymizer:
     def redacted_text_replacement(self, x):
         return str("redacted_value")
 
-    def __init__(self, pii_entitities, mode: str = "CUSTOM", crypto_key: SecretStr = None):
-        configuration = {
-            "nlp_engine_name": "spacy",
-            "models": [
-                {"lang_code": "en", "model_name": "en_core_web_sm"},
-            ],
-        }
-        provider = NlpEngineProvider(nlp_configuration=configuration)
-        self.pii_analyzer = AnalyzerEngine(nlp_engine=provider.create_engine())
-        self.pii_anonymizer = AnonymizerEngine()
+    def __init__(
+        self,
+        pii_entitities,
+        mode: str = "CUSTOM",
+        crypto_key: SecretStr = None,
+        model_name: str = DEFAULT_SPACY_MODEL,
+    ):
+        # The engines are shared by all the Anonymizers of the process
+        self.pii_analyzer = get_analyzer_engine(model_name)
+        self.pii_batch_analyzer = BatchAnalyzerEngine(analyzer_engine=self.pii_analyzer)
+        self.pii_anonymizer = get_anonymizer_engine()
         self.pii_entities = pii_entitities
         self.anonymizer_mode = mode
         self.anonymizer_crypto_key = crypto_key
@@ -46,6 +47,12 @@ class Anonymizer:
         analyzed_text = self.pii_analyzer.analyze(text, entities=self.pii_entities, language="en")
         return analyzed_text
 
+    def analyze_texts(self, texts):
+        """Analyze several texts in one pass of the spaCy pipeline (nlp.pipe)."""
+        return self.pii_batch_analyzer.analyze_iterator(
+            texts, language="en", batch_size=max(len(texts), 1), entities=self.pii_entities
+        )
+
     def anonymize_text(self, input_text):
         analyzed_text = self.analyze_text(input_text)
         anonymized_text = self.pii_anonymizer.anonymize(input_text, analyzed_text, operators=self.operators)
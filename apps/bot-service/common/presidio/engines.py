@@ -0,0 +1,72 @@
+import logging
+import os
+import threading
+from typing import Dict, List
+
+from presidio_analyzer import AnalyzerEngine
+from presidio_analyzer.nlp_engine import NlpEngine, NlpEngineProvider
+from presidio_anonymizer import AnonymizerEngine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPACY_MODEL = "en_core_web_sm"
+
+# Engines of this process, each spaCy model is loaded once however many Anonymizers use it
+_nlp_engines: Dict[str, NlpEngine] = {}
+_analyzer_engines: Dict[str, AnalyzerEngine] = {}
+_anonymizer_engine: List[AnonymizerEngine] = []
+# Resident memory added by loading each model, in bytes
+_model_memory: Dict[str, int] = {}
+_lock = threading.RLock()
+
+
+def get_rss_bytes() -> int:
+    """Return the resident memory of this process."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        # Peak rather than current memory, reported in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_nlp_engine(model_name: str = DEFAULT_SPACY_MODEL) -> NlpEngine:
+    with _lock:
+        if model_name not in _nlp_engines:
+            rss_before = get_rss_bytes()
+            configuration = {
+                "nlp_engine_name": "spacy",
+                "models": [
+                    {"lang_code": "en", "model_name": model_name},
+                ],
+            }
+            provider = NlpEngineProvider(nlp_configuration=configuration)
+            _nlp_engines[model_name] = provider.create_engine()
+            _model_memory[model_name] = max(get_rss_bytes() - rss_before, 0)
+            logger.info(
+                f"Loaded spaCy model {model_name} in process {os.getpid()} using "
+                f"{_model_memory[model_name] / 2**20:.1f} MiB"
+            )
+        return _nlp_engines[model_name]
+
+
+def get_analyzer_engine(model_name: str = DEFAULT_SPACY_MODEL) -> AnalyzerEngine:
+    with _lock:
+        if model_name not in _analyzer_engines:
+            _analyzer_engines[model_name] = AnalyzerEngine(nlp_engine=get_nlp_engine(model_name))
+        return _analyzer_engines[model_name]
+
+
+def get_anonymizer_engine() -> AnonymizerEngine:
+    with _lock:
+        if not _anonymizer_engine:
+            _anonymizer_engine.append(AnonymizerEngine())
+        return _anonymizer_engine[0]
+
+
+def get_model_memory() -> Dict[str, int]:
+    """Return the resident memory in bytes added by each model loaded in this process."""
+    with _lock:
+        return dict(_model_memory)
@@ -0,0 +1,58 @@
+import logging
+import re
+from typing import List, Optional
+
+from presidio_analyzer import PatternRecognizer, RecognizerRegistry
+from presidio_analyzer.predefined_recognizers import SpacyRecognizer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGEX_FLAGS = re.DOTALL | re.MULTILINE | re.IGNORECASE
+
+
+class PIIPrefilter:
+    """Cheap first tier of the PII check that decides whether a text needs the full Presidio analysis.
+
+    The patterns and deny lists of the pattern based recognizers are compiled once and run without the
+    spaCy pipeline, as do the other recognizers that don't need NLP artifacts (e.g. phone numbers).
+    A text is escalated when one of them matches, or when entities only the NER model finds are
+    configured and the text matches ner_trigger_pattern. Without a trigger pattern, the default, every
+    text is escalated as soon as one NER entity is configured, so the prefilter only skips the analysis
+    when all the entities can be found with patterns.
+    """
+
+    def __init__(
+        self,
+        pii_entities: List[str],
+        ner_entities: List[str],
+        ner_trigger_pattern: Optional[str] = None,
+        registry: Optional[RecognizerRegistry] = None,
+    ):
+        self.ner_entities = [entity for entity in pii_entities if entity in ner_entities]
+        self.pattern_entities = [entity for entity in pii_entities if entity not in ner_entities]
+        self.ner_trigger = re.compile(ner_trigger_pattern) if ner_trigger_pattern else None
+        if registry is None:
+            registry = RecognizerRegistry()
+            registry.load_predefined_recognizers(languages=["en"])
+        self.patterns: List[re.Pattern] = []
+        self.recognizers = []
+        if self.pattern_entities:
+            for recognizer in registry.get_recognizers(language="en", entities=self.pattern_entities):
+                if isinstance(recognizer, SpacyRecognizer):
+                    continue
+                if isinstance(recognizer, PatternRecognizer):
+                    flags = getattr(recognizer, "global_regex_flags", None) or DEFAULT_REGEX_FLAGS
+                    self.patterns.extend(re.compile(pattern.regex, flags) for pattern in recognizer.patterns)
+                else:
+                    self.recognizers.append(recognizer)
+        logger.debug(
+            f"PII prefilter with {len(self.patterns)} patterns, {len(self.recognizers)} recognizers "
+            f"and NER entities {self.ner_entities}"
+        )
+
+    def requires_analysis(self, text: str) -> bool:
+        if self.ner_entities and (self.ner_trigger is None or self.ner_trigger.search(text)):
+            return True
+        if any(pattern.search(text) for pattern in self.patterns):
+            return True
+        return any(recognizer.analyze(text, self.pattern_entities, None) for recognizer in self.recognizers)
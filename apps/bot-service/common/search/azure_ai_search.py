@@ -1,17 +1,259 @@
+import asyncio
+import heapq
 import json
 import logging
-from typing import List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
 
 class AzureRAGSearchClient:
-    def __init__(self, api_key: str, api_version: str, search_endpoint: str):
+    def __init__(
+        self,
+        api_key: str,
+        api_version: str,
+        search_endpoint: str,
+        timeout: float = 10.0,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+    ):
         self.search_key = api_key
         self.api_version = api_version
         self.search_endpoint = search_endpoint
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.headers = {
+            "Content-Type": "application/json",
+            "api-key": self.search_key,
+        }
+        self.params = {
+            "api-version": self.api_version,
+        }
+        # Keep-alive pools, the sync one is shared by the worker threads
+        self._session: Optional[requests.Session] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Threads that query the indexes of a sync multi-index search, kept for the life of the client
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_connections, thread_name_prefix="azure-search"
+                )
+            return self._executor
+
+    def get_session(self) -> requests.Session:
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+        return self._session
+
+    def get_async_client(self) -> httpx.AsyncClient:
+        """Return the pooled async client, a new one is created if the event loop changed."""
+        loop = asyncio.get_running_loop()
+        client = self._async_client
+        if client is None or client.is_closed or self._async_client_loop is not loop:
+            self._async_client = httpx.AsyncClient(
+                headers=self.headers,
+                params=self.params,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                ),
+            )
+            self._async_client_loop = loop
+        return self._async_client
+
+    async def aclose(self):
+        if self._async_client is not None and not self._async_client.is_closed:
+            await self._async_client.aclose()
+        self._async_client = None
+        self._async_client_loop = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def get_retry_delay(self, attempt: int) -> float:
+        return self.retry_backoff * (2**attempt)
+
+    def build_search_payload(
+        self,
+        query: str,
+        fields_to_select: str,
+        search_fields: str = "",
+        vector_query_fields: str = "",
+        vector_query_embeddings: List[float] = None,
+        semantic_config: str = "",
+        filter: str = "",
+        k: int = 10,
+        answers: str = "",
+        captions: str = "",
+        highlightPreTag: str = "",
+        highlightPostTag: str = "",
+        count: str = "true",
+        vector_query_weight: int = None,
+    ) -> dict:
+        search_payload = {"select": fields_to_select, "count": count, "top": k}
+        if search_fields != "":
+            search_payload["search"] = query
+            search_payload["searchFields"] = search_fields
+        if vector_query_fields != "":
+            search_payload["queryType"] = "semantic"
+            if vector_query_embeddings:
+                search_payload["vectorQueries"] = [
+                    {
+                        "vector": vector_query_embeddings,
+                        "fields": vector_query_fields,
+                        "kind": "vector",
+                        "k": k,
+                    }
+                ]
+            else:
+                search_payload["vectorQueries"] = [
+                    {
+                        "text": query,
+                        "fields": vector_query_fields,
+                        "kind": "text",
+                        "k": k,
+                        "weight": vector_query_weight,
+                    }
+                ]
+        if semantic_config:
+            search_payload["semanticConfiguration"] = semantic_config
+        if filter:
+            search_payload["filter"] = filter
+        if answers:
+            search_payload["answers"] = answers
+        if captions:
+            search_payload["captions"] = captions
+            if highlightPreTag:
+                search_payload["highlightPreTag"] = highlightPreTag
+            if highlightPostTag:
+                search_payload["highlightPostTag"] = highlightPostTag
+        return search_payload
+
+    def search_index(self, index: str, search_payload: dict) -> dict:
+        """Query one index over the pooled session, retrying throttled and transient failures."""
+        url = f"{self.search_endpoint}/indexes/{index}/docs/search"
+        for attempt in range(self.max_retries + 1):
+            try:
+                resp = self.get_session().post(
+                    url,
+                    data=json.dumps(search_payload),
+                    headers=self.headers,
+                    params=self.params,
+                    timeout=self.timeout,
+                )
+                if resp.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    logger.warning(f"Search on index {index} returned {resp.status_code}, retrying")
+                else:
+                    resp.raise_for_status()
+                    return resp.json()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"Search on index {index} failed with {e}, retrying")
+            time.sleep(self.get_retry_delay(attempt))
+
+    async def asearch_index(self, index: str, search_payload: dict) -> dict:
+        """Query one index over the pooled async client, retrying throttled and transient failures."""
+        url = f"{self.search_endpoint}/indexes/{index}/docs/search"
+        for attempt in range(self.max_retries + 1):
+            try:
+                resp = await self.get_async_client().post(url, json=search_payload)
+                if resp.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    logger.warning(f"Search on index {index} returned {resp.status_code}, retrying")
+                else:
+                    resp.raise_for_status()
+                    return resp.json()
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"Search on index {index} failed with {e}, retrying")
+            await asyncio.sleep(self.get_retry_delay(attempt))
+
+    def collect_results(
+        self,
+        content: dict,
+        index: str,
+        results: dict,
+        id_field: str = "id",
+        reranker_threshold: int = None,
+        index_order: int = 0,
+    ) -> bool:
+        """Fold the results of one index into content keyed by result id.
+
+        content maps each result id to its sort key and result. A document returned by several indexes
+        is kept once with its best score, ties going to the index listed first, so the merged results
+        don't depend on the order the responses arrive in.
+        Returns False if the index response did not contain any results.
+        """
+        if "value" not in results:
+            return False
+        logger.debug(f"found {len(results['value'])} results in index {index}")
+        for result in results["value"]:
+            # Get the unique id of the result
+            result_id = result[id_field] if id_field in result else str(index)
+            if "@search.rerankerScore" not in result:
+                result["@search.rerankerScore"] = 0
+            # Check if the rerankerScore meets the threshold
+            if not reranker_threshold or result["@search.rerankerScore"] > reranker_threshold:
+                key = (result["@search.rerankerScore"], result["@search.score"], -index_order, str(result_id))
+                if result_id not in content or key > content[result_id][0]:
+                    content[result_id] = (key, result)
+            else:
+                logger.debug(f"Reranker Score below threshold for result {result_id}, Skipping")
+        return True
+
+    def select_top_results(self, content: dict, max_results: int) -> List[dict]:
+        """Return up to max_results results ordered by score using a bounded heap."""
+        logger.debug(f"Returning {max_results} results")
+        top_entries = heapq.nlargest(max_results, content.values(), key=lambda entry: entry[0])
+        return [result for _, result in top_entries]
+
+    def merge_results(
+        self,
+        agg_search_results: dict,
+        max_results: int,
+        id_field: str = "id",
+        reranker_threshold: int = None,
+    ) -> List[dict]:
+        """Combine the per-index results and return them ordered by score."""
+        content = dict()
+        found_results = False
+        for index_order, (index, results) in enumerate(agg_search_results.items()):
+            found_results |= self.collect_results(
+                content, index, results, id_field, reranker_threshold, index_order
+            )
+        if not found_results:
+            logger.warning("No results returned")
+            return []
+        return self.select_top_results(content, max_results)
 
     def search(
         self,
@@ -34,98 +276,96 @@ class AzureRAGSearchClient:
         reranker_threshold: int = None,
         vector_query_weight: int = None,
     ) -> List[dict]:
-        print(f"query: {query}")
         """Performs multi-index hybrid search and returns ordered dictionary with the combined results"""
-        headers = {
-            "Content-Type": "application/json",
-            "api-key": self.search_key,
-        }
-        params = {
-            "api-version": self.api_version,
-        }
+        logger.debug(f"query: {query}")
+        search_payload = self.build_search_payload(
+            query,
+            fields_to_select,
+            search_fields=search_fields,
+            vector_query_fields=vector_query_fields,
+            vector_query_embeddings=vector_query_embeddings,
+            semantic_config=semantic_config,
+            filter=filter,
+            k=k,
+            answers=answers,
+            captions=captions,
+            highlightPreTag=highlightPreTag,
+            highlightPostTag=highlightPostTag,
+            count=count,
+            vector_query_weight=vector_query_weight,
+        )
+        logger.debug(f"search_payload: {search_payload}")
 
-        agg_search_results = {}
-        for index in indexes:
-            search_payload = {"select": fields_to_select, "count": count, "top": k}
-            if search_fields != "":
-                search_payload["search"] = query
-                search_payload["searchFields"] = search_fields
-            if vector_query_fields != "":
-                search_payload["queryType"] = "semantic"
-                if vector_query_embeddings:
-                    search_payload["vectorQueries"] = [
-                        {
-                            "vector": vector_query_embeddings,
-                            "fields": vector_query_fields,
-                            "kind": "vector",
-                            "k": k,
-                        }
-                    ]
-                else:
-                    search_payload["vectorQueries"] = [
-                        {
-                            "text": query,
-                            "fields": vector_query_fields,
-                            "kind": "text",
-                            "k": k,
-                            "weight": vector_query_weight,
-                        }
-                    ]
-            if semantic_config:
-                search_payload["semanticConfiguration"] = semantic_config
-            if filter:
-                search_payload["filter"] = filter
-            if answers:
-                search_payload["answers"] = answers
-            if captions:
-                search_payload["captions"] = captions
-                if highlightPreTag:
-                    search_payload["highlightPreTag"] = highlightPreTag
-                if highlightPostTag:
-                    search_payload["highlightPostTag"] = highlightPostTag
-
-            print(f"search_payload: {search_payload}")
-            resp = requests.post(
-                f"{self.search_endpoint}/indexes/{index}/docs/search",
-                data=json.dumps(search_payload),
-                headers=headers,
-                params=params,
-            )
-            search_results = resp.json()
-            print(f"search_results: {search_results}")
-            resp.raise_for_status()
+        if len(indexes) == 1:
+            agg_search_results = {indexes[0]: self.search_index(indexes[0], search_payload)}
+        else:
+            # Query the indexes concurrently so latency follows the slowest index
+            executor = self.get_executor()
+            responses = executor.map(lambda index: self.search_index(index, search_payload), indexes)
+            agg_search_results = dict(zip(indexes, responses))
+
+        return self.merge_results(agg_search_results, max_results, id_field, reranker_threshold)
+
+    async def asearch(
+        self,
+        query: str,
+        indexes: list,
+        fields_to_select: str,
+        max_results: int,
+        id_field: str = "id",
+        search_fields: str = "",
+        vector_query_fields: str = "",
+        vector_query_embeddings: List[float] = None,
+        semantic_config: str = "",
+        filter: str = "",
+        k: int = 10,
+        answers: str = "",
+        captions: str = "",
+        highlightPreTag: str = "",
+        highlightPostTag: str = "",
+        count: str = "true",
+        reranker_threshold: int = None,
+        vector_query_weight: int = None,
+    ) -> List[dict]:
+        """Async version of search that does not need a worker thread"""
+        logger.debug(f"query: {query}")
+        search_payload = self.build_search_payload(
+            query,
+            fields_to_select,
+            search_fields=search_fields,
+            vector_query_fields=vector_query_fields,
+            vector_query_embeddings=vector_query_embeddings,
+            semantic_config=semantic_config,
+            filter=filter,
+            k=k,
+            answers=answers,
+            captions=captions,
+            highlightPreTag=highlightPreTag,
+            highlightPostTag=highlightPostTag,
+            count=count,
+            vector_query_weight=vector_query_weight,
+        )
+        logger.debug(f"search_payload: {search_payload}")
 
-            agg_search_results[index] = search_results
+        async def search_index(index_order, index):
+            return index_order, index, await self.asearch_index(index, search_payload)
 
+        # Query the indexes concurrently and merge each response as soon as it arrives
+        tasks = [
+            asyncio.create_task(search_index(index_order, index)) for index_order, index in enumerate(indexes)
+        ]
         content = dict()
-        if not any("value" in results for results in agg_search_results.values()):
+        found_results = False
+        try:
+            for next_response in asyncio.as_completed(tasks):
+                index_order, index, results = await next_response
+                found_results |= self.collect_results(
+                    content, index, results, id_field, reranker_threshold, index_order
+                )
+        finally:
+            for task in tasks:
+                task.cancel()
+        if not found_results:
             logger.warning("No results returned")
             return []
-
-        for index, results in agg_search_results.items():
-            logger.debug(f"found {len(results['value'])} results in index {index}")
-            if "value" not in results:
-                continue
-            for result in results["value"]:
-                # Get the unique id of the result
-                result_id = result[id_field] if id_field in result else str(index)
-                # Check if the rerankerScore meets the threshold
-                if not reranker_threshold or result["@search.rerankerScore"] > reranker_threshold:
-                    content[result_id] = result
-                else:
-                    logger.debug(
-                        f"Reranker Score below threshold for product number {result[result_id]}, Skipping"
-                    )
-            # Sort results by score in descending order
-            for item in content.values():
-                if "@search.rerankerScore" not in item:
-                    item["@search.rerankerScore"] = 0
-            sorted_results = sorted(
-                content.values(),
-                key=lambda item: (item["@search.rerankerScore"], item["@search.score"]),
-                reverse=True,
-            )
-
-        # Return up to max_results
-        logger.debug(f"Returning {max_results} results")
-        return sorted_results[:max_results]
+        return self.select_top_results(content, max_results)
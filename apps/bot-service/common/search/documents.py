@@ -0,0 +1,165 @@
+import functools
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import tiktoken
+from langchain_core.documents import Document
+
+DEFAULT_ENCODING = "cl100k_base"
+# The indexer splits pages into chunks that overlap by 750 characters, see search_index/create_search_index.py
+MAX_CHUNK_OVERLAP = 750
+# Shortest shared text treated as a chunk overlap rather than a coincidence
+MIN_CHUNK_OVERLAP = 20
+# Used when the tokenizer data can't be loaded, e.g. in environments without access to the download
+CHARACTERS_PER_TOKEN = 4
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = DEFAULT_ENCODING) -> Optional[tiktoken.Encoding]:
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(f"Unable to load tokenizer {encoding_name}, estimating token counts instead: {e}")
+        return None
+
+
+def count_tokens(text: str, encoding_name: str = DEFAULT_ENCODING) -> int:
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return -(-len(text) // CHARACTERS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, encoding_name: str = DEFAULT_ENCODING) -> Tuple[str, int]:
+    """Cut text down to at most max_tokens tokens, returns the text and the number of tokens it uses."""
+    max_tokens = max(max_tokens, 0)
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        text = text[: max_tokens * CHARACTERS_PER_TOKEN]
+        return text, count_tokens(text, encoding_name)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text, len(tokens)
+    return encoding.decode(tokens[:max_tokens]), max_tokens
+
+
+def parse_fields(fields: str) -> List[str]:
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
+
+def search_result_to_document(
+    result: dict,
+    content_fields: List[str],
+    id_field: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    encoding_name: str = DEFAULT_ENCODING,
+    parent_field: Optional[str] = None,
+) -> Document:
+    """Project a raw search hit into a Document.
+
+    The content fields are serialized as compact JSON into page_content, truncated to max_tokens tokens
+    in field order. The id, the parent key and the search scores go to metadata, everything else is dropped.
+    """
+    content = {}
+    remaining_tokens = max_tokens
+    for field in content_fields:
+        value = result.get(field)
+        if value is None:
+            continue
+        if remaining_tokens is not None and isinstance(value, str):
+            value, used_tokens = truncate_to_tokens(value, remaining_tokens, encoding_name)
+            remaining_tokens -= used_tokens
+        content[field] = value
+    metadata = {
+        "score": result.get("@search.score"),
+        "reranker_score": result.get("@search.rerankerScore"),
+    }
+    if id_field and id_field in result:
+        metadata["id"] = result[id_field]
+    if parent_field and result.get(parent_field) is not None:
+        metadata["parent_key"] = result[parent_field]
+    return Document(page_content=json.dumps(content, ensure_ascii=False), metadata=metadata)
+
+
+def find_overlap(
+    earlier: str, later: str, max_overlap: int = MAX_CHUNK_OVERLAP, min_overlap: int = MIN_CHUNK_OVERLAP
+) -> int:
+    """Return the length of the longest suffix of earlier that is also a prefix of later."""
+    if len(later) < min_overlap:
+        return 0
+    anchor = later[:min_overlap]
+    start = earlier.find(anchor, max(len(earlier) - max_overlap, 0))
+    while start != -1:
+        overlap = len(earlier) - start
+        if later.startswith(earlier[start:]):
+            return overlap
+        start = earlier.find(anchor, start + 1)
+    return 0
+
+
+def remove_chunk_overlap(
+    results: List[dict],
+    chunk_field: str,
+    parent_field: str,
+    max_overlap: int = MAX_CHUNK_OVERLAP,
+) -> List[dict]:
+    """Strip the text a chunk shares with higher scoring chunks of the same parent document.
+
+    Results must be ordered by score. Chunks that are fully covered by a higher scoring chunk are dropped,
+    the results are copied so cached search results are left untouched.
+    """
+    kept_chunks: Dict[str, List[str]] = {}
+    deduplicated = []
+    for result in results:
+        parent_key = result.get(parent_field)
+        chunk = result.get(chunk_field)
+        if parent_key is None or not isinstance(chunk, str):
+            deduplicated.append(result)
+            continue
+        original_chunk = chunk
+        siblings = kept_chunks.setdefault(parent_key, [])
+        for sibling in siblings:
+            if chunk in sibling:
+                chunk = ""
+                break
+            # The sibling either precedes or follows this chunk in the parent document
+            chunk = chunk[find_overlap(sibling, chunk, max_overlap) :]
+            overlap = find_overlap(chunk, sibling, max_overlap)
+            if overlap:
+                chunk = chunk[:-overlap]
+        if not chunk.strip():
+            logger.debug(f"Dropping search result covered by other chunks of {parent_key}")
+            continue
+        siblings.append(original_chunk)
+        deduplicated.append({**result, chunk_field: chunk} if chunk != original_chunk else result)
+    return deduplicated
+
+
+def pack_documents(
+    documents: List[Document], max_tokens: Optional[int], encoding_name: str = DEFAULT_ENCODING
+) -> List[Document]:
+    """Keep the highest scoring documents that fit in max_tokens tokens.
+
+    Documents must be ordered by score. A document that doesn't fit is skipped so smaller, lower
+    scoring documents can still use the rest of the budget.
+    """
+    if max_tokens is None:
+        return documents
+    packed = []
+    remaining_tokens = max_tokens
+    for document in documents:
+        tokens = count_tokens(document.page_content, encoding_name)
+        if tokens <= remaining_tokens:
+            packed.append(document)
+            remaining_tokens -= tokens
+    if len(packed) < len(documents):
+        logger.debug(f"Packed {len(packed)} of {len(documents)} search results into {max_tokens} tokens")
+    return packed
+
+
+def format_documents(documents: List[Document]) -> str:
+    """Join the JSON page contents of the documents into the JSON array handed to the model."""
+    return "[" + ",".join(document.page_content for document in documents) + "]"
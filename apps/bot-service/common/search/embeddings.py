@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Any, Callable, Hashable, List, Optional
+
+import numpy as np
+from common.batching import MicroBatcher
+from common.cache import CacheBackend, TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteEmbeddingStore(CacheBackend):
+    """Embedding store persisted in a local SQLite file so vectors survive restarts."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._connection.commit()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            row = self._connection.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def set(self, key: Hashable, value: Any):
+        vector = np.asarray(value, dtype=np.float32).tobytes()
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", (key, vector))
+            self._connection.commit()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        value = self.get(key, default)
+        with self._lock:
+            self._connection.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+            self._connection.commit()
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM embeddings")
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class QueryEmbedder:
+    """Embeds search queries with a reused client, a content hash keyed cache and request batching.
+
+    Concurrent calls to aembed that arrive within batch_window seconds of each other are sent to the
+    embeddings API as a single request of up to max_batch_size inputs.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        client_factory: Callable[[], Any],
+        async_client_factory: Callable[[], Any],
+        max_entries: int = 5000,
+        persist_path: Optional[str] = None,
+        batch_window: float = 0.01,
+        max_batch_size: int = 16,
+    ):
+        self.model = model
+        self.client_factory = client_factory
+        self.async_client_factory = async_client_factory
+        self.cache = TTLCache(max_entries=max_entries)
+        self.store = SqliteEmbeddingStore(persist_path) if persist_path else None
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.api_calls = 0
+        self._client = None
+        self._async_client = None
+        self._async_client_loop = None
+        self.batcher = MicroBatcher(
+            self.embed_batch, batch_window=batch_window, max_batch_size=max_batch_size
+        )
+
+    def make_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}:{text}".encode("utf-8")).hexdigest()
+
+    def get_cached(self, key: str) -> Optional[List[float]]:
+        vector = self.cache.get(key)
+        if vector is None and self.store is not None:
+            vector = self.store.get(key)
+            if vector is not None:
+                self.cache.set(key, vector)
+        return vector
+
+    def set_cached(self, key: str, vector: List[float]):
+        self.cache.set(key, vector)
+        if self.store is not None:
+            self.store.set(key, vector)
+
+    def get_client(self):
+        if self._client is None:
+            self._client = self.client_factory()
+        return self._client
+
+    def get_async_client(self):
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            self._async_client = self.async_client_factory()
+            self._async_client_loop = loop
+        return self._async_client
+
+    def embed(self, text: str) -> List[float]:
+        key = self.make_key(text)
+        vector = self.get_cached(key)
+        if vector is None:
+            self.api_calls += 1
+            vector = self.get_client().embeddings.create(input=[text], model=self.model).data[0].embedding
+            self.set_cached(key, vector)
+        return vector
+
+    async def aembed(self, text: str) -> List[float]:
+        key = self.make_key(text)
+        vector = self.get_cached(key)
+        if vector is not None:
+            return vector
+        # Requests for the same text that are already queued share one future
+        return await asyncio.shield(self.batcher.submit(text, key=key))
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed the texts with one request to the embeddings API."""
+        logger.debug(f"Embedding batch of {len(texts)} queries")
+        self.api_calls += 1
+        response = await self.get_async_client().embeddings.create(input=texts, model=self.model)
+        vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        for text, vector in zip(texts, vectors):
+            self.set_cached(self.make_key(text), vector)
+        return vectors
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "api_calls": self.api_calls}
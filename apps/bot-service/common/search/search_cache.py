@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+from common.cache import CacheBackend, TTLCache, normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+class SearchResultCache:
+    """Cache of search results keyed on the normalized query and the search configuration.
+
+    Exact lookups go to the backend. When a similarity threshold is set, queries that miss are embedded
+    and compared with the recent queries of the same search configuration, so the results of a
+    near-duplicate query are reused.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        max_entries: int = 1000,
+        ttl: Optional[float] = 300,
+        similarity_threshold: Optional[float] = None,
+    ):
+        self.backend = backend if backend is not None else TTLCache(max_entries=max_entries, ttl=ttl)
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        # Recent query embeddings per search configuration, oldest first
+        self._embeddings: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_scope(self, indexes: List[str], search_kwargs: dict) -> str:
+        """Hash everything except the query that changes the results of a search."""
+        scope = json.dumps({"indexes": indexes, **search_kwargs}, sort_keys=True, default=str)
+        return hashlib.sha256(scope.encode("utf-8")).hexdigest()
+
+    def make_key(self, query: str, scope: str) -> str:
+        return hashlib.sha256(f"{scope}:{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def get(self, query: str, scope: str) -> Optional[list]:
+        results = self.backend.get(self.make_key(query, scope))
+        self.record(results is not None)
+        return results
+
+    def set(self, query: str, scope: str, results: list):
+        self.backend.set(self.make_key(query, scope), results)
+
+    async def aget(
+        self, query: str, scope: str, embed: Optional[Callable[[str], Awaitable[List[float]]]] = None
+    ) -> Optional[list]:
+        key = self.make_key(query, scope)
+        results = await self.backend.aget(key)
+        if results is None and self.similarity_threshold and embed is not None:
+            try:
+                vector = self.normalize(await embed(normalize_query(query)))
+            except Exception as e:
+                logger.warning(f"Unable to embed query for the similarity cache: {e}")
+                vector = None
+            if vector is not None:
+                similar_key = self.find_similar(scope, vector)
+                if similar_key is not None:
+                    results = await self.backend.aget(similar_key)
+                    if results is not None:
+                        self.similar_hits += 1
+                        # The next identical query is answered by the exact lookup
+                        await self.backend.aset(key, results)
+                self.remember_embedding(scope, key, vector)
+        self.record(results is not None)
+        return results
+
+    async def aset(self, query: str, scope: str, results: list):
+        await self.backend.aset(self.make_key(query, scope), results)
+
+    def record(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def normalize(self, vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def find_similar(self, scope: str, vector: np.ndarray) -> Optional[str]:
+        with self._lock:
+            candidates = [
+                (key, other) for (other_scope, key), other in self._embeddings.items() if other_scope == scope
+            ]
+        if not candidates:
+            return None
+        similarities = np.stack([other for _, other in candidates]) @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            logger.debug(f"Found similar cached query with similarity {similarities[best]}")
+            return candidates[best][0]
+        return None
+
+    def remember_embedding(self, scope: str, key: str, vector: np.ndarray):
+        with self._lock:
+            self._embeddings[(scope, key)] = vector
+            self._embeddings.move_to_end((scope, key))
+            while len(self._embeddings) > self.max_entries:
+                self._embeddings.popitem(last=False)
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self._embeddings.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "similar_hits": self.similar_hits, "misses": self.misses}
@@ -0,0 +1,50 @@
+import copy
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+from common.cache import CacheBackend, TTLCache, normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+class VerdictCache:
+    """Cache of guardrail verdicts keyed on the normalized text and the configuration of the check.
+
+    The configuration that decides a verdict (thresholds, topics, API version, ...) is hashed into the
+    key, so changing it starts from an empty cache for that check while the old entries expire.
+    Failed checks are never cached.
+    """
+
+    def __init__(
+        self, backend: Optional[CacheBackend] = None, max_entries: int = 5000, ttl: Optional[float] = 600
+    ):
+        self.backend = backend if backend is not None else TTLCache(max_entries=max_entries, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, check: str, text: str, config: dict) -> str:
+        scope = json.dumps({"check": check, **config}, sort_keys=True, default=str)
+        return hashlib.sha256(f"{scope}:{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    async def aget_or_compute(
+        self, check: str, text: str, config: dict, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        key = self.make_key(check, text, config)
+        verdict = await self.backend.aget(key)
+        if verdict is not None:
+            self.hits += 1
+            logger.debug(f"Verdict cache hit for {check}")
+        else:
+            self.misses += 1
+            verdict = await compute()
+            await self.backend.aset(key, verdict)
+        # Callers may change the verdict they get back, the cached one stays as it was
+        return copy.deepcopy(verdict)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,62 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from api.anonymize_decorator import Anonymizer
+from api.models import Payload
+from app.settings import AppSettings
+from common import Singleton
+
+config = {"configurable": {"session_id": "session_id", "user_id": "user_id"}}
+
+
+def make_payload(*contents):
+    roles = ["user", "assistant"]
+    messages = [{"role": roles[i % 2], "content": content} for i, content in enumerate(contents)]
+    return Payload(input={"messages": messages}, config=config)
+
+
+class TestAnonymizer(unittest.IsolatedAsyncioTestCase):
+
+    def make_anonymizer(self, **settings):
+        Singleton._instances.pop(Anonymizer, None)
+        app_settings = AppSettings(load_environment_config=False, **settings)
+        with patch("api.anonymize_decorator.AppSettings", return_value=app_settings):
+            anonymizer = Anonymizer()
+        Singleton._instances.pop(Anonymizer, None)
+        anonymizer.analyzer_pool.aanalyze = AsyncMock(side_effect=lambda text: [text])
+        return anonymizer
+
+    async def test_last_message_only(self):
+        anonymizer = self.make_anonymizer()
+
+        question, results = await anonymizer.anonymize_input(make_payload("first", "answer", "second"))
+
+        self.assertEqual(question, "second")
+        self.assertEqual(results, ["second"])
+
+    async def test_possible_locations_are_analyzed(self):
+        anonymizer = self.make_anonymizer()
+
+        for question in ["Seattle store hours?", "is there a store near springfield"]:
+            _, results = await anonymizer.anonymize_input(make_payload(question))
+
+            self.assertEqual(results, [question])
+            anonymizer.analyzer_pool.aanalyze.assert_awaited_with(question)
+
+    async def test_history_is_analyzed_incrementally(self):
+        anonymizer = self.make_anonymizer(anonymizer_check_history=True)
+
+        _, results = await anonymizer.anonymize_input(make_payload("first", "answer", "second"))
+        self.assertEqual(sorted(results), ["first", "second"])
+
+        payload = make_payload("first", "answer", "second", "answer", "third")
+        _, results = await anonymizer.anonymize_input(payload)
+        self.assertEqual(sorted(results), ["first", "second", "third"])
+        self.assertEqual(
+            sorted(call.args[0] for call in anonymizer.analyzer_pool.aanalyze.call_args_list),
+            ["first", "second", "third"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -57,6 +57,16 @@ class TestApp(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(' '.join(GENERIC_ERROR_MESSAGE.split()[:2]), response.text)
 
+    def test_payload_is_passed_to_runnable(self):
+        client = TestClient(app)
+        config = {"configurable": {"session_id": "session_id", "user_id": "user_id", "thread_id": "thread"}}
+        messages = [{"role": "user", "content": "how do I remove a coffee stain?"}]
+
+        response = client.post("/invoke", json={"input": {"messages": messages}, "config": config})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["output"], {"messages": messages})
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,335 @@
+import copy
+import unittest
+from unittest.mock import patch
+
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+from botify_langchain.async_cosmos_db_chat_message_history import AsyncCosmosDBChatMessageHistory
+from botify_langchain.session_history_cache import SessionHistoryCache
+from langchain_core.messages import AIMessage, HumanMessage
+
+
+class FakeContainer:
+    """In-memory stand-in for the async container client that records the requests it receives."""
+
+    def __init__(self):
+        self.items = {}
+        self.requests = []
+        self.versions = 0
+
+    def new_etag(self):
+        self.versions += 1
+        return f"etag-{self.versions}"
+
+    async def create_item(self, body):
+        self.requests.append(("create", len(body["messages"])))
+        key = (body["user_id"], body["id"])
+        if key in self.items:
+            raise CosmosResourceExistsError()
+        self.items[key] = {**body, "_etag": self.new_etag()}
+        return dict(self.items[key])
+
+    async def patch_item(self, item, partition_key, patch_operations, etag=None, match_condition=None):
+        self.requests.append(("patch", len(patch_operations)))
+        stored = self.items.get((partition_key, item))
+        if stored is None:
+            raise CosmosResourceNotFoundError()
+        if etag is not None and etag != stored["_etag"]:
+            raise CosmosAccessConditionFailedError()
+        for operation in patch_operations:
+            if operation["op"] == "set":
+                stored[operation["path"].lstrip("/")] = operation["value"]
+            else:
+                assert operation["op"] == "add" and operation["path"] == "/messages/-"
+                stored["messages"].append(operation["value"])
+        stored["_etag"] = self.new_etag()
+        return dict(stored)
+
+    async def read_item(self, item, partition_key, etag=None, match_condition=None):
+        self.requests.append(("read", item))
+        stored = self.items.get((partition_key, item))
+        if stored is None:
+            raise CosmosResourceNotFoundError()
+        if match_condition == MatchConditions.IfModified and etag == stored["_etag"]:
+            # Not modified, the service answers with a 304 and no item
+            return {}
+        return copy.deepcopy(stored)
+
+    def query_items(self, query, parameters, partition_key):
+        values = {parameter["name"]: parameter["value"] for parameter in parameters}
+        stored = self.items.get((partition_key, values["@id"]))
+        self.requests.append(("query", query))
+
+        async def results():
+            if stored is not None:
+                limit = values.get("@limit")
+                yield {
+                    "messages": stored["messages"][-limit:] if limit else stored["messages"],
+                    "message_count": len(stored["messages"]),
+                    "session_start_ts": stored["session_start_ts"],
+                    "summary": stored.get("summary"),
+                    "summarized_count": stored.get("summarized_count"),
+                    "_etag": stored["_etag"],
+                }
+
+        return results()
+
+    async def delete_item(self, item, partition_key):
+        if self.items.pop((partition_key, item), None) is None:
+            raise CosmosResourceNotFoundError()
+
+
+def make_history(container, session_id="session", history_limit=4, session_cache=None):
+    history = AsyncCosmosDBChatMessageHistory(
+        cosmos_endpoint="https://localhost:8081",
+        cosmos_database="database",
+        cosmos_container="container",
+        session_id=session_id,
+        user_id="user",
+        connection_string="connection_string",
+        history_limit=history_limit,
+        session_cache=session_cache,
+    )
+    patcher = patch.object(history, "get_container", return_value=container)
+    patcher.start()
+    return history, patcher
+
+
+def make_turn(index):
+    return [HumanMessage(content=f"question {index}"), AIMessage(content=f"answer {index}")]
+
+
+class HistoryTestCase(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.container = FakeContainer()
+        self.patchers = []
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def history(self, **kwargs):
+        history, patcher = make_history(self.container, **kwargs)
+        self.patchers.append(patcher)
+        return history
+
+
+class TestAsyncCosmosDBChatMessageHistory(HistoryTestCase):
+
+    async def test_new_session_is_created_then_appended(self):
+        history = self.history()
+        self.assertEqual(await history.aget_messages(), [])
+
+        await history.aadd_messages(make_turn(1))
+        await history.aadd_messages(make_turn(2))
+
+        self.assertEqual([request[0] for request in self.container.requests], ["query", "create", "patch"])
+        stored = self.container.items[("user", "session")]
+        self.assertEqual(len(stored["messages"]), 4)
+        self.assertIsNotNone(stored["session_start_ts"])
+        self.assertEqual(history.get_session_turn_count(), 2)
+
+    async def test_reads_are_bounded_to_history_limit(self):
+        writer = self.history()
+        for index in range(5):
+            await writer.aadd_messages(make_turn(index))
+
+        reader = self.history()
+        messages = await reader.aget_messages()
+
+        self.assertEqual(
+            [message.content for message in messages], ["question 3", "answer 3", "question 4", "answer 4"]
+        )
+        # The turn count still covers the whole session
+        self.assertEqual(reader.get_session_turn_count(), 5)
+        self.assertEqual(reader.session_start_timestamp, writer.session_start_timestamp)
+        self.assertIn("ARRAY_SLICE", self.container.requests[-1][1])
+
+    async def test_messages_keep_the_last_history_limit_after_append(self):
+        history = self.history(history_limit=2)
+        await history.aadd_messages(make_turn(1) + make_turn(2))
+
+        self.assertEqual([message.content for message in history.messages], ["question 2", "answer 2"])
+        self.assertEqual(history.message_count, 4)
+
+    async def test_large_appends_are_split_into_patch_batches(self):
+        history = self.history()
+        await history.aget_messages()
+        await history.aadd_messages(make_turn(0))
+        await history.aadd_messages([message for index in range(1, 7) for message in make_turn(index)])
+
+        self.assertEqual(self.container.requests[1:], [("create", 2), ("patch", 10), ("patch", 2)])
+        self.assertEqual(len(self.container.items[("user", "session")]["messages"]), 14)
+
+    async def test_concurrent_session_start_appends_to_existing_item(self):
+        first = self.history()
+        second = self.history()
+        await first.aadd_messages(make_turn(1))
+        await second.aadd_messages(make_turn(2))
+
+        self.assertEqual(len(self.container.items[("user", "session")]["messages"]), 4)
+
+    async def test_existing_session_is_patched_without_a_read(self):
+        await self.history().aadd_messages(make_turn(1) + make_turn(2))
+        self.container.requests.clear()
+
+        history = self.history()
+        await history.aadd_messages(make_turn(3))
+
+        self.assertEqual(self.container.requests, [("patch", 2)])
+        self.assertEqual(history.message_count, 6)
+        self.assertEqual(history.get_session_turn_count(), 3)
+
+    async def test_expired_session_is_started_again(self):
+        history = self.history()
+        await history.aadd_messages(make_turn(1))
+        self.container.items.clear()
+
+        await history.aadd_messages(make_turn(2))
+
+        stored = self.container.items[("user", "session")]
+        self.assertEqual(
+            [message["data"]["content"] for message in stored["messages"]], ["question 2", "answer 2"]
+        )
+
+    async def test_session_deleted_mid_session_keeps_no_stale_messages(self):
+        history = self.history()
+        await history.aget_messages()
+        await history.aadd_messages(make_turn(1) + make_turn(2))
+        await history.aset_summary("The user asked two questions.", 2)
+        self.container.items.clear()
+        self.container.requests.clear()
+
+        await history.aadd_messages(make_turn(3))
+
+        self.assertEqual([request[0] for request in self.container.requests], ["patch", "create"])
+        self.assertEqual([message.content for message in history.messages], ["question 3", "answer 3"])
+        self.assertEqual(history.message_count, 2)
+        self.assertIsNone(history.summary)
+        self.assertEqual(history.summarized_count, 0)
+
+    async def test_summary_is_stored_with_the_session(self):
+        writer = self.history()
+        for index in range(3):
+            await writer.aadd_messages(make_turn(index))
+        await writer.aset_summary("The user asked three questions.", 4)
+
+        reader = self.history()
+        await reader.aget_messages()
+
+        self.assertEqual(reader.summary, "The user asked three questions.")
+        self.assertEqual(reader.summarized_count, 4)
+        self.assertEqual(len(self.container.items[("user", "session")]["messages"]), 6)
+        self.assertEqual(
+            [message.content for message in reader.get_unsummarized_messages()], ["question 2", "answer 2"]
+        )
+
+    async def test_clear_removes_the_session(self):
+        history = self.history()
+        await history.aadd_messages(make_turn(1))
+        await history.aclear()
+
+        self.assertEqual(self.container.items, {})
+        self.assertEqual(history.get_session_turn_count(), 0)
+
+    async def test_sync_methods_point_to_the_async_ones(self):
+        history = self.history()
+
+        with self.assertRaisesRegex(NotImplementedError, "aadd_messages"):
+            history.add_messages(make_turn(1))
+        with self.assertRaisesRegex(NotImplementedError, "aclear"):
+            history.clear()
+        self.assertEqual(self.container.requests, [])
+
+
+class TestSessionHistoryCache(HistoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = SessionHistoryCache()
+
+    def request_types(self):
+        return [request[0] for request in self.container.requests]
+
+    async def test_cached_history_is_used_while_etag_matches(self):
+        writer = self.history(session_cache=self.cache)
+        await writer.aget_messages()
+        await writer.aadd_messages(make_turn(1))
+        self.container.requests.clear()
+
+        reader = self.history(session_cache=self.cache)
+        messages = await reader.aget_messages()
+
+        self.assertEqual([message.content for message in messages], ["question 1", "answer 1"])
+        self.assertEqual(reader.get_session_turn_count(), 1)
+        # A conditional point read answered with a 304, no query
+        self.assertEqual(self.request_types(), ["read"])
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    async def test_write_from_another_replica_invalidates_the_cache(self):
+        writer = self.history(session_cache=self.cache)
+        await writer.aadd_messages(make_turn(1))
+        # Another replica appends a turn with its own cache
+        other = self.history(session_cache=SessionHistoryCache())
+        await other.aget_messages()
+        await other.aadd_messages(make_turn(2))
+        self.container.requests.clear()
+
+        reader = self.history(session_cache=self.cache)
+        messages = await reader.aget_messages()
+
+        self.assertEqual(len(messages), 4)
+        self.assertEqual(reader.get_session_turn_count(), 2)
+        # The point read returns the changed item, it isn't queried again
+        self.assertEqual(self.request_types(), ["read"])
+        self.assertEqual(self.cache.stats()["stale"], 1)
+        self.assertEqual(self.cache.get("user", "session")["etag"], reader.etag)
+
+    async def test_expired_session_is_not_served_from_the_cache(self):
+        writer = self.history(session_cache=self.cache)
+        await writer.aadd_messages(make_turn(1))
+        self.container.items.clear()
+
+        reader = self.history(session_cache=self.cache)
+
+        self.assertEqual(await reader.aget_messages(), [])
+        self.assertEqual(reader.get_session_turn_count(), 0)
+        self.assertIsNone(self.cache.get("user", "session"))
+
+    async def test_conflicting_append_is_written_and_reloaded(self):
+        writer = self.history(session_cache=self.cache)
+        await writer.aadd_messages(make_turn(1))
+        other = self.history(session_cache=SessionHistoryCache())
+        await other.aget_messages()
+        await other.aadd_messages(make_turn(2))
+
+        await writer.aadd_messages(make_turn(3))
+
+        stored = self.container.items[("user", "session")]
+        self.assertEqual(len(stored["messages"]), 6)
+        self.assertIsNone(self.cache.get("user", "session"))
+        reader = self.history(session_cache=self.cache)
+        self.assertEqual(
+            [message.content for message in await reader.aget_messages()],
+            ["question 2", "answer 2", "question 3", "answer 3"],
+        )
+        self.assertEqual(reader.get_session_turn_count(), 3)
+
+    async def test_snapshots_are_trusted_without_etag_validation(self):
+        cache = SessionHistoryCache(validate_etag=False)
+        writer = self.history(session_cache=cache)
+        await writer.aadd_messages(make_turn(1))
+        self.container.requests.clear()
+
+        await self.history(session_cache=cache).aget_messages()
+
+        self.assertEqual(self.container.requests, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
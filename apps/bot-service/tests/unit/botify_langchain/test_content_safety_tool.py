@@ -0,0 +1,70 @@
+import asyncio
+import os
+import unittest
+from unittest.mock import patch
+
+os.environ["LOG_LEVEL"] = "DEBUG"
+os.environ["AZURE_OPENAI_API_VERSION"] = "2024-06-01"
+os.environ["OPENAI_API_VERSION"] = "2024-06-01"
+os.environ["AZURE_COSMOSDB_ENDPOINT"] = "https://localhost:8081"
+os.environ["AZURE_COSMOSDB_NAME"] = "database"
+os.environ["AZURE_COSMOSDB_CONTAINER_NAME"] = "container"
+os.environ["AZURE_COSMOSDB_CONNECTION_STRING"] = "connection_string"
+os.environ["AZURE_SEARCH_ENDPOINT"] = "https://localhost:8081"
+os.environ["AZURE_SEARCH_KEY"] = "key"
+os.environ["AZURE_SEARCH_API_VERSION"] = "api_version"
+os.environ["AZURE_SEARCH_INDEX_NAME"] = "index_name"
+os.environ["AZURE_OPENAI_ENDPOINT"] = "https://localhost:8081"
+os.environ["AZURE_OPENAI_API_KEY"] = "key"
+os.environ["AZURE_OPENAI_MODEL_NAME"] = "model_name"
+os.environ["AZURE_OPENAI_CLASSIFIER_MODEL_NAME"] = "model_name"
+os.environ["CONTENT_SAFETY_ENDPOINT"] = "DEBUG"
+os.environ["CONTENT_SAFETY_KEY"] = "key"
+
+import httpx
+from botify_langchain.tools.azure_content_safety_tool import AzureContentSafety_Tool
+
+
+class TestContentSafetyTool(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncTearDown(self):
+        await AzureContentSafety_Tool.aclose()
+
+    async def test_client_is_reused(self):
+        client = AzureContentSafety_Tool.get_async_client()
+
+        self.assertIs(AzureContentSafety_Tool.get_async_client(), client)
+        await AzureContentSafety_Tool.aclose()
+        self.assertIsNot(AzureContentSafety_Tool.get_async_client(), client)
+
+    async def test_checks_are_sent_concurrently(self):
+        in_flight = []
+        max_in_flight = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            in_flight.append(request.url.path)
+            max_in_flight.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(request.url.path)
+            if request.url.path.endswith("shieldPrompt"):
+                return httpx.Response(200, json={"userPromptAnalysis": {"attackDetected": False}})
+            return httpx.Response(200, json={"categoriesAnalysis": []})
+
+        AzureContentSafety_Tool.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        AzureContentSafety_Tool.http_client_loop = asyncio.get_running_loop()
+
+        tool = AzureContentSafety_Tool
+        with (
+            patch.object(tool, "prompt_shield_endpoint", "https://localhost/text:shieldPrompt"),
+            patch.object(tool, "harmful_text_analysis_endpoint", "https://localhost/text:analyze"),
+        ):
+            result = await AzureContentSafety_Tool()._arun("hello")
+
+        shield_response = result["prompt_shield_validation_response"]
+        self.assertEqual(shield_response["userPromptAnalysis"], {"attackDetected": False})
+        self.assertEqual(result["analyzed_harmful_text_response"], {"categoriesAnalysis": []})
+        self.assertEqual(max(max_in_flight), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
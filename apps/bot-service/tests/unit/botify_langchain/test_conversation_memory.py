@@ -0,0 +1,196 @@
+import asyncio
+import os
+import unittest
+from unittest.mock import AsyncMock, Mock, patch
+
+os.environ["LOG_LEVEL"] = "DEBUG"
+os.environ["AZURE_OPENAI_API_VERSION"] = "2024-06-01"
+os.environ["OPENAI_API_VERSION"] = "2024-06-01"
+os.environ["AZURE_COSMOSDB_ENDPOINT"] = "https://localhost:8081"
+os.environ["AZURE_COSMOSDB_NAME"] = "database"
+os.environ["AZURE_COSMOSDB_CONTAINER_NAME"] = "container"
+os.environ["AZURE_COSMOSDB_CONNECTION_STRING"] = "connection_string"
+os.environ["AZURE_SEARCH_ENDPOINT"] = "https://localhost:8081"
+os.environ["AZURE_SEARCH_KEY"] = "key"
+os.environ["AZURE_SEARCH_API_VERSION"] = "api_version"
+os.environ["AZURE_SEARCH_INDEX_NAME"] = "index_name"
+os.environ["AZURE_OPENAI_ENDPOINT"] = "https://localhost:8081"
+os.environ["AZURE_OPENAI_API_KEY"] = "key"
+os.environ["AZURE_OPENAI_MODEL_NAME"] = "model_name"
+os.environ["AZURE_OPENAI_CLASSIFIER_MODEL_NAME"] = "model_name"
+os.environ["CONTENT_SAFETY_ENDPOINT"] = "DEBUG"
+os.environ["CONTENT_SAFETY_KEY"] = "key"
+
+from app.settings import AppSettings
+from botify_langchain.async_cosmos_db_chat_message_history import AsyncCosmosDBChatMessageHistory
+from botify_langchain.conversation_memory import ConversationMemory
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+
+def make_turn(index, words=1):
+    return [
+        HumanMessage(content=" ".join([f"question {index}"] * words)),
+        AIMessage(content=" ".join([f"answer {index}"] * words)),
+    ]
+
+
+class TestConversationMemory(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.app_settings = AppSettings()
+        self.app_settings.history_limit = 10
+
+    def make_memory(self, stored_messages, message_count=None):
+        memory = ConversationMemory(self.app_settings)
+        history = Mock(user_id="user", session_id="session")
+        history.aget_messages = AsyncMock(return_value=stored_messages)
+        history.get_session_turn_count.return_value = (message_count or len(stored_messages)) / 2
+        history.aadd_messages = AsyncMock()
+        patcher = patch.object(memory, "get_history", return_value=history)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return memory, history
+
+    async def test_load_returns_history_and_turn_count(self):
+        memory, _ = self.make_memory(make_turn(1) + make_turn(2), message_count=8)
+
+        messages, turn_count = await memory.load("user", "session")
+
+        self.assertEqual(len(messages), 4)
+        self.assertEqual(turn_count, 4)
+
+    async def test_load_includes_queued_messages(self):
+        self.app_settings.history_write_batch_window_ms = 200
+        memory, history = self.make_memory(make_turn(1))
+        await memory.save("user", "session", make_turn(2))
+
+        messages, turn_count = await memory.load("user", "session")
+
+        history.aadd_messages.assert_not_awaited()
+        self.assertEqual([message.content for message in messages][-1], "answer 2")
+        self.assertEqual(turn_count, 2)
+        await memory.writer.flush()
+        history.aadd_messages.assert_awaited_once()
+
+    async def test_flush_keeps_the_cosmos_client_open(self):
+        self.app_settings.history_write_batch_window_ms = 200
+        memory, history = self.make_memory([])
+        await memory.save("user", "session", make_turn(1))
+
+        with patch.object(AsyncCosmosDBChatMessageHistory, "aclose", new_callable=AsyncMock) as aclose:
+            await memory.flush()
+            history.aadd_messages.assert_awaited_once()
+            aclose.assert_not_awaited()
+            await memory.aclose()
+            aclose.assert_awaited_once()
+
+    async def test_save_writes_inline_without_write_behind(self):
+        self.app_settings.history_write_behind = False
+        memory, history = self.make_memory([])
+
+        await memory.save("user", "session", make_turn(1))
+
+        history.aadd_messages.assert_awaited_once()
+
+    def test_trim_keeps_the_latest_turns_within_budget(self):
+        memory = ConversationMemory(self.app_settings)
+        messages = make_turn(1, words=50) + make_turn(2, words=5) + make_turn(3, words=5)
+
+        window = memory.trim(messages, max_tokens=100)
+
+        self.assertEqual([message.content.split()[1] for message in window], ["2", "2", "3", "3"])
+
+    def test_trim_starts_the_window_at_a_question(self):
+        memory = ConversationMemory(self.app_settings)
+        messages = make_turn(1, words=5) + make_turn(2, words=5)
+
+        window = memory.trim(messages[1:], max_tokens=100)
+
+        self.assertIsInstance(window[0], HumanMessage)
+        self.assertEqual(len(window), 2)
+
+    def test_trim_keeps_the_summary(self):
+        memory = ConversationMemory(self.app_settings)
+        summary = SystemMessage(content="Summary of the earlier conversation: the user likes burgers")
+        messages = [summary] + make_turn(1, words=50) + make_turn(2, words=5)
+
+        window = memory.trim(messages, max_tokens=50)
+
+        self.assertEqual(window[0], summary)
+        self.assertEqual(len(window), 3)
+
+    def test_trim_without_budget_keeps_everything(self):
+        memory = ConversationMemory(self.app_settings)
+        messages = make_turn(1) + make_turn(2)
+
+        self.assertEqual(memory.trim(messages, max_tokens=0), messages)
+
+
+class TestConversationSummarization(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.app_settings = AppSettings()
+        self.app_settings.history_limit = 10
+        self.app_settings.history_summarization = True
+        self.app_settings.history_summary_keep_messages = 2
+        self.app_settings.history_summary_token_threshold = 1000
+        self.memory = ConversationMemory(self.app_settings)
+        self.memory.summarizer = Mock()
+        self.memory.summarizer.asummarize = AsyncMock(return_value="The user asked about the menu.")
+
+    def make_history(self, messages, message_count, summary=None, summarized_count=0):
+        history = Mock(user_id="user", session_id="session", summary=summary, message_count=message_count)
+        history.aget_messages = AsyncMock(return_value=messages)
+        history.get_session_turn_count.return_value = message_count / 2
+        history.get_unsummarized_messages.return_value = messages[summarized_count - message_count :]
+        history.aset_summary = AsyncMock()
+        patcher = patch.object(self.memory, "get_history", return_value=history)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return history
+
+    async def test_prompt_carries_summary_and_recent_turns(self):
+        messages = make_turn(1) + make_turn(2) + make_turn(3)
+        self.make_history(messages, message_count=20, summary="Earlier turns", summarized_count=18)
+
+        loaded, turn_count = await self.memory.load("user", "session")
+
+        self.assertIsInstance(loaded[0], SystemMessage)
+        self.assertIn("Earlier turns", loaded[0].content)
+        self.assertEqual([message.content for message in loaded[1:]], ["question 3", "answer 3"])
+        self.assertEqual(turn_count, 10)
+
+    async def test_summary_is_updated_in_the_background(self):
+        self.app_settings.history_summary_token_threshold = 5
+        messages = [message for index in range(3) for message in make_turn(index, words=5)]
+        history = self.make_history(messages, message_count=6)
+        started = asyncio.Event()
+
+        async def summarize(summary, summarized):
+            started.set()
+            await asyncio.sleep(0.01)
+            return "The user asked three questions."
+
+        self.memory.summarizer.asummarize = AsyncMock(side_effect=summarize)
+
+        loaded, _ = await self.memory.load("user", "session")
+
+        # The turn goes on with the history as it was while the summary is computed
+        self.assertEqual(len(loaded), 6)
+        history.aset_summary.assert_not_awaited()
+        await self.memory.aclose()
+        summarized = self.memory.summarizer.asummarize.await_args.args[1]
+        self.assertEqual(len(summarized), 4)
+        history.aset_summary.assert_awaited_once_with("The user asked three questions.", 4)
+
+    async def test_short_sessions_are_not_summarized(self):
+        self.make_history(make_turn(1) + make_turn(2), message_count=4)
+
+        await self.memory.load("user", "session")
+
+        self.assertEqual(self.memory._summaries, {})
+        self.memory.summarizer.asummarize.assert_not_awaited()
+
+
+if __name__ == "__main__":
+    unittest.main()
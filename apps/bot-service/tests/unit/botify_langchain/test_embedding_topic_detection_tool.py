@@ -0,0 +1,125 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from botify_langchain.tools.embedding_topic_detection_tool import EmbeddingTopicDetectionTool
+
+# Axes of the fake embedding space
+VECTORS = {"legal": [1.0, 0.0, 0.0], "fire": [0.0, 1.0, 0.0], "other": [0.0, 0.0, 1.0]}
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.texts = []
+
+    async def aembed(self, text):
+        await asyncio.sleep(0)
+        return self.embed(text)
+
+    def embed(self, text):
+        self.texts.append(text)
+        vector = [0.0, 0.0, 0.0]
+        for word, axis in VECTORS.items():
+            if word in text:
+                vector = [a + b for a, b in zip(vector, axis)]
+        return vector if any(vector) else VECTORS["other"]
+
+
+class AdaLikeEmbedder(FakeEmbedder):
+    """Embeddings with a large shared component, unrelated texts have a similarity of 0.75 as with ada-002."""
+
+    def embed(self, text):
+        self.texts.append(text)
+        vector = [3**0.5, 0.0, 0.0, 0.0]
+        if "legal" in text:
+            vector[1] = 1.0
+        elif "lawyer" in text:
+            vector[1], vector[3] = 0.8, 0.6
+        else:
+            vector[3] = 1.0
+        return vector
+
+
+class TestEmbeddingTopicDetectionTool(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        EmbeddingTopicDetectionTool.centroids.clear()
+        self.embedder = FakeEmbedder()
+        self.tool = EmbeddingTopicDetectionTool(
+            topic_examples={"legal": ["a legal question", "legal advice"], "fire": ["a fire"]},
+            threshold=0.9,
+            margin=0.3,
+        )
+        patcher = patch.object(EmbeddingTopicDetectionTool, "get_embedder", return_value=self.embedder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch("botify_langchain.tools.embedding_topic_detection_tool.TopicDetectionTool")
+    async def test_confident_scores_skip_the_llm(self, llm_tool):
+        self.assertEqual(await self.tool._arun("is this legal?", ["legal", "fire"]), ["legal"])
+        self.assertEqual(await self.tool._arun("the weather", ["legal", "fire"]), [])
+        llm_tool.assert_not_called()
+
+    async def test_centroids_are_computed_once(self):
+        await self.tool._arun("is this legal?", ["legal"])
+        await self.tool._arun("the weather", ["legal"])
+
+        self.assertEqual(self.embedder.texts.count("legal advice"), 1)
+
+    async def test_concurrent_requests_compute_centroids_once(self):
+        await asyncio.gather(
+            self.tool._arun("is this legal?", ["legal", "fire"]), self.tool._arun("a fire", ["legal", "fire"])
+        )
+
+        self.assertEqual(self.embedder.texts.count("legal advice"), 1)
+        self.assertEqual(self.embedder.texts.count("a fire"), 2)
+
+    @patch("botify_langchain.tools.embedding_topic_detection_tool.TopicDetectionTool")
+    async def test_run_inside_an_event_loop(self, llm_tool):
+        llm_tool.return_value._run.return_value = ["fire"]
+
+        self.assertEqual(self.tool._run("is this legal?", ["legal", "fire"]), ["legal"])
+        self.assertEqual(self.tool._run("a legal fire", ["legal", "fire"]), ["fire"])
+        llm_tool.return_value._run.assert_called_once_with("a legal fire", ["legal", "fire"])
+
+    @patch("botify_langchain.tools.embedding_topic_detection_tool.TopicDetectionTool")
+    async def test_borderline_topics_go_to_the_llm(self, llm_tool):
+        llm_tool.return_value._arun = AsyncMock(return_value=["fire"])
+
+        # Similarity of about 0.7 to both centroids
+        results = await self.tool._arun("a legal fire", ["legal", "fire"])
+
+        self.assertEqual(results, ["fire"])
+        llm_tool.return_value._arun.assert_awaited_once_with("a legal fire", ["legal", "fire"])
+
+    @patch("botify_langchain.tools.embedding_topic_detection_tool.TopicDetectionTool")
+    async def test_topics_without_examples_go_to_the_llm(self, llm_tool):
+        llm_tool.return_value._arun = AsyncMock(return_value=["politics"])
+
+        self.assertEqual(await self.tool._arun("the weather", ["politics", "legal"]), ["politics"])
+        llm_tool.return_value._arun.assert_awaited_once_with("the weather", ["politics"])
+
+
+class TestDefaultThresholds(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        EmbeddingTopicDetectionTool.centroids.clear()
+        self.tool = EmbeddingTopicDetectionTool(
+            topic_examples={"legal": ["a legal question", "legal advice"]}, llm_fallback=False
+        )
+        patcher = patch.object(EmbeddingTopicDetectionTool, "get_embedder", return_value=AdaLikeEmbedder())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_unrelated_questions_are_not_detected_with_ada_similarities(self):
+        # Similarity of 0.75 to the legal centroid
+        self.assertEqual(await self.tool._arun("what are the store hours?", ["legal"]), [])
+
+    async def test_related_questions_are_detected_with_ada_similarities(self):
+        # Similarity of 0.95 to the legal centroid
+        self.assertEqual(await self.tool._arun("do I need a lawyer?", ["legal"]), ["legal"])
+        self.assertEqual(await self.tool._arun("is this legal?", ["legal"]), ["legal"])
+
+
+if __name__ == "__main__":
+    unittest.main()
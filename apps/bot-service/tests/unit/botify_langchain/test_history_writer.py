@@ -0,0 +1,148 @@
+import asyncio
+import unittest
+
+from botify_langchain.history_writer import HistoryWriter
+from langchain_core.messages import AIMessage, HumanMessage
+
+
+class RecordingHistory:
+    """Chat history that records the batches it is asked to write."""
+
+    def __init__(self, session_id, user_id="user", failures=0, delay=0.0):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.failures = failures
+        self.delay = delay
+        self.batches = []
+
+    async def aadd_messages(self, messages):
+        await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Cosmos unavailable")
+        self.batches.append([message.content for message in messages])
+
+
+def make_turn(index):
+    return [HumanMessage(content=f"question {index}"), AIMessage(content=f"answer {index}")]
+
+
+class TestHistoryWriter(unittest.IsolatedAsyncioTestCase):
+
+    async def test_messages_are_written_after_the_call_returns(self):
+        writer = HistoryWriter(batch_window=0.01)
+        history = RecordingHistory("session")
+
+        await writer.add_messages(history, make_turn(1))
+
+        self.assertEqual(history.batches, [])
+        self.assertEqual(writer.stats()["queue_depth"], 2)
+        self.assertEqual(len(writer.get_pending("user", "session")), 2)
+        await writer.flush()
+        self.assertEqual(history.batches, [["question 1", "answer 1"]])
+        self.assertEqual(writer.stats()["queue_depth"], 0)
+        self.assertEqual(writer.get_pending("user", "session"), [])
+
+    async def test_turns_of_a_session_are_batched_in_order(self):
+        writer = HistoryWriter(batch_window=0.01)
+        history = RecordingHistory("session")
+
+        for index in range(3):
+            await writer.add_messages(history, make_turn(index))
+        await writer.flush()
+
+        self.assertEqual(
+            history.batches,
+            [["question 0", "answer 0", "question 1", "answer 1", "question 2", "answer 2"]],
+        )
+
+    async def test_writes_queued_during_a_flush_follow_it(self):
+        writer = HistoryWriter(batch_window=0)
+        history = RecordingHistory("session", delay=0.02)
+
+        await writer.add_messages(history, make_turn(1))
+        await asyncio.sleep(0.01)
+        await writer.add_messages(history, make_turn(2))
+        await writer.flush()
+
+        self.assertEqual(history.batches, [["question 1", "answer 1"], ["question 2", "answer 2"]])
+
+    async def test_sessions_are_written_concurrently(self):
+        writer = HistoryWriter(batch_window=0)
+        histories = [RecordingHistory(f"session {index}", delay=0.05) for index in range(5)]
+
+        for history in histories:
+            await writer.add_messages(history, make_turn(1))
+        start = asyncio.get_running_loop().time()
+        await writer.flush()
+
+        self.assertLess(asyncio.get_running_loop().time() - start, 0.2)
+        self.assertTrue(all(history.batches for history in histories))
+
+    async def test_full_queue_makes_callers_wait(self):
+        writer = HistoryWriter(max_pending=1, batch_window=0.01)
+        history = RecordingHistory("session", delay=0.05)
+
+        for index in range(4):
+            await writer.add_messages(history, make_turn(index))
+
+        # The last call waited for the first batch to be written before its turn was queued
+        self.assertEqual(history.batches, [["question 0", "answer 0", "question 1", "answer 1"]])
+        self.assertEqual(writer.stats()["backpressure_waits"], 3)
+        await writer.flush()
+        self.assertEqual(history.batches[1], ["question 2", "answer 2", "question 3", "answer 3"])
+        self.assertEqual(writer.stats()["queue_depth"], 0)
+
+    async def test_queue_stays_bounded_under_concurrent_calls(self):
+        writer = HistoryWriter(max_pending=2, batch_window=0)
+        histories = [RecordingHistory(f"session {index}", delay=0.01) for index in range(10)]
+        depths = []
+
+        async def add(history):
+            await writer.add_messages(history, make_turn(1))
+            depths.append(writer.queue.qsize())
+
+        await asyncio.gather(*(add(history) for history in histories))
+        await writer.flush()
+
+        self.assertLessEqual(max(depths), 2)
+        self.assertGreater(writer.stats()["backpressure_waits"], 0)
+        self.assertTrue(all(history.batches == [["question 1", "answer 1"]] for history in histories))
+
+    async def test_failed_writes_are_retried_in_order(self):
+        writer = HistoryWriter(batch_window=0, max_retries=2)
+        history = RecordingHistory("session", failures=2)
+
+        await writer.add_messages(history, make_turn(1))
+        await writer.flush()
+
+        self.assertEqual(history.batches, [["question 1", "answer 1"]])
+        self.assertEqual(writer.stats()["dropped"], 0)
+
+    async def test_writes_are_dropped_after_the_retries(self):
+        writer = HistoryWriter(batch_window=0, max_retries=1)
+        history = RecordingHistory("session", failures=2)
+
+        await writer.add_messages(history, make_turn(1))
+        await writer.flush()
+
+        stats = writer.stats()
+        self.assertEqual(history.batches, [])
+        self.assertEqual(stats["dropped"], 2)
+        self.assertEqual(stats["queue_depth"], 0)
+
+    async def test_stats_report_flush_latency(self):
+        writer = HistoryWriter(batch_window=0)
+        history = RecordingHistory("session", delay=0.01)
+
+        await writer.add_messages(history, make_turn(1))
+        await writer.flush()
+
+        stats = writer.stats()
+        self.assertEqual(stats["flushed"], 2)
+        self.assertGreater(stats["avg_flush_ms"], 0)
+        self.assertGreaterEqual(stats["max_flush_ms"], stats["avg_flush_ms"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,303 @@
+import asyncio
+import os
+import unittest
+from unittest.mock import AsyncMock, Mock, patch
+
+os.environ["LOG_LEVEL"] = "DEBUG"
+os.environ["AZURE_OPENAI_API_VERSION"] = "2024-06-01"
+os.environ["OPENAI_API_VERSION"] = "2024-06-01"
+os.environ["AZURE_COSMOSDB_ENDPOINT"] = "https://localhost:8081"
+os.environ["AZURE_COSMOSDB_NAME"] = "database"
+os.environ["AZURE_COSMOSDB_CONTAINER_NAME"] = "container"
+os.environ["AZURE_COSMOSDB_CONNECTION_STRING"] = "connection_string"
+os.environ["AZURE_SEARCH_ENDPOINT"] = "https://localhost:8081"
+os.environ["AZURE_SEARCH_KEY"] = "key"
+os.environ["AZURE_SEARCH_API_VERSION"] = "api_version"
+os.environ["AZURE_SEARCH_INDEX_NAME"] = "index_name"
+os.environ["AZURE_OPENAI_ENDPOINT"] = "https://localhost:8081"
+os.environ["AZURE_OPENAI_API_KEY"] = "key"
+os.environ["AZURE_OPENAI_MODEL_NAME"] = "model_name"
+os.environ["AZURE_OPENAI_CLASSIFIER_MODEL_NAME"] = "model_name"
+os.environ["CONTENT_SAFETY_ENDPOINT"] = "DEBUG"
+os.environ["CONTENT_SAFETY_KEY"] = "key"
+
+from app.exceptions import MaxTurnsExceededError
+from botify_langchain.runnable_factory import RunnableFactory
+from langchain_core.messages import AIMessage, HumanMessage
+
+
+class TestRunnableCache(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = RunnableFactory()
+
+    def test_runnable_is_compiled_once(self):
+        with patch.object(self.factory, "build_runnable", side_effect=lambda: Mock()) as build:
+            first = self.factory.get_runnable()
+            second = self.factory.get_runnable()
+        self.assertIs(first, second)
+        self.assertEqual(build.call_count, 1)
+
+    def test_settings_change_rebuilds_runnable(self):
+        with patch.object(self.factory, "build_runnable", side_effect=lambda: Mock()) as build:
+            first = self.factory.get_runnable()
+            self.factory.app_settings.max_turn_count += 1
+            second = self.factory.get_runnable()
+        self.assertIsNot(first, second)
+        self.assertEqual(build.call_count, 2)
+
+    def test_invalidate_runnable_cache(self):
+        with patch.object(self.factory, "build_runnable", side_effect=lambda: Mock()) as build:
+            self.factory.get_runnable()
+            self.factory.invalidate_runnable_cache()
+            self.factory.get_runnable()
+        self.assertEqual(build.call_count, 2)
+
+    def test_settings_change_rebuilds_components(self):
+        with patch.object(self.factory, "build_runnable", side_effect=lambda: Mock()):
+            self.factory.get_runnable()
+            memory = self.factory.memory
+            search_tool = self.factory.azure_ai_search_tool
+            self.factory.get_runnable()
+            self.assertIs(self.factory.memory, memory)
+
+            self.factory.app_settings.search_tool_topk += 1
+            self.factory.get_runnable()
+        self.assertIsNot(self.factory.memory, memory)
+        self.assertIsNot(self.factory.azure_ai_search_tool, search_tool)
+        self.assertEqual(self.factory.azure_ai_search_tool.k, self.factory.app_settings.search_tool_topk)
+
+    def test_invalidate_runnable_cache_rebuilds_components(self):
+        with patch.object(self.factory, "build_runnable", side_effect=lambda: Mock()):
+            self.factory.get_runnable()
+            content_safety_tool = self.factory.content_safety_tool
+            self.factory.invalidate_runnable_cache()
+            self.factory.get_runnable()
+        self.assertIsNot(self.factory.content_safety_tool, content_safety_tool)
+
+
+class TestGuardrails(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.factory = RunnableFactory()
+        self.safe_results = {
+            "attackDetected": False,
+            "harmful_prompt_detected": False,
+            "harmful_categories": [],
+            "unable_to_complete_safety_check": False,
+        }
+        self.no_banned_topics = {
+            "banned_topic_detected": False,
+            "banned_topics": [],
+            "unable_to_complete_safety_check": False,
+        }
+
+    async def test_guardrails_continue_with_disclaimers(self):
+        self.factory.content_safety = AsyncMock(return_value=self.safe_results)
+        self.factory.detect_banned_topics = AsyncMock(return_value=self.no_banned_topics)
+        self.factory.identify_disclaimers = AsyncMock(return_value=["fire"])
+
+        state = await self.factory.guardrails({"question": "How do I light a campfire?"})
+
+        self.assertEqual(state["disclaimers"], ["fire"])
+        self.assertEqual(self.factory.should_stop_for_safety(state), "continue")
+
+    async def test_guardrails_stop_for_banned_topic(self):
+        self.factory.content_safety = AsyncMock(return_value=self.safe_results)
+        self.factory.detect_banned_topics = AsyncMock(
+            return_value={**self.no_banned_topics, "banned_topic_detected": True, "banned_topics": ["legal"]}
+        )
+        self.factory.identify_disclaimers = AsyncMock(side_effect=RuntimeError("classifier down"))
+
+        state = await self.factory.guardrails({"question": "Can I sue my neighbour?"})
+
+        self.assertNotIn("disclaimers", state)
+        self.assertEqual(self.factory.should_stop_for_safety(state), "stop_for_safety")
+
+    async def test_guardrails_raise_disclaimer_error_when_continuing(self):
+        self.factory.content_safety = AsyncMock(return_value=self.safe_results)
+        self.factory.detect_banned_topics = AsyncMock(return_value=self.no_banned_topics)
+        self.factory.identify_disclaimers = AsyncMock(side_effect=RuntimeError("classifier down"))
+
+        with self.assertRaises(RuntimeError):
+            await self.factory.guardrails({"question": "hello"})
+
+
+class TestVerdictCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.factory = RunnableFactory()
+
+    async def test_disclaimers_are_cached_per_topic_configuration(self):
+        self.factory.app_settings.combined_topic_detection = False
+        with patch("botify_langchain.runnable_factory.TopicDetectionTool") as tool:
+            tool.return_value._arun = AsyncMock(return_value=["fire"])
+            first = await self.factory.identify_disclaimers("How do I light a campfire?")
+            second = await self.factory.identify_disclaimers("how do I light a campfire?")
+            self.factory.app_settings.disclaimer_topics = ["fire", "water"]
+            await self.factory.identify_disclaimers("How do I light a campfire?")
+
+        self.assertEqual(first, ["fire"])
+        self.assertEqual(second, ["fire"])
+        self.assertEqual(tool.return_value._arun.await_count, 2)
+
+
+class TestCombinedTopicDetection(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.factory = RunnableFactory()
+        self.factory.app_settings.combined_topic_detection = True
+        self.factory.verdict_cache = None
+
+    async def test_one_classifier_call_for_both_topic_sets(self):
+        with patch("botify_langchain.runnable_factory.TopicDetectionTool") as tool:
+            tool.return_value.aclassify = AsyncMock(
+                return_value={"banned_topics": ["legal"], "disclaimer_topics": ["fire"]}
+            )
+            banned_topic_results, disclaimers = await asyncio.gather(
+                self.factory.detect_banned_topics("Can I sue over a fire?"),
+                self.factory.identify_disclaimers("Can I sue over a fire?"),
+            )
+
+        self.assertTrue(banned_topic_results["banned_topic_detected"])
+        self.assertEqual(banned_topic_results["banned_topics"], ["legal"])
+        self.assertEqual(disclaimers, ["fire"])
+        tool.return_value.aclassify.assert_awaited_once()
+
+    async def test_classifier_error_fails_the_check(self):
+        with patch("botify_langchain.runnable_factory.TopicDetectionTool") as tool:
+            tool.return_value.aclassify = AsyncMock(side_effect=ValueError("invalid JSON"))
+            banned_topic_results = await self.factory.detect_banned_topics("hello")
+
+        self.assertTrue(banned_topic_results["unable_to_complete_safety_check"])
+
+
+class TestSpeculativeExecution(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.factory = RunnableFactory()
+        self.agent_started = asyncio.Event()
+        self.agent_graph = Mock()
+
+        async def run_agent(state, config):
+            self.agent_started.set()
+            await asyncio.sleep(0.05)
+            return {"messages": state["messages"] + ["answer"]}
+
+        self.agent_graph.ainvoke = run_agent
+
+    def mock_guardrails(self, tripped):
+        async def guardrails(state):
+            # The agent is already running while the checks are evaluated
+            await asyncio.wait_for(self.agent_started.wait(), timeout=1)
+            state["attackDetected"] = tripped
+            state["harmful_prompt_detected"] = False
+            state["banned_topic_detected"] = False
+            state["unable_to_complete_safety_check"] = False
+            return state
+
+        self.factory.guardrails = guardrails
+
+    async def test_answer_kept_when_checks_pass(self):
+        self.mock_guardrails(tripped=False)
+        node = self.factory.speculative_call_model(self.agent_graph)
+
+        state = await node({"messages": ["question"], "question": "question"}, {})
+
+        self.assertEqual(state["messages"], ["question", "answer"])
+        self.assertEqual(self.factory.should_stop_for_safety(state), "continue")
+
+    async def test_answer_discarded_when_check_trips(self):
+        self.mock_guardrails(tripped=True)
+        node = self.factory.speculative_call_model(self.agent_graph)
+
+        state = await node({"messages": ["question"], "question": "question"}, {})
+
+        self.assertEqual(state["messages"], ["question"])
+        self.assertEqual(self.factory.should_stop_for_safety(state), "stop_for_safety")
+
+
+class TestConversationMemory(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.factory = RunnableFactory()
+        self.factory.memory = Mock()
+        self.factory.memory.trim.side_effect = lambda messages, max_tokens: messages
+        self.factory.memory.save = AsyncMock()
+        self.history = [HumanMessage(content="Hi"), AIMessage(content="Hello")]
+        self.config = {"configurable": {"session_id": "session", "user_id": "user"}}
+        self.question = {"role": "user", "content": "What is on the menu?"}
+
+    async def test_history_is_loaded_for_a_new_question(self):
+        self.factory.memory.load = AsyncMock(return_value=(self.history, 1))
+
+        state = await self.factory.load_memory({"messages": [self.question]}, self.config)
+
+        self.assertEqual(state["messages"], self.history + [self.question])
+        self.assertEqual(state["session_turn_count"], 1)
+        self.factory.memory.load.assert_awaited_once_with("user", "session")
+
+    async def test_client_history_is_left_as_sent(self):
+        self.factory.memory.load = AsyncMock(return_value=(self.history, 1))
+        messages = [
+            {"role": "user", "content": "Hi"},
+            {"role": "assistant", "content": "Hello"},
+            self.question,
+        ]
+
+        state = await self.factory.load_memory({"messages": list(messages)}, self.config)
+
+        self.assertEqual(state["messages"], messages)
+        self.assertEqual(state["session_turn_count"], 1)
+
+    async def test_max_turn_count_is_enforced_per_session(self):
+        self.factory.memory.load = AsyncMock(return_value=([], self.factory.app_settings.max_turn_count))
+        state = await self.factory.load_memory({"messages": [self.question]}, self.config)
+
+        with self.assertRaises(MaxTurnsExceededError):
+            self.factory.pre_processor(state)
+        # Other sessions are not affected
+        self.factory.pre_processor({"messages": [self.question]})
+
+    async def test_load_failure_continues_without_history(self):
+        self.factory.memory.load = AsyncMock(side_effect=ConnectionError("Cosmos unavailable"))
+
+        state = await self.factory.load_memory({"messages": [self.question]}, self.config)
+
+        self.assertEqual(state["messages"], [self.question])
+        self.assertEqual(state["session_turn_count"], 0)
+
+    async def test_turn_is_saved_after_post_processing(self):
+        answer = AIMessage(content='{"displayResponse": "Burgers"}')
+        state = {
+            "messages": [self.question, answer],
+            "question": self.question["content"],
+            "attackDetected": False,
+            "harmful_prompt_detected": False,
+            "banned_topic_detected": False,
+            "unable_to_complete_safety_check": False,
+        }
+
+        await self.factory.save_memory(state, self.config)
+
+        user_id, session_id, turn = self.factory.memory.save.await_args.args
+        self.assertEqual((user_id, session_id), ("user", "session"))
+        self.assertEqual([message.content for message in turn], [self.question["content"], answer.content])
+
+    async def test_flagged_turn_is_not_saved(self):
+        state = {
+            "messages": [self.question, AIMessage(content="error")],
+            "question": self.question["content"],
+            "attackDetected": True,
+            "harmful_prompt_detected": False,
+            "banned_topic_detected": False,
+            "unable_to_complete_safety_check": False,
+        }
+
+        await self.factory.save_memory(state, self.config)
+
+        self.factory.memory.save.assert_not_awaited()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from botify_langchain.tools.topic_detection_tool import TopicDetectionTool
+from langchain_core.messages import AIMessage
+
+topic_sets = {"banned_topics": ["legal", "medical"], "disclaimer_topics": ["fire"]}
+
+
+class TestTopicDetectionTool(unittest.TestCase):
+
+    def setUp(self):
+        self.tool = TopicDetectionTool()
+
+    def test_format_response(self):
+        response = AIMessage(content='{"banned_topics": ["legal"], "disclaimer_topics": []}')
+
+        classification = self.tool.format_response(response, topic_sets)
+
+        self.assertEqual(classification, {"banned_topics": ["legal"], "disclaimer_topics": []})
+
+    def test_format_response_is_strict(self):
+        invalid_responses = [
+            "legal, medical",
+            '{"banned_topics": ["legal"]}',
+            '{"banned_topics": ["sports"], "disclaimer_topics": []}',
+        ]
+        for content in invalid_responses:
+            with self.assertRaises(ValueError):
+                self.tool.format_response(AIMessage(content=content), topic_sets)
+
+    def test_response_format_only_allows_configured_topics(self):
+        schema = self.tool.make_response_format(topic_sets)["json_schema"]["schema"]
+
+        self.assertEqual(schema["required"], ["banned_topics", "disclaimer_topics"])
+        self.assertEqual(schema["properties"]["banned_topics"]["items"]["enum"], ["legal", "medical"])
+
+    def test_empty_topic_sets_skip_the_model(self):
+        self.assertEqual(self.tool.classify("hello", {"banned_topics": []}), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
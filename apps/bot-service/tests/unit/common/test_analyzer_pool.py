@@ -0,0 +1,80 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+from common.presidio.analyzer_pool import AnalyzerPool
+
+
+def analysis(texts):
+    return [[text] for text in texts]
+
+
+def slow_analysis(texts):
+    time.sleep(0.2)
+    return analysis(texts)
+
+
+@patch("common.presidio.analyzer_pool.init_worker", lambda pii_entities, model_name: None)
+class TestAnalyzerPool(unittest.IsolatedAsyncioTestCase):
+
+    def tearDown(self):
+        AnalyzerPool.shutdown_all()
+
+    @patch("common.presidio.analyzer_pool.analyze_batch_in_worker", analysis)
+    async def test_analysis_runs_in_executor(self):
+        pool = AnalyzerPool(["PHONE_NUMBER"], max_workers=0)
+
+        self.assertEqual(await pool.aanalyze("call me"), ["call me"])
+
+    async def test_concurrent_texts_are_batched(self):
+        pool = AnalyzerPool(["PHONE_NUMBER"], max_workers=0, max_batch_size=2)
+        texts = ["one", "two", "three"]
+
+        with patch("common.presidio.analyzer_pool.analyze_batch_in_worker", wraps=analysis) as analyze:
+            results = await asyncio.gather(*(pool.aanalyze(text) for text in texts))
+
+        self.assertEqual(results, [["one"], ["two"], ["three"]])
+        self.assertEqual([call.args[0] for call in analyze.call_args_list], [["one", "two"], ["three"]])
+
+    @patch("common.presidio.analyzer_pool.warm_up_worker", lambda: (1234, {"en_core_web_sm": 2**20}))
+    async def test_warm_up(self):
+        pool = AnalyzerPool(["PHONE_NUMBER"], max_workers=0)
+
+        self.assertEqual(await pool.warm_up(), {1234: {"en_core_web_sm": 2**20}})
+
+    @patch("common.presidio.analyzer_pool.analyze_batch_in_worker", slow_analysis)
+    async def test_timeout(self):
+        pool = AnalyzerPool(["PHONE_NUMBER"], max_workers=0, timeout=0.05)
+
+        with self.assertRaises(TimeoutError):
+            await pool.aanalyze("call me")
+
+    @patch("common.presidio.analyzer_pool.analyze_batch_in_worker", slow_analysis)
+    async def test_backpressure(self):
+        pool = AnalyzerPool(["PHONE_NUMBER"], max_workers=0, max_pending=1, timeout=0.3, max_batch_size=1)
+
+        results = await asyncio.gather(
+            pool.aanalyze("first"), pool.aanalyze("second"), return_exceptions=True
+        )
+
+        self.assertEqual(results[0], ["first"])
+        self.assertIsInstance(results[1], TimeoutError)
+
+    @patch("common.presidio.analyzer_pool.analyze_batch_in_worker", slow_analysis)
+    async def test_timed_out_analysis_keeps_its_slot(self):
+        pool = AnalyzerPool(["PHONE_NUMBER"], max_workers=0, max_pending=1, timeout=0.05, max_batch_size=1)
+
+        with self.assertRaises(TimeoutError):
+            await pool.aanalyze("first")
+
+        # The analysis of the first text is still running in the executor
+        self.assertTrue(pool.get_semaphore().locked())
+        with self.assertRaisesRegex(TimeoutError, "slot"):
+            await pool.aanalyze("second")
+        await asyncio.sleep(0.3)
+        self.assertFalse(pool.get_semaphore().locked())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import httpx
+from common.search.azure_ai_search import AzureRAGSearchClient
+
+
+def search_response(*results):
+    return {"value": list(results)}
+
+
+class TestAzureRAGSearchClient(unittest.IsolatedAsyncioTestCase):
+
+    def make_client(self, handler):
+        client = AzureRAGSearchClient(
+            api_key="key", api_version="2024-07-01", search_endpoint="https://search", retry_backoff=0
+        )
+        client._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        client._async_client_loop = asyncio.get_running_loop()
+        return client
+
+    async def test_asearch_retries_throttled_requests(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            if len(calls) == 1:
+                return httpx.Response(503)
+            return httpx.Response(
+                200, json=search_response({"id": "1", "@search.score": 1.0, "@search.rerankerScore": 2.0})
+            )
+
+        client = self.make_client(handler)
+        results = await client.asearch("query", ["index"], fields_to_select="id", max_results=3)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([result["id"] for result in results], ["1"])
+        await client.aclose()
+
+    async def test_asearch_orders_and_limits_results(self):
+        def handler(request):
+            return httpx.Response(
+                200,
+                json=search_response(
+                    {"id": "1", "@search.score": 1.0, "@search.rerankerScore": 2.0},
+                    {"id": "2", "@search.score": 1.0, "@search.rerankerScore": 3.0},
+                    {"id": "3", "@search.score": 2.0, "@search.rerankerScore": 2.0},
+                ),
+            )
+
+        client = self.make_client(handler)
+        results = await client.asearch("query", ["index"], fields_to_select="id", max_results=2)
+
+        self.assertEqual([result["id"] for result in results], ["2", "3"])
+        await client.aclose()
+
+    async def test_asearch_raises_client_errors(self):
+        client = self.make_client(lambda request: httpx.Response(400, json={"error": "bad request"}))
+
+        with self.assertRaises(httpx.HTTPStatusError):
+            await client.asearch("query", ["index"], fields_to_select="id", max_results=2)
+        await client.aclose()
+
+    async def test_asearch_merges_multiple_indexes(self):
+        responses = {
+            "index-a": search_response(
+                {"id": "1", "@search.score": 1.0, "@search.rerankerScore": 1.5},
+                {"id": "2", "@search.score": 1.0, "@search.rerankerScore": 3.5},
+            ),
+            "index-b": search_response(
+                {"id": "3", "@search.score": 1.0, "@search.rerankerScore": 2.5},
+                {"id": "4", "@search.score": 1.0, "@search.rerankerScore": 0.5},
+            ),
+            "index-c": {},
+        }
+
+        def handler(request):
+            return httpx.Response(200, json=responses[request.url.path.split("/")[2]])
+
+        client = self.make_client(handler)
+        results = await client.asearch(
+            "query", list(responses), fields_to_select="id", max_results=3, reranker_threshold=1
+        )
+
+        self.assertEqual([result["id"] for result in results], ["2", "3", "1"])
+        await client.aclose()
+
+    async def test_asearch_dedupes_documents_deterministically(self):
+        responses = {
+            "index-a": search_response(
+                {"id": "1", "@search.score": 1.0, "@search.rerankerScore": 2.0, "source": "a"},
+                {"id": "2", "@search.score": 1.0, "@search.rerankerScore": 2.5, "source": "a"},
+            ),
+            "index-b": search_response(
+                {"id": "1", "@search.score": 1.0, "@search.rerankerScore": 3.0, "source": "b"},
+                {"id": "2", "@search.score": 1.0, "@search.rerankerScore": 2.5, "source": "b"},
+            ),
+        }
+        delays = {"index-a": 0.02, "index-b": 0.0}
+
+        async def handler(request):
+            index = request.url.path.split("/")[2]
+            await asyncio.sleep(delays[index])
+            return httpx.Response(200, json=responses[index])
+
+        client = self.make_client(handler)
+        first = await client.asearch("query", list(responses), fields_to_select="id", max_results=3)
+        delays.update({"index-a": 0.0, "index-b": 0.02})
+        second = await client.asearch("query", list(responses), fields_to_select="id", max_results=3)
+
+        for results in (first, second):
+            # Each document once, with its best score and ties going to the first index
+            self.assertEqual(
+                [(result["id"], result["source"]) for result in results], [("1", "b"), ("2", "a")]
+            )
+        await client.aclose()
+
+    async def test_sync_search_reuses_the_executor_of_the_client(self):
+        client = AzureRAGSearchClient(
+            api_key="key", api_version="2024-07-01", search_endpoint="https://search"
+        )
+
+        def search_index(index, search_payload):
+            return search_response({"id": index, "@search.score": 1.0, "@search.rerankerScore": 1.0})
+
+        with patch.object(client, "search_index", side_effect=search_index):
+            first = client.search("query", ["index-a", "index-b"], fields_to_select="id", max_results=3)
+            executor = client.get_executor()
+            second = client.search("query", ["index-a", "index-b"], fields_to_select="id", max_results=3)
+
+        self.assertEqual(sorted(result["id"] for result in first), ["index-a", "index-b"])
+        self.assertEqual(first, second)
+        self.assertIs(client.get_executor(), executor)
+        await client.aclose()
+        self.assertIsNone(client._executor)
+
+    def test_merge_results_without_values(self):
+        client = AzureRAGSearchClient(api_key="key", api_version="2024-07-01", search_endpoint="https://search")
+
+        self.assertEqual(client.merge_results({"index": {}}, max_results=3), [])
+
+    def test_merge_results_defaults_missing_reranker_score(self):
+        client = AzureRAGSearchClient(api_key="key", api_version="2024-07-01", search_endpoint="https://search")
+        results = client.merge_results(
+            {
+                "index": search_response(
+                    {"id": "1", "@search.score": 2.0}, {"id": "2", "@search.score": 1.0, "@search.rerankerScore": 1}
+                )
+            },
+            max_results=3,
+        )
+
+        self.assertEqual([result["id"] for result in results], ["2", "1"])
+        self.assertEqual(results[1]["@search.rerankerScore"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import asyncio
+import unittest
+
+from common.batching import MicroBatcher
+
+
+class TestMicroBatcher(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    async def process(self, items):
+        self.batches.append(items)
+        return [item.upper() for item in items]
+
+    async def test_items_within_the_window_are_batched(self):
+        batcher = MicroBatcher(self.process, batch_window=0.01, max_batch_size=10)
+
+        results = await asyncio.gather(*(batcher.submit(item) for item in ["a", "b", "c"]))
+
+        self.assertEqual(results, ["A", "B", "C"])
+        self.assertEqual(self.batches, [["a", "b", "c"]])
+
+    async def test_full_batches_are_processed_without_waiting(self):
+        batcher = MicroBatcher(self.process, batch_window=10, max_batch_size=2)
+
+        futures = [batcher.submit(item) for item in ["a", "b", "c", "d"]]
+        results = await asyncio.wait_for(asyncio.gather(*futures), timeout=1)
+
+        self.assertEqual(results, ["A", "B", "C", "D"])
+        self.assertEqual(self.batches, [["a", "b"], ["c", "d"]])
+
+    async def test_items_with_the_same_key_share_a_future(self):
+        batcher = MicroBatcher(self.process, batch_window=0.01)
+
+        first = batcher.submit("a", key="a")
+        second = batcher.submit("a", key="a")
+
+        self.assertIs(first, second)
+        self.assertEqual(await first, "A")
+        self.assertEqual(self.batches, [["a"]])
+
+    async def test_errors_are_set_on_every_item_of_the_batch(self):
+        async def fail(items):
+            raise ConnectionError("unavailable")
+
+        batcher = MicroBatcher(fail, batch_window=0.01)
+
+        results = await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, ConnectionError) for result in results))
+        self.assertEqual(len(batcher), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from common.cache import SqliteCache, TTLCache, normalize_query
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  How do I\tRemove   a Stain? "), "how do i remove a stain?")
+
+    def test_get_and_set(self):
+        cache = TTLCache(max_entries=2)
+        cache.set("a", 1)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats(), {"entries": 1, "hits": 1, "misses": 1})
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_entries_expire(self):
+        cache = TTLCache(max_entries=2, ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+class TestSqliteCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "cache.db")
+
+    def make_cache(self, ttl=None):
+        cache = SqliteCache(self.path, ttl=ttl)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_entries_are_shared_between_instances(self):
+        writer = self.make_cache()
+        writer.set("a", [{"id": "1", "score": 2.5}])
+
+        reader = self.make_cache()
+
+        self.assertEqual(reader.get("a"), [{"id": "1", "score": 2.5}])
+        self.assertIsNone(reader.get("b"))
+        self.assertEqual(reader.stats(), {"entries": 1, "hits": 1, "misses": 1})
+
+    def test_pop_and_clear(self):
+        cache = self.make_cache()
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        self.assertEqual(cache.pop("a"), 1)
+        self.assertIsNone(cache.get("a"))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_entries_expire(self):
+        cache = self.make_cache(ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get("a"))
+
+    async def test_async_calls_run_off_the_event_loop(self):
+        cache = self.make_cache()
+        threads = []
+        for name in ["get", "set"]:
+            method = getattr(cache, name)
+
+            def record(*args, method=method):
+                threads.append(threading.get_ident())
+                return method(*args)
+
+            setattr(cache, name, record)
+
+        await cache.aset("a", [1, 2])
+
+        self.assertEqual(await cache.aget("a"), [1, 2])
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
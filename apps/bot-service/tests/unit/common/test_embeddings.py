@@ -0,0 +1,104 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from common.search.embeddings import QueryEmbedder, SqliteEmbeddingStore
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed(self, input):
+        return SimpleNamespace(
+            data=[SimpleNamespace(index=i, embedding=[float(len(text)), 1.0]) for i, text in enumerate(input)]
+        )
+
+    def create(self, input, model):
+        self.calls.append(list(input))
+        return self.embed(input)
+
+
+class FakeAsyncEmbeddings(FakeEmbeddings):
+    async def create(self, input, model):
+        self.calls.append(list(input))
+        await asyncio.sleep(0)
+        return self.embed(input)
+
+
+class TestQueryEmbedder(unittest.IsolatedAsyncioTestCase):
+
+    def make_embedder(self, **kwargs):
+        self.embeddings = FakeEmbeddings()
+        self.async_embeddings = FakeAsyncEmbeddings()
+        return QueryEmbedder(
+            model="embedding",
+            client_factory=lambda: SimpleNamespace(embeddings=self.embeddings),
+            async_client_factory=lambda: SimpleNamespace(embeddings=self.async_embeddings),
+            **kwargs,
+        )
+
+    async def test_concurrent_requests_are_batched(self):
+        embedder = self.make_embedder(batch_window=0.01)
+
+        vectors = await asyncio.gather(embedder.aembed("a"), embedder.aembed("bb"), embedder.aembed("a"))
+
+        self.assertEqual(vectors, [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]])
+        self.assertEqual(self.async_embeddings.calls, [["a", "bb"]])
+
+    async def test_batches_are_limited_in_size(self):
+        embedder = self.make_embedder(batch_window=0.01, max_batch_size=2)
+
+        await asyncio.gather(*(embedder.aembed(text) for text in ["a", "bb", "ccc"]))
+
+        self.assertEqual(self.async_embeddings.calls, [["a", "bb"], ["ccc"]])
+
+    async def test_cached_embeddings_skip_the_api(self):
+        embedder = self.make_embedder()
+
+        await embedder.aembed("a")
+        await embedder.aembed("a")
+        embedder.embed("a")
+
+        self.assertEqual(embedder.api_calls, 1)
+        self.assertEqual(self.embeddings.calls, [])
+
+    async def test_embeddings_are_persisted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "embeddings.db")
+            await self.make_embedder(persist_path=path).aembed("a")
+
+            embedder = self.make_embedder(persist_path=path)
+            self.assertEqual(embedder.embed("a"), [1.0, 1.0])
+            self.assertEqual(embedder.api_calls, 0)
+            embedder.store.close()
+
+    async def test_api_errors_are_raised(self):
+        embedder = self.make_embedder()
+
+        async def fail(input, model):
+            raise RuntimeError("throttled")
+
+        self.async_embeddings.create = fail
+
+        with self.assertRaises(RuntimeError):
+            await embedder.aembed("a")
+
+
+class TestSqliteEmbeddingStore(unittest.TestCase):
+
+    def test_set_get_pop(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SqliteEmbeddingStore(os.path.join(directory, "embeddings.db"))
+            store.set("key", [0.5, 1.5])
+
+            self.assertEqual(store.get("key"), [0.5, 1.5])
+            self.assertEqual(store.pop("key"), [0.5, 1.5])
+            self.assertIsNone(store.get("key"))
+            store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from app.settings import AppSettings
+from common.presidio.prefilter import PIIPrefilter
+
+app_settings = AppSettings(load_environment_config=False)
+ner_entities = app_settings.anonymizer_ner_entities
+pattern_entities = [entity for entity in app_settings.anonymizer_entities if entity not in ner_entities]
+
+
+class TestPIIPrefilter(unittest.TestCase):
+    prefilter = PIIPrefilter(
+        app_settings.anonymizer_entities,
+        app_settings.anonymizer_ner_entities,
+        app_settings.anonymizer_ner_trigger_pattern,
+    )
+    pattern_prefilter = PIIPrefilter(pattern_entities, app_settings.anonymizer_ner_entities)
+
+    def test_pii_free_question_is_not_escalated(self):
+        question = "how do I get a red wine stain out of a rug?"
+
+        self.assertFalse(self.pattern_prefilter.requires_analysis(question))
+
+    def test_pattern_match_is_escalated(self):
+        self.assertTrue(self.pattern_prefilter.requires_analysis("please email me at jolu@gen.com"))
+        self.assertTrue(self.pattern_prefilter.requires_analysis("my card is 4111 1111 1111 1111"))
+
+    def test_possible_locations_are_escalated(self):
+        self.assertTrue(self.prefilter.requires_analysis("is there a store near Springfield?"))
+        self.assertTrue(self.prefilter.requires_analysis("Seattle store hours?"))
+        self.assertTrue(self.prefilter.requires_analysis("is there a store near springfield"))
+
+    def test_ner_entities_without_trigger_are_always_escalated(self):
+        prefilter = PIIPrefilter(["LOCATION", "EMAIL_ADDRESS"], ["LOCATION"])
+
+        self.assertTrue(prefilter.requires_analysis("how do I get a red wine stain out of a rug?"))
+
+    def test_ner_trigger_pattern(self):
+        prefilter = PIIPrefilter(["LOCATION"], ["LOCATION"], r"\d")
+
+        self.assertFalse(prefilter.requires_analysis("how do I get a red wine stain out of a rug?"))
+        self.assertTrue(prefilter.requires_analysis("is store 12 open?"))
+
+    def test_pattern_entities_only(self):
+        prefilter = PIIPrefilter(["EMAIL_ADDRESS"], app_settings.anonymizer_ner_entities)
+
+        self.assertFalse(prefilter.requires_analysis("is there a store near Springfield?"))
+        self.assertTrue(prefilter.requires_analysis("please email me at jolu@gen.com"))
+
+
+if __name__ == "__main__":
+    unittest.main()
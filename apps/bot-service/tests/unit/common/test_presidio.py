@@ -2,6 +2,7 @@ import unittest
 
 from pydantic import SecretStr
 from common.presidio.anonymizer import Anonymizer, Deanonymizer
+from common.presidio.engines import get_model_memory
 from app.settings import EnvironmentConfig, AppSettings
 import secrets
 import string
@@ -71,5 +72,15 @@ class TestDecrypt(unittest.TestCase):
                   ellapsed_time} seconds")
 
 
+class TestEngineRegistry(unittest.TestCase):
+
+    def test_model_is_loaded_once(self):
+        first = Anonymizer(pii_entitities=app_settings.anonymizer_entities)
+        second = Anonymizer(pii_entitities=["PHONE_NUMBER"], mode="ENCRYPT", crypto_key=random_secret_string())
+
+        self.assertIs(first.pii_analyzer, second.pii_analyzer)
+        self.assertIn("en_core_web_sm", get_model_memory())
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from common.search.search_cache import SearchResultCache
+
+
+class TestSearchResultCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.search_kwargs = {"k": 10, "fields_to_select": "id, chunk", "filter": ""}
+
+    async def test_exact_hit_for_normalized_query(self):
+        cache = SearchResultCache()
+        scope = cache.make_scope(["index"], self.search_kwargs)
+        await cache.aset("Remove a stain", scope, [{"id": "1"}])
+
+        self.assertEqual(await cache.aget("  remove A stain ", scope), [{"id": "1"}])
+        self.assertEqual(cache.stats(), {"hits": 1, "similar_hits": 0, "misses": 0})
+
+    async def test_scope_separates_configurations(self):
+        cache = SearchResultCache()
+        scope = cache.make_scope(["index"], self.search_kwargs)
+        other_scope = cache.make_scope(["index"], {**self.search_kwargs, "filter": "location eq 'x'"})
+        await cache.aset("Remove a stain", scope, [{"id": "1"}])
+
+        self.assertIsNone(await cache.aget("Remove a stain", other_scope))
+
+    async def test_similar_query_hit(self):
+        embeddings = {"remove a stain": [1.0, 0.0], "removing a stain": [0.99, 0.05], "paint a wall": [0.0, 1.0]}
+
+        async def embed(query):
+            return embeddings[query]
+
+        cache = SearchResultCache(similarity_threshold=0.95)
+        scope = cache.make_scope(["index"], self.search_kwargs)
+        self.assertIsNone(await cache.aget("remove a stain", scope, embed=embed))
+        await cache.aset("remove a stain", scope, [{"id": "1"}])
+
+        self.assertEqual(await cache.aget("removing a stain", scope, embed=embed), [{"id": "1"}])
+        self.assertIsNone(await cache.aget("paint a wall", scope, embed=embed))
+        self.assertEqual(cache.stats(), {"hits": 1, "similar_hits": 1, "misses": 2})
+
+    async def test_similar_hit_is_stored_under_the_exact_key(self):
+        calls = []
+
+        async def embed(query):
+            calls.append(query)
+            return {"remove a stain": [1.0, 0.0], "removing a stain": [0.99, 0.05]}[query]
+
+        cache = SearchResultCache(similarity_threshold=0.95)
+        scope = cache.make_scope(["index"], self.search_kwargs)
+        await cache.aget("remove a stain", scope, embed=embed)
+        await cache.aset("remove a stain", scope, [{"id": "1"}])
+        await cache.aget("removing a stain", scope, embed=embed)
+        calls.clear()
+
+        self.assertEqual(await cache.aget("Removing a stain", scope, embed=embed), [{"id": "1"}])
+        self.assertEqual(calls, [])
+        self.assertEqual(cache.stats(), {"hits": 2, "similar_hits": 1, "misses": 1})
+
+    async def test_embedding_errors_fall_back_to_exact_lookup(self):
+        async def embed(query):
+            raise RuntimeError("no embedding deployment")
+
+        cache = SearchResultCache(similarity_threshold=0.95)
+        scope = cache.make_scope(["index"], self.search_kwargs)
+
+        self.assertIsNone(await cache.aget("remove a stain", scope, embed=embed))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import json
+import unittest
+
+from common.search.documents import (
+    MAX_CHUNK_OVERLAP,
+    count_tokens,
+    find_overlap,
+    format_documents,
+    pack_documents,
+    parse_fields,
+    remove_chunk_overlap,
+    search_result_to_document,
+    truncate_to_tokens,
+)
+
+search_result = {
+    "id": "42",
+    "title": "Stain removal",
+    "chunk": "Blot the stain with cold water and a little dish soap before washing. " * 20,
+    "location": "https://example.com/stains",
+    "@search.score": 0.8,
+    "@search.rerankerScore": 2.5,
+    "@search.captions": [{"text": "Blot the stain", "highlights": ""}],
+}
+
+
+class TestSearchDocuments(unittest.TestCase):
+
+    def test_parse_fields(self):
+        self.assertEqual(parse_fields("id, title,chunk , location"), ["id", "title", "chunk", "location"])
+
+    def test_truncate_to_tokens(self):
+        text, used_tokens = truncate_to_tokens(search_result["chunk"], 10)
+
+        self.assertEqual(used_tokens, 10)
+        self.assertEqual(count_tokens(text), 10)
+        self.assertTrue(search_result["chunk"].startswith(text))
+
+    def test_document_projection(self):
+        document = search_result_to_document(search_result, ["title", "chunk", "location"], id_field="id")
+
+        self.assertEqual(
+            json.loads(document.page_content),
+            {"title": "Stain removal", "chunk": search_result["chunk"], "location": search_result["location"]},
+        )
+        self.assertEqual(document.metadata, {"score": 0.8, "reranker_score": 2.5, "id": "42"})
+
+    def test_document_token_budget(self):
+        document = search_result_to_document(search_result, ["title", "chunk", "location"], max_tokens=50)
+        content = json.loads(document.page_content)
+
+        self.assertEqual(content["title"], "Stain removal")
+        self.assertLessEqual(sum(count_tokens(value) for value in content.values()), 50)
+
+    def test_format_documents(self):
+        documents = [
+            search_result_to_document(search_result, ["title"]),
+            search_result_to_document({**search_result, "title": "Ink"}, ["title"]),
+        ]
+
+        self.assertEqual(json.loads(format_documents(documents)), [{"title": "Stain removal"}, {"title": "Ink"}])
+
+    def test_find_overlap(self):
+        earlier = "Pre-treat the stain. Wash in cold water with an enzyme detergent."
+        later = "Wash in cold water with an enzyme detergent. Air dry and check the stain."
+
+        self.assertEqual(find_overlap(earlier, later), len("Wash in cold water with an enzyme detergent."))
+        self.assertEqual(find_overlap(later, earlier), 0)
+
+    def test_find_overlap_up_to_the_indexer_overlap(self):
+        text = "".join(f"{index:04d}," for index in range(200))
+
+        for length, expected in [(MAX_CHUNK_OVERLAP, MAX_CHUNK_OVERLAP), (MAX_CHUNK_OVERLAP + 1, 0)]:
+            shared = text[:length]
+            self.assertEqual(find_overlap("Pre-treat the stain. " + shared, shared + " Air dry."), expected)
+
+    def test_remove_chunk_overlap(self):
+        shared = "Wash in cold water with an enzyme detergent."
+        results = [
+            {"id": "2", "ParentKey": "page", "chunk": shared + " Air dry and check the stain."},
+            {"id": "1", "ParentKey": "page", "chunk": "Pre-treat the stain. " + shared},
+            {"id": "3", "ParentKey": "page", "chunk": "Air dry and check the stain."},
+            {"id": "4", "ParentKey": "other", "chunk": shared},
+        ]
+
+        deduplicated = remove_chunk_overlap(results, "chunk", "ParentKey")
+
+        self.assertEqual(
+            [(result["id"], result["chunk"]) for result in deduplicated],
+            [("2", results[0]["chunk"]), ("1", "Pre-treat the stain. "), ("4", shared)],
+        )
+        self.assertEqual(results[1]["chunk"], "Pre-treat the stain. " + shared)
+
+    def test_parent_key_metadata(self):
+        document = search_result_to_document(
+            {**search_result, "ParentKey": "page"}, ["title"], parent_field="ParentKey"
+        )
+
+        self.assertEqual(document.metadata["parent_key"], "page")
+
+    def test_pack_documents(self):
+        documents = [
+            search_result_to_document(search_result, ["chunk"], max_tokens=60),
+            search_result_to_document(search_result, ["chunk"], max_tokens=60),
+            search_result_to_document(search_result, ["title"]),
+        ]
+        budget = count_tokens(documents[0].page_content) + count_tokens(documents[2].page_content)
+
+        self.assertEqual(pack_documents(documents, budget), [documents[0], documents[2]])
+        self.assertEqual(pack_documents(documents, None), documents)
+
+
+if __name__ == "__main__":
+    unittest.main()
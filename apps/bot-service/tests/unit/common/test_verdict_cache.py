@@ -0,0 +1,49 @@
+import unittest
+from unittest.mock import AsyncMock
+
+from common.verdict_cache import VerdictCache
+
+
+class TestVerdictCache(unittest.IsolatedAsyncioTestCase):
+
+    async def test_repeated_text_is_served_from_cache(self):
+        cache = VerdictCache()
+        compute = AsyncMock(return_value=["fire"])
+
+        config = {"topics": ["fire"]}
+        first = await cache.aget_or_compute("topics", "How do I light a fire?", config, compute)
+        second = await cache.aget_or_compute("topics", " how do I light a FIRE? ", config, compute)
+
+        self.assertEqual(first, ["fire"])
+        self.assertEqual(second, ["fire"])
+        compute.assert_awaited_once()
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1})
+
+    async def test_configuration_change_invalidates(self):
+        cache = VerdictCache()
+        compute = AsyncMock(return_value=[])
+
+        await cache.aget_or_compute("topics", "hello", {"topics": ["fire"]}, compute)
+        await cache.aget_or_compute("topics", "hello", {"topics": ["fire", "legal"]}, compute)
+        await cache.aget_or_compute("content_safety", "hello", {"topics": ["fire"]}, compute)
+
+        self.assertEqual(compute.await_count, 3)
+
+    async def test_failures_are_not_cached(self):
+        cache = VerdictCache()
+        compute = AsyncMock(side_effect=[RuntimeError("service down"), []])
+
+        with self.assertRaises(RuntimeError):
+            await cache.aget_or_compute("topics", "hello", {}, compute)
+        self.assertEqual(await cache.aget_or_compute("topics", "hello", {}, compute), [])
+
+    async def test_cached_verdict_is_not_shared(self):
+        cache = VerdictCache()
+        verdict = await cache.aget_or_compute("topics", "hello", {}, AsyncMock(return_value=["fire"]))
+        verdict.append("legal")
+
+        self.assertEqual(await cache.aget_or_compute("topics", "hello", {}, AsyncMock()), ["fire"])
+
+
+if __name__ == "__main__":
+    unittest.main()
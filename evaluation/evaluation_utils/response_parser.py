@@ -1,4 +1,3 @@
-import ast
 import json
 import logging
 
@@ -15,28 +14,16 @@ class Output(BaseModel):
     answer: str
 
 
-def parse_document_string(document_string):
+def parse_documents(documents):
+    """Convert the Documents kept as a ToolMessage artifact by the search tools."""
     document_list = []
     try:
-        # Remove the surrounding brackets and split the string into individual document strings
-        document_string.strip("[]")
-        document_entries = document_string.split("Document(")[1:]
-        for entry in document_entries:
-            entry = "Document(" + entry
-            # Extract metadata and page_content
-            metadata_str = entry.split("metadata=")[1].split(", page_content=")[0].strip()
-            page_content_str = entry.split("page_content=")[1].rsplit(")", 1)[0].strip()
-            # Convert the strings to dictionaries
-            metadata = json.loads(metadata_str)
-            # Value in lanchain response is a string that has to be converted to a dictionary
-            # this required two ast.literal_eval calls
-            page_content = ast.literal_eval(page_content_str)
-            page_content = ast.literal_eval(page_content)
-            # Create Document object and append to list
-            document = {"metadata": metadata, "page_content": page_content}
-            document_list.append(document)
+        for document in documents:
+            document_list.append(
+                {"metadata": document.metadata, "page_content": json.loads(document.page_content)}
+            )
     except Exception as e:
-        logger.exception(f"Error parsing document string: {e}")
+        logger.exception(f"Error parsing documents: {e}")
     return document_list
 
 
@@ -44,12 +31,8 @@ def extract_intermediate_steps(messages):
     document_list = []
     called_tools = []
     for message in messages:
-        if isinstance(message, ToolMessage) and "Document" in message.content:
-            try:
-                document_list_str = message.content
-                document_list = parse_document_string(document_list_str)
-            except Exception as e:
-                logger.exception(f"Failed to parse document: {e}")
+        if isinstance(message, ToolMessage) and message.artifact:
+            document_list = parse_documents(message.artifact)
         if isinstance(message, AIMessage) and hasattr(message, "tool_calls"):
             try:
                 tool_calls = message.tool_calls
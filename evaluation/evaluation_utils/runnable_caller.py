@@ -4,7 +4,6 @@ from typing import List
 
 from app.settings import AppSettings
 from botify_langchain.runnable_factory import RunnableFactory
-from evaluation_utils.formatting_utils import string_to_dict
 from evaluation_utils.response_parser import parse_response
 from langchain_community.callbacks import get_openai_callback
 from langchain_community.chat_message_histories import ChatMessageHistory
@@ -16,11 +15,9 @@ def format_search_result(documents):
     reranker_scores = []
     contexts = []
     for document in documents:
-        page_content = document.page_content
-        page_content = string_to_dict(page_content)
-        scores.append(page_content["@search.score"])
-        # reranker_scores.append(page_content["@search.rerankerScore"])
-        contexts.append(page_content)
+        scores.append(document.metadata["score"])
+        reranker_scores.append(document.metadata["reranker_score"])
+        contexts.append(json.loads(document.page_content))
     response = {"scores": scores, "reranker_scores": reranker_scores, "contexts": contexts}
     return response
 
@@ -67,7 +64,7 @@ class RunnableCaller:
         self.factory = RunnableFactory(app_settings)
 
     def call_search_tool(self, question: str) -> dict:
-        documents = self.factory.azure_ai_search_tool.invoke(question)
+        documents = self.factory.azure_ai_search_tool.get_retriever().invoke(question)
         return format_search_result(documents)
 
     def call_content_safety_tool(self, question: str) -> dict: